@@ -20,7 +20,6 @@ import ctypes
 from signal import signal, SIGINT
 from datetime import datetime
 import re
-import pickle
 import clipboard
 from pynput import keyboard
 if platform.system() == 'Windows':
@@ -30,10 +29,12 @@ if platform.system() == 'Windows':
     import wmi
 import logging
 
-from bin.fileutils import FileUtils, get_drive_list, human_filesize, get_directory_size, get_file_hash, do_delete
+from bin.fileutils import FileUtils, get_drive_list, human_filesize
 from bin.threadmanager import ThreadManager
 from bin.config import Config
 from bin.backup import Backup
+from bin.verification import Verification
+from bin.sizeindex import DirectorySizeIndex
 from bin.repeatedtimer import RepeatedTimer
 from bin.update import UpdateHandler
 from bin.uielements import Color, RootWindow, ModalWindow, StatusBar, WarningPanel, FancyProgressBar, SelectionListCtrl, CopyListPanel, InlineLabel, Counter, DetailBlock, BackupDetailBlock, resource_path
@@ -189,6 +190,12 @@ def display_backup_progress(copied: int, total: int, display_filename: str = Non
             progress_bar_file.SetRange(total)
             cmd_info_blocks[display_index].SetLabel('progress', label=f"Deleted {display_filename}")
             cmd_info_blocks[display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
+        elif operation == Status.FILE_OPERATION_MOVE:
+            progress_bar_master.SetValue(backup.progress['current'])
+            progress_bar_file.SetValue(copied)
+            progress_bar_file.SetRange(total)
+            cmd_info_blocks[display_index].SetLabel('progress', label=f"Moved {display_filename}")
+            cmd_info_blocks[display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
         elif operation == Status.FILE_OPERATION_COPY:
             progress_bar_master.SetValue(backup.progress['current'])
             progress_bar_file.SetValue(copied)
@@ -263,6 +270,23 @@ def display_backup_summary_chunk(title: str, payload: list, reset: bool = None):
     summary_summary_sizer.Layout()
 
 
+def get_bytes_copied_label(progress: dict) -> str:
+    """Get the label for the data copied in a backup.
+
+    Args:
+        progress (dict): The progress of the backup.
+
+    Returns:
+        String: The size of the data copied, and the bytes written to the drives if
+            holes in sparse files were skipped.
+    """
+
+    if progress['bytes_written'] < progress['bytes_copied']:
+        return f"{human_filesize(progress['bytes_copied'])} copied ({human_filesize(progress['bytes_written'])} written)"
+
+    return f"{human_filesize(progress['bytes_copied'])} copied"
+
+
 # QUESTION: Instead of the copy function handling display, can it just set variables, and have the timer handle all the UI stuff?
 def update_backup_eta_timer(progress_info: dict):
     """Update the backup timer to show ETA.
@@ -297,7 +321,7 @@ def update_backup_eta_timer(progress_info: dict):
             # Show infinity symbol if no calculated ETA
             remaining_time = '\u221e'
 
-        backup_eta_label.SetLabel(f'{str(running_time).split(".")[0]} elapsed \u27f6 {str(remaining_time).split(".")[0]} remaining')
+        backup_eta_label.SetLabel(f'{str(running_time).split(".")[0]} elapsed \u27f6 {str(remaining_time).split(".")[0]} remaining \u27f6 {get_bytes_copied_label(progress_info["total"])}')
         backup_eta_label.SetForegroundColour(Color.TEXT_DEFAULT)
         backup_eta_label.Layout()
         summary_sizer.Layout()
@@ -306,8 +330,13 @@ def update_backup_eta_timer(progress_info: dict):
         backup_eta_label.SetForegroundColour(Color.FAILED)
         backup_eta_label.Layout()
         summary_sizer.Layout()
+    elif backup.status == Status.BACKUP_BACKUP_FINISHED and backup.failed_drives:
+        backup_eta_label.SetLabel(f'Backup completed with errors on {", ".join(backup.failed_drives)} in {str(backup.timer.elapsed).split(".")[0]}')
+        backup_eta_label.SetForegroundColour(Color.FAILED)
+        backup_eta_label.Layout()
+        summary_sizer.Layout()
     elif backup.status == Status.BACKUP_BACKUP_FINISHED:
-        backup_eta_label.SetLabel(f'Backup completed successfully in {str(backup.timer.elapsed).split(".")[0]}')
+        backup_eta_label.SetLabel(f'Backup completed successfully in {str(backup.timer.elapsed).split(".")[0]} \u27f6 {get_bytes_copied_label(backup.progress)}')
         backup_eta_label.SetForegroundColour(Color.FINISHED)
         backup_eta_label.Layout()
         summary_sizer.Layout()
@@ -330,6 +359,8 @@ def display_backup_command_info(display_command_list: list) -> list:
         if item['type'] == Backup.COMMAND_TYPE_FILE_LIST:
             if item['mode'] == Status.FILE_OPERATION_DELETE:
                 cmd_header_text = f"Delete {len(item['list'])} files from {item['dest']}"
+            elif item['mode'] == Status.FILE_OPERATION_MOVE:
+                cmd_header_text = f"Move {len(item['list'])} files on {item['dest']}"
             elif item['mode'] == Status.FILE_OPERATION_UPDATE:
                 cmd_header_text = f"Update {len(item['list'])} files on {item['dest']}"
             elif item['mode'] == Status.FILE_OPERATION_COPY:
@@ -425,13 +456,18 @@ def start_backup_analysis():
     status_bar.SetErrorCount(0)
     update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data='')
 
+    # Release the drives held open by the last analysis
+    if backup is not None:
+        backup.close()
+
     backup = Backup(
         config=config,
         backup_config_dir=BACKUP_CONFIG_DIR,
         backup_config_file=BACKUP_CONFIG_FILE,
         analysis_pre_callback_fn=request_update_ui_pre_analysis,
         analysis_callback_fn=request_update_ui_post_analysis,
-        backup_callback_fn=lambda cmd=None: post_event(evt_type=EVT_BACKUP_FINISHED, data=cmd)
+        backup_callback_fn=lambda cmd=None: post_event(evt_type=EVT_BACKUP_FINISHED, data=cmd),
+        size_index=size_index
     )
 
     thread_manager.start(ThreadManager.KILLABLE, target=backup.analyze, name='Backup Analysis', daemon=True)
@@ -452,6 +488,7 @@ def load_source():
 
     # Empty tree in case this is being refreshed
     source_tree.DeleteAllItems()
+    size_index.invalidate()
 
     flags = 0
     if prefs.get('selection', 'source_local_drives', default=True, data_type=Config.BOOLEAN):
@@ -643,7 +680,7 @@ def update_source_size(item: int):
     elif settings_source_mode in [Config.SOURCE_MODE_MULTI_DRIVE, Config.SOURCE_MODE_MULTI_PATH]:
         source_path = source_name
 
-    source_dir_size = get_directory_size(source_path)
+    source_dir_size = size_index.get_size(source_path)
     source_tree.SetItem(item, SOURCE_COL_SIZE, label=human_filesize(source_dir_size))
     source_tree.SetItem(item, SOURCE_COL_RAWSIZE, label=str(source_dir_size))
 
@@ -1366,196 +1403,104 @@ def cleanup_handler(signal_received, frame):
     exit(0)
 
 
-def get_data_verify_killflag():
-    """Get the kill flag for the data verification thread."""
-
-    return thread_manager.threadlist['Data Verification']['killFlag']
-
-
-# TODO: Move file verification to Backup class
 def verify_data_integrity(path_list: list):
     """Verify itegrity of files on destination paths by checking hashes.
 
+    The drives are checked in the background by a Verification, and the results
+    are shown as they come in by update_ui_during_verification().
+
     Args:
         path_list (String[]): A list of mount points for paths to check.
     """
 
+    global verification
     global verification_running
-    global verification_failed_list
 
-    def recurse_for_hash(path: str, drive: str, hash_file_path: str):
-        """Recurse a given path and check hashes.
+    if (backup and backup.running) or verification_running:
+        return
+
+    update_status_bar_action(Status.VERIFICATION_RUNNING)
+    post_event(evt_type=EVT_PROGRESS_MASTER_START_INDETERMINATE)
+    status_bar.SetErrorCount(0)
 
-        Args:
-            path (String): The path to check.
-            drive (String): The mountpoint of the drive.
-            hash_file_path (String): The path to the hash file.
-        """
+    update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data='')
+
+    halt_verification_btn.Enable()
+
+    # Empty file detail lists
+    for list_name in [FileUtils.LIST_SUCCESS, FileUtils.LIST_FAIL]:
+        file_detail_list[list_name].clear()
+
+    # Reset file details counters
+    file_details_pending_delete_counter.value = 0
+    file_details_pending_delete_counter_total.value = 0
+    file_details_pending_copy_counter.value = 0
+    file_details_pending_copy_counter_total.value = 0
+    file_details_pending_sizer.Layout()
+    file_details_success_panel.Clear()
+    file_details_failed_panel.Clear()
+
+    verification_running = True
+    verification = Verification(
+        drives=path_list,
+        backup_config_dir=BACKUP_CONFIG_DIR,
+        verify_all_files=prefs.get('verification', 'verify_all_files', default=False, data_type=Config.BOOLEAN),
+        file_workers=max(1, prefs.get('verification', 'file_workers', default=1, data_type=Config.INTEGER)),
+        scrub_size=int(prefs.get('verification', 'scrub_size_gb', default=0, data_type=Config.FLOAT) * 1024**3),
+        scrub_percent=prefs.get('verification', 'scrub_percent', default=0, data_type=Config.FLOAT),
+        scrub_cycle=prefs.get('verification', 'scrub_cycle_days', default=0, data_type=Config.FLOAT) * 24 * 60 * 60,
+        io_budget=int(prefs.get('verification', 'io_budget_mbps', default=0, data_type=Config.FLOAT) * 1024**2)
+    )
+
+    def run_verification():
+        """Run the verification, and update the UI when it's done."""
 
         try:
-            for entry in os.scandir(path):
-                path_stub = entry.path.split(drive)[1].strip(os.path.sep)
-                if entry.is_file():
-                    # If entry is a file, hash it, and check for a computed hash
-                    update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data=entry.path)
-
-                    file_hash = get_file_hash(entry.path, lambda: thread_manager.threadlist['Data Verification']['killFlag'])
-
-                    if get_data_verify_killflag():
-                        break
-
-                    if path_stub in hash_list[drive].keys():
-                        # Hash saved, so check integrity against saved file
-                        saved_hash = hash_list[drive][path_stub]
-
-                        if file_hash != saved_hash:
-                            # Computed hash different from saved, so delete
-                            # corrupted file
-                            if os.path.isfile(entry.path):
-                                os.remove(entry.path)
-                            elif os.path.isdir(entry.path):
-                                shutil.rmtree(entry.path)
-
-                            # Update UI counter
-                            verification_failed_list.append(entry.path)
-                            status_bar.SetErrorCount(len(verification_failed_list))
-
-                            # Also delete the saved hash
-                            if path_stub in hash_list[drive].keys():
-                                del hash_list[drive][path_stub]
-                            with open(drive_hash_file_path, 'wb') as f:
-                                pickle.dump({'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in hash_list[drive].items()}, f)
-
-                        # Update file detail lists
-                        if file_hash == saved_hash:
-                            update_file_detail_lists(FileUtils.LIST_SUCCESS, {entry.path})
-                        else:
-                            update_file_detail_lists(FileUtils.LIST_FAIL, {entry.path})
-                            backup_error_log.append({'file': entry.path, 'mode': 'copy', 'error': 'File hash mismatch'})
-                    else:
-                        # Hash not saved, so store it
-                        hash_list[drive][path_stub] = file_hash
-                        with open(drive_hash_file_path, 'wb') as f:
-                            pickle.dump({'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in hash_list[drive].items()}, f)
-                elif entry.is_dir() and path_stub not in SPECIAL_IGNORE_LIST:
-                    # If entry is path, recurse into it
-                    recurse_for_hash(entry.path, drive, hash_file_path)
-
-                if thread_manager.threadlist['Data Verification']['killFlag']:
-                    break
-        except Exception:
-            pass
+            verification.run()
+        finally:
+            post_event(evt_type=EVT_VERIFICATION_FINISHED)
 
-    if not backup or not backup.running:
-        update_status_bar_action(Status.VERIFICATION_RUNNING)
-        post_event(evt_type=EVT_PROGRESS_MASTER_START_INDETERMINATE)
-        status_bar.SetErrorCount(0)
+    thread_manager.start(ThreadManager.KILLABLE, callback=verification.kill, target=run_verification, name='Data Verification', daemon=True)
 
-        update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data='')
 
-        halt_verification_btn.Enable()
+def update_ui_during_verification():
+    """Show the results of the running verification that have come in since the last update."""
 
-        # Empty file detail lists
-        for list_name in [FileUtils.LIST_SUCCESS, FileUtils.LIST_FAIL]:
-            file_detail_list[list_name].clear()
+    if not verification:
+        return
 
-        # Reset file details counters
-        file_details_pending_delete_counter.value = 0
-        file_details_pending_delete_counter_total.value = 0
-        file_details_pending_copy_counter.value = 0
-        file_details_pending_copy_counter_total.value = 0
-        file_details_pending_sizer.Layout()
-        file_details_success_panel.Clear()
-        file_details_failed_panel.Clear()
-
-        verification_running = True
-        verification_failed_list = []
-
-        # Get hash list for all drives
-        bad_hash_files = []
-        hash_list = {drive: {} for drive in path_list}
-        for drive in path_list:
-            drive_hash_file_path = os.path.join(drive, BACKUP_CONFIG_DIR, BACKUP_HASH_FILE)
-
-            if os.path.isfile(drive_hash_file_path):
-                write_trimmed_changes = False
-                with open(drive_hash_file_path, 'rb') as f:
-                    try:
-                        drive_hash_list = pickle.load(f)
-                        new_hash_list = {file_name: hash_val for file_name, hash_val in drive_hash_list.items() if file_name.split('/')[0] not in SPECIAL_IGNORE_LIST}
-                        new_hash_list = {os.path.sep.join(file_name.split('/')): hash_val for file_name, hash_val in new_hash_list.items() if os.path.isfile(os.path.join(drive, file_name))}
-
-                        # If trimmed list is shorter, new changes have to be written to the file
-                        if len(new_hash_list) < len(drive_hash_list):
-                            write_trimmed_changes = True
-
-                        hash_list[drive] = new_hash_list
-                    except Exception:
-                        # Hash file is corrupt
-                        bad_hash_files.append(drive_hash_file_path)
-
-                # If trimmed list is different length than original, write changes to file
-                if write_trimmed_changes:
-                    with open(drive_hash_file_path, 'wb') as f:
-                        pickle.dump({'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in hash_list[drive].items()}, f)
-            else:
-                bad_hash_files.append(drive_hash_file_path)
-
-        # If there are missing or corrupted pickle files, write empty data
-        if bad_hash_files:
-            for file in bad_hash_files:
-                with open(file, 'wb') as f:
-                    pickle.dump({}, f)
-
-        verify_all_files = prefs.get('verification', 'verify_all_files', default=False, data_type=Config.BOOLEAN)
-        if verify_all_files:
-            for drive in path_list:
-                drive_hash_file_path = os.path.join(drive, BACKUP_CONFIG_DIR, BACKUP_HASH_FILE)
-                recurse_for_hash(drive, drive, drive_hash_file_path)
-        else:
-            for drive in path_list:
-                drive_hash_file_path = os.path.join(drive, BACKUP_CONFIG_DIR, BACKUP_HASH_FILE)
-                for file, saved_hash in hash_list[drive].items():
-                    filename = os.path.join(drive, file)
-                    update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data=filename)
-                    computed_hash = get_file_hash(filename, get_backup_killflag)
-
-                    if thread_manager.threadlist['Data Verification']['killFlag']:
-                        break
-
-                    # If file has hash mismatch, delete the corrupted file
-                    if saved_hash != computed_hash:
-                        do_delete(filename)
-
-                        # Update UI counter
-                        verification_failed_list.append(filename)
-                        status_bar.SetErrorCount(len(verification_failed_list))
-
-                        # Delete the saved hash, and write changes to the hash file
-                        if file in hash_list[drive].keys():
-                            del hash_list[drive][file]
-                        with open(drive_hash_file_path, 'wb') as f:
-                            pickle.dump({'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in hash_list[drive].items()}, f)
-
-                    # Update file detail lists
-                    if saved_hash == computed_hash:
-                        update_file_detail_lists(FileUtils.LIST_SUCCESS, {filename})
-                    else:
-                        update_file_detail_lists(FileUtils.LIST_FAIL, {filename})
-                        backup_error_log.append({'file': filename, 'mode': 'copy', 'error': 'File hash mismatch'})
+    results = verification.get_results()
 
-                    if thread_manager.threadlist['Data Verification']['killFlag']:
-                        break
+    file_lists = {}
+    for file_list, filename, error in results:
+        file_lists.setdefault(file_list, set()).add(filename)
 
-                if thread_manager.threadlist['Data Verification']['killFlag']:
-                    break
+        if error is not None:
+            backup_error_log.append({'file': filename, 'mode': 'copy', 'error': error})
 
-        verification_running = False
-        halt_verification_btn.Disable()
+    for file_list, filenames in file_lists.items():
+        update_file_detail_lists(file_list, filenames)
 
-        post_event(evt_type=EVT_PROGRESS_MASTER_STOP_INDETERMINATE)
-        update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data='')
-        update_status_bar_action(Status.IDLE)
+    if file_lists.get(FileUtils.LIST_FAIL):
+        status_bar.SetErrorCount(len(verification.failed_list))
+
+    if verification.running:
+        update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data=verification.current_file if verification.current_file is not None else '')
+
+
+def update_ui_post_verification():
+    """Show the last results of a verification, and reset the UI once it's finished."""
+
+    global verification_running
+
+    update_ui_during_verification()
+
+    verification_running = False
+    halt_verification_btn.Disable()
+
+    post_event(evt_type=EVT_PROGRESS_MASTER_STOP_INDETERMINATE)
+    update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, data='')
+    update_status_bar_action(Status.IDLE)
 
 
 def show_update_window(update_info: dict):
@@ -1784,24 +1729,17 @@ if __name__ == '__main__':
     prev_selection = 0
     prev_dest_selection = []
     force_non_graceful_cleanup = False
+    verification = None
     verification_running = False
-    verification_failed_list = []
     update_window = None
 
     # Set app defaults
     BACKUP_CONFIG_DIR = '.backdrop'  # TODO: Should these backup constants be moved to the Backup class?
     BACKUP_CONFIG_FILE = 'backup.ini'
-    BACKUP_HASH_FILE = 'hashes.pkl'
     PREFERENCES_CONFIG_FILE = 'preferences.ini'
     PORTABLE_PREFERENCES_CONFIG_FILE = 'backdrop.ini'
     WINDOW_ELEMENT_PADDING = 16
 
-    # TODO: Move SPECIAL_IGNORE_LIST and verification to Backup class
-    #     NOTE: This already exists in the Backup class, but the local reference
-    #     is used by the data verification functions. Once those get moved to
-    #     the Backup class, this can be removedq
-    SPECIAL_IGNORE_LIST = [BACKUP_CONFIG_DIR, '$RECYCLE.BIN', 'System Volume Information']
-
     PORTABLE_CONFIG_FILE_PATH = os.path.join(os.getcwd(), PORTABLE_PREFERENCES_CONFIG_FILE)
 
     PORTABLE_MODE = os.path.isfile(PORTABLE_CONFIG_FILE_PATH)
@@ -1822,7 +1760,22 @@ if __name__ == '__main__':
         'sources': [],
         'destinations': [],
         'missing_drives': {},
-        'allow_prereleases': prefs.get('ui', 'allow_prereleases', default=False, data_type=Config.BOOLEAN)
+        'allow_prereleases': prefs.get('ui', 'allow_prereleases', default=False, data_type=Config.BOOLEAN),
+        'max_drive_workers': max(1, prefs.get('backup', 'max_drive_workers', default=1, data_type=Config.INTEGER)),
+        'copy_strategy': prefs.get('backup', 'copy_strategy', default=FileUtils.COPY_STRATEGY, verify_data=FileUtils.COPY_STRATEGY_OPTIONS),
+        'mtime_hash_check': prefs.get('backup', 'mtime_hash_check', default=False, data_type=Config.BOOLEAN),
+        'source_snapshot': prefs.get('backup', 'source_snapshot', default=False, data_type=Config.BOOLEAN),
+        'manifest_verify': prefs.get('backup', 'manifest_verify', default=False, data_type=Config.BOOLEAN),
+        'detect_moves': prefs.get('backup', 'detect_moves', default=True, data_type=Config.BOOLEAN),
+        'delta_update': prefs.get('backup', 'delta_update', default=True, data_type=Config.BOOLEAN),
+        'chunk_hashes': prefs.get('backup', 'chunk_hashes', default=True, data_type=Config.BOOLEAN),
+        'cache_hints': prefs.get('backup', 'cache_hints', default=False, data_type=Config.BOOLEAN),
+        'dedup': prefs.get('backup', 'dedup', default=False, data_type=Config.BOOLEAN),
+        'source_hash_cache': prefs.get('backup', 'source_hash_cache', default=False, data_type=Config.BOOLEAN),
+        'change_journal': prefs.get('backup', 'change_journal', default=False, data_type=Config.BOOLEAN),
+        'snapshot_dir': os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'snapshots'),
+        'source_hash_file': os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'source_hashes.db'),
+        'journal_dir': os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'journals')
     }
     dest_drive_master_list = []
 
@@ -1834,6 +1787,9 @@ if __name__ == '__main__':
 
     thread_manager = ThreadManager()
 
+    # Directory sizes are shared between source selection, destination browsing, and analysis
+    size_index = DirectorySizeIndex()
+
     keypresses = {
         'AltL': False,
         'AltR': False,
@@ -2221,8 +2177,8 @@ if __name__ == '__main__':
             # Custom dest isn't stored in preferences, so default to
             # dir name
             drive_free_space = shutil.disk_usage(dir_name).free
-            path_space = get_directory_size(dir_name)
-            config_space = get_directory_size(os.path.join(dir_name, BACKUP_CONFIG_DIR))
+            path_space = size_index.get_size(dir_name)
+            config_space = size_index.get_size(os.path.join(dir_name, BACKUP_CONFIG_DIR))
 
             dir_has_config_file = os.path.isfile(os.path.join(dir_name, BACKUP_CONFIG_DIR, BACKUP_CONFIG_FILE))
             name_stub = dir_name.strip(os.path.sep).split(os.path.sep)[-1].strip()
@@ -2607,6 +2563,9 @@ if __name__ == '__main__':
         
         post_event(evt_type=EVT_BACKUP_TIMER)
 
+        if verification_running:
+            post_event(evt_type=EVT_VERIFICATION_TIMER)
+
     PREV_BACKUP_UI_STATUS = None
 
     def update_ui_during_backup():
@@ -2671,43 +2630,42 @@ if __name__ == '__main__':
             filename, display_index = (None, None)
 
         # Update backup status for each command info block
-        if backup_progress['total']['command_display_index'] is not None:
-            cmd_info_blocks[backup_progress['total']['command_display_index']].state.SetLabel(label='Running')
-            cmd_info_blocks[backup_progress['total']['command_display_index']].state.SetForegroundColour(Color.RUNNING)
-            backup.progress['command_display_index'] = None
+        for command_display_index in backup_progress['delta']['commands']:
+            cmd_info_blocks[command_display_index].state.SetLabel(label='Running')
+            cmd_info_blocks[command_display_index].state.SetForegroundColour(Color.RUNNING)
 
         # Update status bar
         update_ui_component(Status.UPDATEUI_CURRENT_FILE_DETAILS, filename if filename is not None else '')
 
-        # Update copied files
-        buffer = backup_progress['total']['buffer']
+        # Update master progress bar
+        if display_index is not None:
+            progress_bar_master.SetRange(backup.progress['total'])
+            progress_bar_master.SetValue(backup.progress['current'])
 
-        if buffer['copied'] > buffer['total']:
-            buffer['copied'] = buffer['total']
+        # Update copied files for each drive, showing the most recent file on the file progress bar
+        for buffer in list(backup_progress['total']['buffers'].values()):
+            if buffer['display_index'] is None or buffer['display_index'] not in cmd_info_blocks:
+                continue
 
-        if buffer['total'] > 0:
-            percent_copied = buffer['copied'] / buffer['total'] * 100
-        else:
-            percent_copied = 100
+            copied = min(buffer['copied'], buffer['total'])
 
-        # If display index has been specified, write progress to GUI
-        if display_index is not None and buffer['display_index'] is not None:
-            total_progress_with_buffer = backup.progress['current']
-            if buffer['operation'] == Status.FILE_OPERATION_VERIFY:
-                total_progress_with_buffer += buffer['total']
+            if buffer['total'] > 0:
+                percent_copied = copied / buffer['total'] * 100
+            else:
+                percent_copied = 100
 
-            progress_bar_master.SetRange(backup.progress['total'])
-            progress_bar_master.SetValue(total_progress_with_buffer)
-            progress_bar_file.SetValue(buffer['copied'])
-            progress_bar_file.SetRange(buffer['total'])
+            if buffer is backup_progress['total']['buffer']:
+                progress_bar_file.SetValue(copied)
+                progress_bar_file.SetRange(buffer['total'])
 
-            # Change file progress bar to blue during verification
-            if buffer['operation'] == Status.FILE_OPERATION_VERIFY:
-                progress_bar_file.SetForegroundColour(Color.BLUE)
-            else:
-                progress_bar_file.SetForegroundColour(Color.BRAND_COLOR)
+                # Change file progress bar to blue during verification
+                if buffer['operation'] == Status.FILE_OPERATION_VERIFY:
+                    progress_bar_file.SetForegroundColour(Color.BLUE)
+                else:
+                    progress_bar_file.SetForegroundColour(Color.BRAND_COLOR)
 
             filename = buffer['display_filename']
+            buffer_display_index = buffer['display_index']
 
             dc = wx.ScreenDC()
 
@@ -2725,17 +2683,17 @@ if __name__ == '__main__':
                     actual_file_width = dc.GetTextExtent(f'{filename}...').GetWidth()
                 filename = f'{filename}...'
 
-            cmd_info_blocks[display_index].SetLabel('current_file', label=filename)
-            cmd_info_blocks[display_index].SetForegroundColour('current_file', Color.TEXT_DEFAULT)
+            cmd_info_blocks[buffer_display_index].SetLabel('current_file', label=filename)
+            cmd_info_blocks[buffer_display_index].SetForegroundColour('current_file', Color.TEXT_DEFAULT)
             if buffer['operation'] == Status.FILE_OPERATION_DELETE:
-                cmd_info_blocks[display_index].SetLabel('progress', label=f"Deleted {filename}")
-                cmd_info_blocks[display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
+                cmd_info_blocks[buffer_display_index].SetLabel('progress', label=f"Deleted {filename}")
+                cmd_info_blocks[buffer_display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
             elif buffer['operation'] == Status.FILE_OPERATION_COPY:
-                cmd_info_blocks[display_index].SetLabel('progress', label=f"{percent_copied:.2f}% \u27f6 {human_filesize(buffer['copied'])} of {human_filesize(buffer['total'])}")
-                cmd_info_blocks[display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
+                cmd_info_blocks[buffer_display_index].SetLabel('progress', label=f"{percent_copied:.2f}% \u27f6 {human_filesize(copied)} of {human_filesize(buffer['total'])}")
+                cmd_info_blocks[buffer_display_index].SetForegroundColour('progress', Color.TEXT_DEFAULT)
             elif buffer['operation'] == Status.FILE_OPERATION_VERIFY:
-                cmd_info_blocks[display_index].SetLabel('progress', label=f"Verifying \u27f6 {percent_copied:.2f}% \u27f6 {human_filesize(buffer['copied'])} of {human_filesize(buffer['total'])}")
-                cmd_info_blocks[display_index].SetForegroundColour('progress', Color.BLUE)
+                cmd_info_blocks[buffer_display_index].SetLabel('progress', label=f"Verifying \u27f6 {percent_copied:.2f}% \u27f6 {human_filesize(copied)} of {human_filesize(buffer['total'])}")
+                cmd_info_blocks[buffer_display_index].SetForegroundColour('progress', Color.BLUE)
 
         # Update file detail lists on deletes and copies
         delta_file_lists = {
@@ -2748,6 +2706,19 @@ if __name__ == '__main__':
             filename, filesize, operation, display_index = file['file']
 
             if operation == Status.FILE_OPERATION_COPY:
+                if file['success']:
+                    delta_file_lists[FileUtils.LIST_SUCCESS].add(filename)
+                else:
+                    delta_file_lists[FileUtils.LIST_FAIL].add(filename)
+            elif operation == Status.FILE_OPERATION_MOVE:
+                display_backup_progress(
+                    copied=filesize,
+                    total=filesize,
+                    display_filename=filename.split(os.path.sep)[-1],
+                    operation=operation,
+                    display_index=display_index
+                )
+
                 if file['success']:
                     delta_file_lists[FileUtils.LIST_SUCCESS].add(filename)
                 else:
@@ -2783,7 +2754,12 @@ if __name__ == '__main__':
 
         if command is not None:
             display_index = command['displayIndex']
-            if backup.status == Status.BACKUP_BACKUP_ABORTED and backup.progress['current'] < backup.progress['total']:
+            if command['dest'] in backup.failed_drives:
+                cmd_info_blocks[display_index].state.SetLabel(label='Failed')
+                cmd_info_blocks[display_index].state.SetForegroundColour(Color.FAILED)
+                cmd_info_blocks[display_index].SetLabel('progress', label='Failed')
+                cmd_info_blocks[display_index].SetForegroundColour('progress', Color.FAILED)
+            elif backup.status == Status.BACKUP_BACKUP_ABORTED and backup.progress['current'] < backup.progress['total']:
                 cmd_info_blocks[display_index].state.SetLabel(label='Aborted')
                 cmd_info_blocks[display_index].state.SetForegroundColour(Color.STOPPED)
                 cmd_info_blocks[display_index].SetLabel('progress', label='Aborted')
@@ -2799,7 +2775,7 @@ if __name__ == '__main__':
             update_ui_component(Status.UPDATEUI_BACKUP_END)
 
         # If backup complete, play success tone
-        if backup.status == Status.BACKUP_BACKUP_FINISHED:
+        if backup.status == Status.BACKUP_BACKUP_FINISHED and not backup.failed_drives:
             success_sound.Play()
 
     # FIXME: can a function like this be generalized to set a setting and preferences?
@@ -3607,6 +3583,8 @@ if __name__ == '__main__':
     EVT_BACKUP_FINISHED = wx.NewEventType()
     EVT_CHECK_FOR_UPDATES = wx.NewEventType()
     EVT_VERIFY_DATA_INTEGRITY = wx.NewEventType()
+    EVT_VERIFICATION_TIMER = wx.NewEventType()
+    EVT_VERIFICATION_FINISHED = wx.NewEventType()
     EVT_PROGRESS_MASTER_START_INDETERMINATE = wx.NewEventType()
     EVT_PROGRESS_MASTER_STOP_INDETERMINATE = wx.NewEventType()
     main_frame.Connect(-1, -1, EVT_REQUEST_LOAD_SOURCE, lambda e: source_tree.load())
@@ -3626,6 +3604,8 @@ if __name__ == '__main__':
     main_frame.Connect(-1, -1, EVT_BACKUP_FINISHED, lambda e: update_ui_post_backup(e.data))
     main_frame.Connect(-1, -1, EVT_CHECK_FOR_UPDATES, lambda e: show_update_window(e.data))
     main_frame.Connect(-1, -1, EVT_VERIFY_DATA_INTEGRITY, lambda e: verify_data_integrity(e.data))
+    main_frame.Connect(-1, -1, EVT_VERIFICATION_TIMER, lambda e: update_ui_during_verification())
+    main_frame.Connect(-1, -1, EVT_VERIFICATION_FINISHED, lambda e: update_ui_post_verification())
     main_frame.Connect(-1, -1, EVT_PROGRESS_MASTER_START_INDETERMINATE, lambda e: progress_bar_master.StartIndeterminate())
     main_frame.Connect(-1, -1, EVT_PROGRESS_MASTER_STOP_INDETERMINATE, lambda e: progress_bar_master.StopIndeterminate())
 
@@ -0,0 +1,123 @@
+"""Benchmark copy_file() throughput between two locations.
+
+Run from the repository root, pointing the source and destination at the drives
+to compare, for example an HDD source with a USB destination, or two SSDs:
+
+    python -m benchmarks.copy_file --source /mnt/hdd/bench --dest /media/usb/bench
+
+Test files are created in the source directory, and removed when the benchmark
+finishes. For results that reflect the disks rather than the page cache, use
+files larger than the available RAM, or pass --drop-caches when running as root
+on Linux.
+"""
+
+import argparse
+import os
+import platform
+import time
+
+from bin.fileutils import FileUtils, copy_file, human_filesize
+
+MODES = {
+    'serial': {'COPY_STRATEGY': FileUtils.COPY_STRATEGY_BUFFERED, 'PIPELINE_BUFFER_COUNT': 1},
+    'pipelined': {'COPY_STRATEGY': FileUtils.COPY_STRATEGY_BUFFERED, 'PIPELINE_BUFFER_COUNT': 3},
+    'kernel': {'COPY_STRATEGY': FileUtils.COPY_STRATEGY_KERNEL, 'PIPELINE_BUFFER_COUNT': 3}
+}
+
+
+def drop_caches():
+    """Flush dirty pages and drop the page cache, if possible."""
+
+    os.sync()
+    if platform.system() == 'Linux':
+        try:
+            with open('/proc/sys/vm/drop_caches', 'w') as f:
+                f.write('3')
+        except PermissionError:
+            print('Insufficient permissions to drop caches')
+
+
+def run_mode(mode: str, source_files: list, dest_dir: str, should_drop_caches: bool) -> tuple:
+    """Copy a list of files with a given mode, and time it.
+
+    Args:
+        mode (String): The name of the mode in MODES to benchmark.
+        source_files (String[]): The files to copy.
+        dest_dir (String): The directory to copy to.
+        should_drop_caches (bool): Whether to drop caches before copying.
+
+    Returns:
+        tuple:
+            float: The wall time in seconds the copy took.
+            float: The CPU time in seconds used by the copy.
+    """
+
+    for setting, value in MODES[mode].items():
+        setattr(FileUtils, setting, value)
+
+    if should_drop_caches:
+        drop_caches()
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for filename in source_files:
+        dest_filename = os.path.join(dest_dir, os.path.basename(filename))
+        copy_file(
+            source_filename=filename,
+            dest_filename=dest_filename,
+            drive_path=dest_dir,
+            pre_callback=lambda: None,
+            prog_callback=lambda c, t, op: None,
+            fd_callback=lambda status, file: None,
+            get_backup_killflag=lambda: False
+        )
+    os.sync()
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    for filename in source_files:
+        os.remove(os.path.join(dest_dir, os.path.basename(filename)))
+
+    return (elapsed, cpu_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark copy_file() modes between two directories.')
+    parser.add_argument('--source', required=True, help='The directory to create the test files in')
+    parser.add_argument('--dest', required=True, help='The directory to copy the test files to')
+    parser.add_argument('--size', type=int, default=1024, help='The size of each test file in MiB (default: 1024)')
+    parser.add_argument('--count', type=int, default=4, help='The number of test files (default: 4)')
+    parser.add_argument('--runs', type=int, default=3, help='The number of runs for each mode (default: 3)')
+    parser.add_argument('--modes', nargs='+', default=list(MODES.keys()), choices=list(MODES.keys()))
+    parser.add_argument('--drop-caches', action='store_true', help='Drop the page cache before each run')
+    args = parser.parse_args()
+
+    os.makedirs(args.source, exist_ok=True)
+    os.makedirs(args.dest, exist_ok=True)
+
+    source_files = []
+    chunk = os.urandom(FileUtils.READINTO_BUFSIZE)
+    for i in range(args.count):
+        filename = os.path.join(args.source, f'backdrop_bench_{i}.bin')
+        with open(filename, 'wb') as f:
+            for n in range(args.size * 1024 * 1024 // len(chunk)):
+                f.write(chunk)
+        source_files.append(filename)
+
+    total_size = sum(os.path.getsize(filename) for filename in source_files)
+    print(f'Copying {args.count} x {human_filesize(total_size // args.count)} from {args.source} to {args.dest}')
+
+    try:
+        for mode in args.modes:
+            results = [run_mode(mode, source_files, args.dest, args.drop_caches) for run in range(args.runs)]
+            times = [elapsed for elapsed, cpu_time in results]
+            best = min(times)
+            cpu_per_gib = min(cpu_time for elapsed, cpu_time in results) / (total_size / 1024 ** 3)
+            print(f'{mode:>12}: best {best:.2f}s, mean {sum(times) / len(times):.2f}s, {human_filesize(total_size / best)}/s, {cpu_per_gib:.2f}s CPU/GiB')
+    finally:
+        for filename in source_files:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark hash_file() against single threaded streaming BLAKE3.
+
+Run from the repository root:
+
+    python -m benchmarks.hashing --sizes 1 16 256 1024 --runs 3
+
+Each size is in MiB. A random file of each size is written to a temporary
+folder, and hashed once to load it into the page cache, so that the results
+measure hashing rather than the drive. Pass --dir to put the files on a
+particular drive instead.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from blake3 import blake3
+
+from bin.fileutils import FileUtils, hash_file, new_file_hash
+
+
+def hash_streaming(filename) -> str:
+    """Hash a file the way get_file_hash() used to, for comparison.
+
+    Args:
+        filename (String): The file to hash.
+
+    Returns:
+        String: The hash of the file.
+    """
+
+    h = blake3()
+    mv = memoryview(bytearray(FileUtils.READINTO_BUFSIZE))
+
+    with open(filename, 'rb', buffering=0) as f:
+        for n in iter(lambda: f.readinto(mv), 0):
+            h.update(mv[:n])
+
+    return h.hexdigest()
+
+
+def hash_backend(filename) -> str:
+    """Hash a file with hash_file(), the way get_file_hash() does now.
+
+    Args:
+        filename (String): The file to hash.
+
+    Returns:
+        String: The hash of the file.
+    """
+
+    h = new_file_hash(os.path.getsize(filename))
+    hash_file(filename, h)
+
+    return h.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark file hashing methods.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 256, 1024], help='The file sizes to hash in MiB')
+    parser.add_argument('--runs', type=int, default=3, help='The number of runs for each file size (default: 3)')
+    parser.add_argument('--dir', default=None, help='The folder to write test files to (default: a temporary folder)')
+    args = parser.parse_args()
+
+    methods = {
+        'streaming': hash_streaming,
+        'hash_file': hash_backend
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as temp_dir:
+        for size in args.sizes:
+            filename = os.path.join(temp_dir, f'{size}.bin')
+            with open(filename, 'wb') as f:
+                for i in range(size):
+                    f.write(os.urandom(1024 * 1024))
+
+            # Warm the page cache, and make sure the methods agree
+            hashes = {method: hash_fn(filename) for method, hash_fn in methods.items()}
+            if len(set(hashes.values())) != 1:
+                raise RuntimeError(f'Hash methods disagree for {size} MiB file: {hashes}')
+
+            print(f'{size} MiB:')
+            for method, hash_fn in methods.items():
+                times = []
+                for run in range(args.runs):
+                    start = time.perf_counter()
+                    hash_fn(filename)
+                    times.append(time.perf_counter() - start)
+
+                print(f'{method:>10}: best {size / min(times):.1f} MiB/s, mean {size * args.runs / sum(times):.1f} MiB/s')
+
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark pack_subset() against the old chunked combinations search.
+
+Run from the repository root:
+
+    python -m benchmarks.packing --items 20 100 1000 --runs 5
+
+Each run generates a random set of sources with sizes spread over a few orders
+of magnitude, and a drive whose capacity is a fraction of their total, then
+reports how much of the drive each method fills, and how long it takes.
+"""
+
+import argparse
+import itertools
+import math
+import random
+import time
+
+from bin.packing import pack_subset
+
+
+def pack_combinations(items: dict, capacity: int, chunk_size: int = 15) -> set:
+    """Pack items the way Backup.analyze used to, for comparison.
+
+    Items are split into chunks, and every combination within each chunk is
+    checked, keeping the best combination from each chunk in turn.
+
+    Args:
+        items (dict): The items to pack, with their sizes.
+        capacity (int): The space available to pack into.
+        chunk_size (int): The number of items to search at once (default: 15).
+
+    Returns:
+        set: The names of the items chosen.
+    """
+
+    small_items = [(name, size) for name, size in items.items() if size <= capacity]
+    chosen = set()
+    free = capacity
+
+    for chunk in range(math.ceil(len(small_items) / chunk_size)):
+        chunk_items = small_items[chunk * chunk_size:(chunk + 1) * chunk_size]
+        best_combination = ()
+        best_total = 0
+        for n in range(1, len(chunk_items) + 1):
+            for combination in itertools.combinations(chunk_items, n):
+                total = sum(size for name, size in combination)
+                if best_total < total <= free:
+                    best_total = total
+                    best_combination = combination
+
+        chosen.update(name for name, size in best_combination)
+        free -= best_total
+
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark drive packing methods.')
+    parser.add_argument('--items', type=int, nargs='+', default=[15, 30, 100, 1000], help='The numbers of items to pack')
+    parser.add_argument('--runs', type=int, default=5, help='The number of runs for each item count (default: 5)')
+    parser.add_argument('--fill', type=float, default=0.6, help='The drive capacity as a fraction of the total item size (default: 0.6)')
+    parser.add_argument('--time-budget', type=float, default=5, help='The time budget for pack_subset in seconds (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed (default: 0)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    methods = {
+        'combinations': lambda items, capacity: pack_combinations(items, capacity),
+        'pack_subset': lambda items, capacity: pack_subset(items, capacity, time_budget=args.time_budget)
+    }
+
+    for item_count in args.items:
+        results = {method: {'fill': [], 'time': []} for method in methods}
+        for run in range(args.runs):
+            items = {f'source_{i}': int(10 ** rng.uniform(6, 11)) for i in range(item_count)}
+            capacity = int(sum(items.values()) * args.fill)
+
+            for method, pack in methods.items():
+                start = time.perf_counter()
+                chosen = pack(items, capacity)
+                results[method]['time'].append(time.perf_counter() - start)
+                results[method]['fill'].append(sum(items[name] for name in chosen) / capacity)
+
+        print(f'{item_count} items:')
+        for method, result in results.items():
+            print(f"{method:>14}: mean fill {sum(result['fill']) / args.runs:.6f}, worst fill {min(result['fill']):.6f}, mean {sum(result['time']) / args.runs:.3f}s, max {max(result['time']):.3f}s")
+
+
+if __name__ == '__main__':
+    main()
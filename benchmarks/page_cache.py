@@ -0,0 +1,156 @@
+"""Measure how much of a copy copy_file() leaves in the page cache, with and without cache hints.
+
+Run from the repository root on Linux:
+
+    python -m benchmarks.page_cache --source /mnt/hdd/bench --dest /media/usb/bench
+
+Test files are created in the source directory, and removed when the benchmark
+finishes. After each run, the share of the source and destination pages still
+in the page cache is read with mincore(), along with how much of the first file
+was in the cache after prefetch_file() before it was copied. With cache hints
+on, the copied files should be almost entirely out of the cache, and the
+prefetched file should be in it.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import mmap
+import os
+import time
+
+from bin.fileutils import FileUtils, copy_file, drop_file_cache, prefetch_file, human_filesize
+
+
+def get_cached_fraction(filename) -> float:
+    """Get the fraction of a file's pages that are in the page cache.
+
+    Args:
+        filename (String): The file to check.
+
+    Returns:
+        float: The fraction of pages in the cache, from 0 to 1.
+    """
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    page_size = mmap.PAGESIZE
+
+    with open(filename, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            return 0
+
+        # A private mapping is writable as far as ctypes is concerned, but maps the
+        # same cached pages as the file until something writes to it
+        with mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_COPY) as file_map:
+            page_count = (file_size + page_size - 1) // page_size
+            vec = (ctypes.c_ubyte * page_count)()
+            address = ctypes.addressof(ctypes.c_char.from_buffer(file_map))
+
+            if libc.mincore(ctypes.c_void_p(address), ctypes.c_size_t(file_size), vec) != 0:
+                raise OSError(ctypes.get_errno(), 'mincore failed')
+
+    return sum(page & 1 for page in vec) / page_count
+
+
+def run(source_files: list, dest_dir: str, cache_hints: bool) -> dict:
+    """Copy a list of files, and measure what's left in the page cache.
+
+    Args:
+        source_files (String[]): The files to copy.
+        dest_dir (String): The directory to copy to.
+        cache_hints (bool): Whether to copy with cache hints.
+
+    Returns:
+        dict: The results of the run.
+            time (float): The wall time in seconds the copy took.
+            source (float): The fraction of the sources left in the cache.
+            dest (float): The fraction of the destinations left in the cache.
+            prefetched (float): The fraction of the first file in the cache after
+                prefetching it, or None if cache hints are off.
+    """
+
+    # Start with the sources out of the cache, as if they were read from a cold drive
+    for filename in source_files:
+        with open(filename, 'rb') as f:
+            drop_file_cache(f.fileno(), sync=False)
+
+    prefetched = None
+    if cache_hints:
+        prefetch_file(source_files[0])
+        time.sleep(0.5)
+        prefetched = get_cached_fraction(source_files[0]) / min(1, FileUtils.PREFETCH_SIZE / os.path.getsize(source_files[0]))
+
+    dest_files = []
+    start = time.perf_counter()
+    for i, filename in enumerate(source_files):
+        if cache_hints and i + 1 < len(source_files):
+            prefetch_file(source_files[i + 1])
+
+        dest_filename = os.path.join(dest_dir, os.path.basename(filename))
+        copy_file(
+            source_filename=filename,
+            dest_filename=dest_filename,
+            drive_path=dest_dir,
+            pre_callback=lambda: None,
+            prog_callback=lambda c, t, op: None,
+            fd_callback=lambda status, file: None,
+            get_backup_killflag=lambda: False,
+            cache_hints=cache_hints
+        )
+        dest_files.append(dest_filename)
+    elapsed = time.perf_counter() - start
+
+    total_size = sum(os.path.getsize(filename) for filename in source_files)
+    results = {
+        'time': elapsed,
+        'source': sum(get_cached_fraction(filename) * os.path.getsize(filename) for filename in source_files) / total_size,
+        'dest': sum(get_cached_fraction(filename) * os.path.getsize(filename) for filename in dest_files) / total_size,
+        'prefetched': prefetched
+    }
+
+    for filename in dest_files:
+        os.remove(filename)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure page cache use of copy_file() with and without cache hints.')
+    parser.add_argument('--source', required=True, help='The directory to create the test files in')
+    parser.add_argument('--dest', required=True, help='The directory to copy the test files to')
+    parser.add_argument('--size', type=int, default=256, help='The size of each test file in MiB (default: 256)')
+    parser.add_argument('--count', type=int, default=4, help='The number of test files (default: 4)')
+    parser.add_argument('--verify-bypass-cache', action='store_true', help='Verify copies from the drive even without cache hints')
+    args = parser.parse_args()
+
+    FileUtils.VERIFY_BYPASS_CACHE = args.verify_bypass_cache
+
+    os.makedirs(args.source, exist_ok=True)
+    os.makedirs(args.dest, exist_ok=True)
+
+    source_files = []
+    chunk = os.urandom(FileUtils.READINTO_BUFSIZE)
+    for i in range(args.count):
+        filename = os.path.join(args.source, f'backdrop_bench_{i}.bin')
+        with open(filename, 'wb') as f:
+            for n in range(args.size * 1024 * 1024 // len(chunk)):
+                f.write(chunk)
+        source_files.append(filename)
+
+    total_size = sum(os.path.getsize(filename) for filename in source_files)
+    print(f'Copying {args.count} x {human_filesize(total_size // args.count)} from {args.source} to {args.dest}')
+
+    try:
+        for cache_hints in [False, True]:
+            results = run(source_files, args.dest, cache_hints)
+            prefetched = f", {results['prefetched'] * 100:.0f}% of prefetch in cache" if results['prefetched'] is not None else ''
+            print(f"{'hints' if cache_hints else 'no hints':>9}: {results['time']:.2f}s, {human_filesize(total_size / results['time'])}/s, "
+                  f"{results['source'] * 100:.0f}% of source and {results['dest'] * 100:.0f}% of destination left in cache{prefetched}")
+    finally:
+        for filename in source_files:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
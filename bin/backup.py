@@ -1,13 +1,20 @@
 import os
-import itertools
 from datetime import datetime
 import shutil
-import pickle
 import logging
-import math
 import time
-
-from bin.fileutils import FileUtils, human_filesize, get_directory_size, do_delete, do_copy
+import threading
+from blake3 import blake3
+from concurrent.futures import ThreadPoolExecutor
+
+from bin.fileutils import FileUtils, human_filesize, do_delete, do_copy, copy_small_files, delta_update_file, get_file_hash, get_mtime_tolerance, prefetch_file, link_file, clone_file, is_hardlinked
+from bin.hashstore import HashStore
+from bin.manifest import DriveManifest
+from bin.sizeindex import DirectorySizeIndex
+from bin.snapshot import SourceSnapshot
+from bin.changejournal import ChangeJournal, get_journal_filename
+from bin.sourcehashes import SourceHashCache
+from bin.packing import pack_subset
 from bin.utils import Timer
 from bin.config import Config
 from bin.status import Status
@@ -22,9 +29,12 @@ class Backup:
     COMMAND_TYPE_FILE_LIST = 'file_list'
     COMMAND_FILE_LIST = 'file_list'
 
+    # Maximum time in seconds to spend searching for the best way to pack a drive
+    PACKING_TIME_BUDGET = 5
+
     def __init__(self, config: dict, backup_config_dir, backup_config_file,
                  analysis_pre_callback_fn, analysis_callback_fn,
-                 backup_callback_fn):
+                 backup_callback_fn, size_index: DirectorySizeIndex = None):
         """Configure a backup to be run on a set of drives.
 
         Args:
@@ -34,29 +44,35 @@ class Backup:
             analysis_pre_callback_fn (def): The callback function to call before analysis.
             analysis_callback_fn (def): The callback function to call post analysis.
             backup_callback_fn (def): The callback function to call post backup.
+            size_index (DirectorySizeIndex): The directory size index to share with the UI (optional).
         """
 
         self.timer = Timer()
 
         self.progress = {
             'analysis': [],  # (list, file path)
-            'buffer': {
+            'buffer': {  # The most recently updated copy buffer
                 'copied': 0,
                 'total': 0,
                 'display_filename': None,
                 'operation': None,
                 'display_index': None
             },
-            'command_display_index': None,  # The current command within a running backup
+            'buffers': {},  # Copy buffers for each destination drive running a command
             'current': 0,  # (int) Current progress
             'current_file': None,  # (filename, filesize, operation, display index)
             'files': [],  # (filename, filesize, operation, display index)
             'since_last_update': {  # Buffer for tracking delta UI updates
                 'analysis': [],  # (list, file path)
-                'files': []
+                'files': [],
+                'commands': []  # (int) Display index of commands started
             },
             'total': 0,  # (int) Total for calculating progress percentage
-            'delete_total': 0
+            'delete_total': 0,
+            'bytes_copied': 0,  # (int) Logical size of the data copied so far, counting holes in sparse files
+            'bytes_written': 0,  # (int) Bytes physically written for the data copied so far, leaving out holes
+            'sparse_skipped': 0,  # (int) Bytes in holes of sparse files that were copied without writing them
+            'dedup_saved': 0  # (int) Bytes of files linked or cloned to an identical file instead of copied
         }
 
         self.confirm_wipe_existing_drives = False
@@ -70,6 +86,9 @@ class Backup:
         self.delete_file_list = {}
         self.replace_file_list = {}
         self.new_file_list = {}
+        self.unchanged_file_list = {}  # Files with different mtimes that didn't need replacing
+        self.move_file_list = {}  # Files already on the drive under a path that's being deleted
+        self.link_file_list = {}  # New files that are hardlinks to a file already on, or being copied to, the drive
 
         self.config = config
         self.DRIVE_VID_INFO = {drive['vid']: drive for drive in config['destinations']}
@@ -77,14 +96,24 @@ class Backup:
 
         self.BACKUP_CONFIG_DIR = backup_config_dir
         self.BACKUP_CONFIG_FILE = backup_config_file
-        self.BACKUP_HASH_FILE = 'hashes.pkl'
+        self.BACKUP_HASH_FILE = HashStore.FILENAME
+        self.BACKUP_MANIFEST_FILE = DriveManifest.FILENAME
 
-        self.SPECIAL_IGNORE_LIST = [self.BACKUP_CONFIG_DIR, '$RECYCLE.BIN', 'System Volume Information']
+        self.SPECIAL_IGNORE_LIST = [self.BACKUP_CONFIG_DIR] + FileUtils.SYSTEM_IGNORE_LIST
 
-        self.file_hashes = {drive['name']: {} for drive in self.config['destinations']}
+        self.file_hashes = {}  # Hash store for each drive, loaded during analysis
+        self.clone_unsupported = set()  # Drives that files can't be cloned on for dedup
+        self.source_hashes = None  # Cache of source file hashes, opened during analysis if enabled
+        self.drive_manifests = {}  # Manifest of files on each drive, loaded during analysis
+        self.size_index = size_index if size_index is not None else DirectorySizeIndex()
 
         self.analysis_killed = False
         self.run_killed = False
+        self.failed_drives = {}  # Drives whose commands stopped with an error, and the error
+
+        # Commands for separate drives can run on separate threads, so progress
+        # updates need to be locked
+        self.progress_lock = threading.Lock()
 
         self.analysis_pre_callback_fn = analysis_pre_callback_fn
         self.analysis_callback_fn = analysis_callback_fn
@@ -112,12 +141,13 @@ class Backup:
         # TODO: Replace current_file with buffer in self.progress
         self.progress['current_file'] = (filename, size, operation, display_index)
 
-    def do_del_fn(self, filename, size: int, display_index: int = None):
+    def do_del_fn(self, filename, size: int, drive=None, display_index: int = None):
         """Start a do_delete() call, and report to the GUI.
 
         Args:
             filename (String): The file or folder to delete.
             size (int): The size in bytes of the file or folder.
+            drive (String): The destination drive the file is on (optional).
             display_index (int): The index to display the item in the GUI (optional).
         """
 
@@ -132,9 +162,9 @@ class Backup:
         else:
             status = Status.FILE_OPERATION_FAILED
 
-        self.update_copy_lists(status, (filename, size, Status.FILE_OPERATION_DELETE, display_index))
+        self.update_copy_lists(status, (filename, size, Status.FILE_OPERATION_DELETE, display_index), drive=drive)
 
-    def set_copy_progress(self, copied, total, display_filename=None, operation=None, display_index: int = None):
+    def set_copy_progress(self, copied, total, display_filename=None, operation=None, display_index: int = None, drive=None):
         """Set the copy progress of a transfer.
 
         Args:
@@ -143,28 +173,37 @@ class Backup:
             display_filename (String): The filename to display inthe GUI (optional).
             operation (int): The mode to display the progress in (optional).
             display_index (int): The index to display the item in the GUI (optional).
+            drive (String): The destination drive being copied to (optional).
         """
 
-        self.progress['buffer']['copied'] = copied
-        self.progress['buffer']['total'] = total
-        self.progress['buffer']['display_filename'] = display_filename
-        self.progress['buffer']['operation'] = operation
-        self.progress['buffer']['display_index'] = display_index
+        buffer = {
+            'copied': copied,
+            'total': total,
+            'display_filename': display_filename,
+            'operation': operation,
+            'display_index': display_index
+        }
 
-    def update_copy_lists(self, status, file):
+        self.progress['buffers'][drive] = buffer
+        self.progress['buffer'] = buffer
+
+    def update_copy_lists(self, status, file, drive=None):
         """Add the copied file to the correct list.
 
         Args:
             status (int): The Status of the file copy state.
             file (tuple): The file to add to the list.
+            drive (String): The destination drive the file was copied to (optional).
         """
 
-        self.progress['buffer']['copied'] = 0
-        self.progress['since_last_update']['files'].append({
-            'file': file,
-            'success': status == Status.FILE_OPERATION_SUCCESS,
-            'timestamp': time.time()
-        })
+        with self.progress_lock:
+            if drive in self.progress['buffers']:
+                self.progress['buffers'][drive]['copied'] = 0
+            self.progress['since_last_update']['files'].append({
+                'file': file,
+                'success': status == Status.FILE_OPERATION_SUCCESS,
+                'timestamp': time.time()
+            })
 
     def do_copy_fn(self, src, dest, drive_path, display_index: int = None) -> dict:
         """Start a do_copy() call and report to the GUI.
@@ -181,6 +220,7 @@ class Backup:
 
         # FIXME: Backup error log is not being appended to from fd_callback
 
+        # Sources with a saved hash don't need hashing again, and the rest are saved once they're copied
         return do_copy(
             src=src,
             dest=dest,
@@ -191,13 +231,208 @@ class Backup:
                 total=t,
                 display_filename=dest,
                 operation=op,
-                display_index=display_index
+                display_index=display_index,
+                drive=drive_path
             ),
             display_index=display_index,
-            fd_callback=self.update_copy_lists,
-            get_backup_killflag=self.get_kill_flag
+            fd_callback=lambda status, file: self.update_copy_lists(status, file, drive=drive_path),
+            get_backup_killflag=self.get_kill_flag,
+            copy_strategy=self.config.get('copy_strategy'),
+            chunk_callback=(lambda file, digests, complete: self.save_file_chunks(drive_path, file, digests, complete)) if self.config.get('chunk_hashes', True) else None,
+            cache_hints=self.config.get('cache_hints', False),
+            sparse_callback=self.add_sparse_skipped,
+            source_hashes=self.source_hashes
         )
 
+    def get_source_hash(self, filename, kill_flag) -> str:
+        """Get the hash of a source file, from the source hash cache if it's enabled.
+
+        Args:
+            filename (String): The file to get the hash of.
+            kill_flag (function): The function to get a kill flag.
+
+        Returns:
+            String: The blake3 hash of the file if readable, as in get_file_hash().
+        """
+
+        if self.source_hashes is None:
+            return get_file_hash(filename, kill_flag)
+
+        return self.source_hashes.get_file_hash(filename, kill_flag)
+
+    def add_sparse_skipped(self, size: int):
+        """Count holes in a sparse file that were skipped instead of written, as they're copied.
+
+        Args:
+            size (int): The size of the holes in bytes.
+        """
+
+        with self.progress_lock:
+            self.progress['sparse_skipped'] += size
+
+    def save_file_chunks(self, drive_path, dest, digests: list, complete: bool):
+        """Save the chunk digests of a large file copied to a drive.
+
+        Args:
+            drive_path (String): The path of the destination drive.
+            dest (String): The file the chunks are for.
+            digests (bytes[]): The digest of each chunk, in order.
+            complete (bool): Whether the file is fully copied, or this is a checkpoint.
+        """
+
+        if dest.find(drive_path) != 0:
+            return
+
+        file_name = dest[len(drive_path):].strip(os.path.sep)
+        self.file_hashes[drive_path].set_chunks(file_name, FileUtils.CHUNK_SIZE, digests, complete)
+
+        # Partly copied files are kept for resuming, so the manifest needs to know they're there
+        if not complete and digests and drive_path in self.drive_manifests:
+            self.drive_manifests[drive_path].add_files([file_name])
+
+    def get_file_chunks(self, drive_path, file_name) -> list:
+        """Get the saved chunk digests of a file on a drive, if they're still valid.
+
+        Args:
+            drive_path (String): The path of the destination drive.
+            file_name (String): The path of the file, relative to the drive.
+
+        Returns:
+            bytes[]: The digest of each chunk, or None if there are no valid chunks saved.
+        """
+
+        try:
+            dest_stat = os.stat(os.path.join(drive_path, file_name))
+        except OSError:
+            return None
+
+        saved_chunks = self.file_hashes[drive_path].get_chunks(file_name, dest_stat.st_size, dest_stat.st_mtime_ns)
+        if saved_chunks is None or saved_chunks[0] != FileUtils.CHUNK_SIZE:
+            return None
+
+        return saved_chunks[1]
+
+    def do_delta_update_fn(self, src, dest, drive_path, chunk_digests: list = None, display_index: int = None) -> dict:
+        """Start a delta_update_file() call, and report to the GUI.
+
+        Args:
+            src (String): The source to copy.
+            dest (String): The existing destination file to update.
+            drive_path (String): The path of the destination drive to copy to.
+            chunk_digests (bytes[]): The saved chunk digests of the destination file (optional).
+            display_index (int): The index to display the item in the GUI (optional).
+
+        Return:
+            dict: The hash of the file if it was updated.
+        """
+
+        try:
+            source_stat = os.stat(src)
+        except OSError:
+            source_stat = None
+
+        new_hash = delta_update_file(
+            source_filename=src,
+            dest_filename=dest,
+            drive_path=drive_path,
+            pre_callback=lambda: self.set_working_file(dest, None, Status.FILE_OPERATION_UPDATE, display_index),
+            prog_callback=lambda c, t, op: self.set_copy_progress(
+                copied=c,
+                total=t,
+                display_filename=dest,
+                operation=op,
+                display_index=display_index,
+                drive=drive_path
+            ),
+            fd_callback=lambda status, file: self.update_copy_lists(status, (file[0], file[1], file[2], display_index), drive=drive_path),
+            get_backup_killflag=self.get_kill_flag,
+            chunk_digests=chunk_digests,
+            chunk_callback=lambda file, digests, complete: self.save_file_chunks(drive_path, file, digests, complete),
+            cache_hints=self.config.get('cache_hints', False)
+        )
+
+        if new_hash is None:
+            # The file may be partly rewritten, so its old hash no longer matches it
+            self.file_hashes[drive_path].delete([dest[len(drive_path):].strip(os.path.sep)], keep_chunks=True)
+            return {}
+
+        # The whole source is read and hashed to update the file, so the hash can be saved for free
+        if self.source_hashes is not None:
+            self.source_hashes.add(src, source_stat, new_hash[1])
+
+        return {dest[len(drive_path):].strip(os.path.sep): new_hash[1]}
+
+    def dedup_file(self, src, dest, drive_path, display_index: int = None) -> dict:
+        """Link or clone a new file to an identical file that's already on the drive.
+
+        The source is only hashed if the drive has a file of the same size. A
+        file is hardlinked if it has the same mtime and mode as the source, since
+        the link shares those. Otherwise it's cloned, if the drive supports it.
+
+        Args:
+            src (String): The source file.
+            dest (String): The destination to link or clone to.
+            drive_path (String): The path of the destination drive.
+            display_index (int): The index to display the item in the GUI (optional).
+
+        Returns:
+            dict: The hash of the file if it was linked or cloned, or None if it needs copying.
+        """
+
+        hash_store = self.file_hashes[drive_path]
+        dest_stub = dest[len(drive_path):].strip(os.path.sep)
+
+        try:
+            source_stat = os.stat(src)
+        except OSError:
+            return None
+
+        # If the drive can't clone files, only files that can be linked are worth hashing
+        if not hash_store.has_size(source_stat.st_size, source_stat.st_mtime_ns if drive_path in self.clone_unsupported else None):
+            return None
+
+        try:
+            digest = self.get_source_hash(src, self.get_kill_flag)
+        except OSError:
+            return None
+
+        if not digest:
+            return None
+
+        for file_name, mtime_ns in hash_store.find_by_digest(digest, source_stat.st_size):
+            if file_name == dest_stub:
+                continue
+
+            existing = os.path.join(drive_path, file_name)
+            try:
+                existing_stat = os.stat(existing)
+            except OSError:
+                continue
+
+            # The file has to be unchanged since it was hashed to still be a copy
+            if existing_stat.st_size != source_stat.st_size or existing_stat.st_mtime_ns != mtime_ns:
+                continue
+
+            if existing_stat.st_mtime_ns == source_stat.st_mtime_ns and existing_stat.st_mode == source_stat.st_mode:
+                if not link_file(existing, dest):
+                    continue
+            elif drive_path in self.clone_unsupported:
+                continue
+            elif clone_file(existing, dest):
+                shutil.copymode(src, dest)
+                shutil.copystat(src, dest)
+            else:
+                self.clone_unsupported.add(drive_path)
+                continue
+
+            with self.progress_lock:
+                self.progress['dedup_saved'] += source_stat.st_size
+            self.update_copy_lists(Status.FILE_OPERATION_SUCCESS, (dest, source_stat.st_size, Status.FILE_OPERATION_COPY, display_index), drive=drive_path)
+
+            return {dest_stub: digest}
+
+        return None
+
     def sanity_check(self) -> bool:
         """Check to make sure everything is correct before a backup.
 
@@ -279,73 +514,107 @@ class Backup:
 
         self.analysis_pre_callback_fn()
 
+        # Close anything left open by the last analysis before it's loaded again
+        self.close()
+
         self.progress['current'] = 0
         self.progress['total'] = 0
 
         source_info = {source['dest_name']: source['size'] for source in self.config['sources']}
         all_source_info = source_info.copy()
 
+        def load_drive_manifests() -> dict:
+            """Load the manifest for each drive, and clear any that can't be trusted.
+
+            A manifest can only be trusted if its generation matches the one saved
+            in the backup config on the drive by the last backup.
+
+            Returns:
+                dict: The manifests to be used during analysis.
+                    Key (String): The drive being referenced.
+                    Value (DriveManifest): The manifest for the drive.
+            """
+
+            manifests = {}
+
+            for drive in self.config['destinations']:
+                manifest = DriveManifest(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_MANIFEST_FILE), root=drive['name'])
+                drive_config_file = Config(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_CONFIG_FILE))
+
+                try:
+                    generation = drive_config_file.get('manifest', 'generation', default=0, data_type=Config.INTEGER)
+                except ValueError:
+                    generation = 0
+
+                if self.config.get('manifest_verify') or not generation or generation != manifest.generation:
+                    # Drive will be read in full, and the manifest rebuilt from that
+                    manifest.clear()
+                else:
+                    trusted_manifests.add(drive['name'])
+
+                manifests[drive['name']] = manifest
+
+            return manifests
+
         def scan_hash_files() -> dict:
-            """Scan hash files, and build hash list for files.
+            """Load the hash store for each drive, and prune hashes for missing files.
 
             Returns:
                 dict: The hash data to be used during analysis.
                     Key (String): The drive being referenced.
-                    Value (dict): The hash list:
-                        Key (String): The filename to hash.
-                        Value (String): The hash of the file.
+                    Value (HashStore): The hash store for the drive.
             """
 
-            hash_data = {drive['name']: {} for drive in self.config['destinations']}
-            bad_hash_files = []
+            hash_data = {}
 
             for drive in self.config['destinations']:
-                drive_hash_file_path = os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE)
+                drive_hash_store = HashStore(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE), root=drive['name'])
 
-                if os.path.isfile(drive_hash_file_path):
-                    write_trimmed_changes = False
-                    with open(drive_hash_file_path, 'rb') as f:
-                        try:
-                            # Load hash list, and filter out ignored folders
-                            hash_list = pickle.load(f)
-                            new_hash_list = {}
-                            for file_name, hash_val in hash_list.items():
-                                filename_chunks = file_name.split('/')
-
-                                if filename_chunks[0] not in self.SPECIAL_IGNORE_LIST:
-                                    if os.path.isfile(os.path.join(drive['name'], file_name)):
-                                        new_hash_list[os.path.join(filename_chunks)]: hash_val
-
-                            # If trimmed list is shorter, new changes have to be written to the file
-                            if len(new_hash_list) < len(hash_list):
-                                write_trimmed_changes = True
-
-                            hash_data[drive['name']] = new_hash_list
-                        except Exception:
-                            # Hash file is corrupt
-                            bad_hash_files.append(drive_hash_file_path)
-
-                    # If trimmed list is different length than original, write changes to file
-                    if write_trimmed_changes:
-                        with open(drive_hash_file_path, 'wb') as f:
-                            pickle.dump({'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in new_hash_list.items()}, f)
+                # Filter out ignored folders and files that no longer exist
+                if drive['name'] in trusted_manifests:
+                    # Check the manifest instead of the drive where possible
+                    def file_exists(file_name, manifest=self.drive_manifests[drive['name']], drive_path=drive['name']) -> bool:
+                        in_manifest = manifest.has_file(file_name)
+                        return in_manifest if in_manifest is not None else os.path.isfile(os.path.join(drive_path, file_name))
+
+                    drive_hash_store.prune(drive['name'], self.SPECIAL_IGNORE_LIST, file_exists=file_exists)
                 else:
-                    # Hash file doesn't exist, so create it
-                    if not os.path.exists(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR)):
-                        os.makedirs(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR))
-                    with open(drive_hash_file_path, 'wb') as f:
-                        pickle.dump({}, f)
+                    drive_hash_store.prune(drive['name'], self.SPECIAL_IGNORE_LIST)
 
-            # If there are missing or corrupted pickle files, write empty data
-            for file in bad_hash_files:
-                with open(file, 'wb') as f:
-                    pickle.dump({}, f)
+                hash_data[drive['name']] = drive_hash_store
 
             return hash_data
 
-        # Get hash list for all drives
+        # Get manifest and hash list for all drives
+        trusted_manifests = set()
+        self.drive_manifests = load_drive_manifests()
         self.file_hashes = scan_hash_files()
 
+        # Load the snapshot of each source from the last analysis, so that unchanged
+        # folders don't need to be listed again
+        source_snapshots = {}
+        if self.config.get('source_snapshot') and self.config.get('snapshot_dir'):
+            for source in self.config['sources']:
+                source_path = self.get_source_source_path(source['dest_name'])
+                snapshot_name = blake3(os.path.normcase(os.path.abspath(source_path)).encode('utf-8')).hexdigest()[:32]
+                source_snapshots[source['dest_name']] = SourceSnapshot(os.path.join(self.config['snapshot_dir'], f'{snapshot_name}.db'), source_path)
+
+                # With a change journal, folders that changed are marked in the snapshot,
+                # and if the journal has every change, the rest don't need checking
+                if self.config.get('change_journal') and self.config.get('journal_dir'):
+                    journal = ChangeJournal(get_journal_filename(self.config['journal_dir'], source_path))
+                    changes = journal.get_changes()
+                    source_snapshots[source['dest_name']].apply_changes(changes)
+                    journal.mark_read(changes['marker'])
+                    journal.close()
+
+                    if not changes['complete']:
+                        logging.info('Change journal for %s is incomplete, checking the whole source', source_path)
+
+        # The cache of source file hashes is kept open for the backup, so copies can add to it
+        if self.source_hashes is None and self.config.get('source_hash_cache') and self.config.get('source_hash_file'):
+            self.source_hashes = SourceHashCache(self.config['source_hash_file'])
+
         drive_info = []
         drive_source_list = {}
         master_drive_list = [drive for drive in self.config['destinations']]
@@ -362,7 +631,7 @@ class Backup:
 
             # If drive is connected, collect info about config size and free space
             if drive_connected:
-                current_drive_info['configSize'] = get_directory_size(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR))
+                current_drive_info['configSize'] = self.size_index.get_size(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR))
             else:
                 current_drive_info['name'] = f"[{drive['vid']}]"
                 current_drive_info['configSize'] = 20000  # Assume 20K config size
@@ -379,55 +648,14 @@ class Backup:
 
         all_drive_files_buffer = {drive['name']: set() for drive in master_drive_list}
 
-        SOURCE_LIST_CHUNK_SIZE = 15
-
         for i, drive in enumerate(drive_info):
             # Get list of sources small enough to fit on drive
-            total_small_sources = {source: size for source, size in source_info.items() if size <= drive['free']}
-            SOURCE_LIST_LENGTH = len(total_small_sources)
-
-            # Sort sources by largest first
-            total_small_sources = sorted(total_small_sources.items(), key=lambda x: x[1], reverse=True)
+            small_source_list = {source: size for source, size in source_info.items() if size <= drive['free']}
 
-            # Since the list of files is truncated to prevent an unreasonably large
-            # number of combinations to check, we need to keep processing the file list
-            # in chunks to make sure we check if all files can be fit on one drive
-            sources_that_fit_on_dest = set()
-            small_source_list = {}
-            processed_small_sources = []
-            processed_source_size = 0
-
-            for chunk in range(0, math.ceil(SOURCE_LIST_LENGTH / SOURCE_LIST_CHUNK_SIZE)):
-                if self.analysis_killed:
-                    break
-
-                # Trim the list of small files to those that aren't already processed
-                small_source_list = {source: size for (source, size) in total_small_sources if source not in processed_small_sources}
-
-                LIST_CHUNK_MIN = chunk * SOURCE_LIST_CHUNK_SIZE
-                LIST_CHUNK_MAX = min((chunk + 1) * SOURCE_LIST_CHUNK_SIZE, SOURCE_LIST_LENGTH)
-
-                # Truncate to prevent unreasonably large number of combinations
-                trimmed_small_source_list = {source[0]: source[1] for source in total_small_sources[LIST_CHUNK_MIN:LIST_CHUNK_MAX]}
-
-                # Try every combination of sources that fit to find result that uses most of that drive
-                largest_sum = 0
-                largest_set = set()
-                for n in range(1, len(trimmed_small_source_list) + 1):
-                    for subset in itertools.combinations(trimmed_small_source_list.keys(), n):
-                        combination_total = sum(trimmed_small_source_list[source] for source in subset)
-
-                        if (combination_total > largest_sum and combination_total <= drive['free']):
-                            largest_sum = combination_total
-                            largest_set = subset
-
-                sources_that_fit_on_dest.update({source for source in largest_set})
-                remaining_small_sources = {source[0]: source[1] for source in small_source_list if source not in sources_that_fit_on_dest}
-                processed_small_sources.extend([source for source in trimmed_small_source_list.keys()])
-                source_info = {source: size for (source, size) in source_info.items() if source not in sources_that_fit_on_dest}
-
-                # Subtract file size of each batch of files from the free space on the drive so the next batch sorts properly
-                processed_source_size += sum((size for (source, size) in small_source_list.items() if source in largest_set))
+            # Find the combination of sources that uses the most of that drive
+            sources_that_fit_on_dest = pack_subset(small_source_list, drive['free'], kill_flag=lambda: self.analysis_killed, time_budget=Backup.PACKING_TIME_BUDGET)
+            remaining_small_sources = {source: size for source, size in small_source_list.items() if source not in sources_that_fit_on_dest}
+            source_info = {source: size for (source, size) in source_info.items() if source not in sources_that_fit_on_dest}
 
             if self.analysis_killed:
                 break
@@ -504,7 +732,7 @@ class Backup:
                         if filename in self.SPECIAL_IGNORE_LIST:
                             continue
 
-                        new_dir_size = get_directory_size(entry.path)
+                        new_dir_size = self.size_index.get_size(entry.path)
 
                     filename = entry.path[len(source_path):].strip(os.path.sep)
                     file_info[filename] = new_dir_size
@@ -517,54 +745,14 @@ class Backup:
             # For splitting sources, sort by largest free space first
             drive_info.sort(reverse=True, key=lambda x: x['free'])
 
-            FILE_LIST_CHUNK_SIZE = 15
-
             for i, drive in enumerate(drive_info):
                 # Get list of files small enough to fit on drive
-                total_small_files = {file: size for file, size in file_info.items() if size <= drive['free']}
-                FILE_LIST_LENGTH = len(total_small_files)
-
-                # Sort files by largest first
-                total_small_files = sorted(total_small_files.items(), key=lambda x: x[1], reverse=True)
+                small_file_list = {file: size for file, size in file_info.items() if size <= drive['free']}
 
-                # Since the list of files is truncated to prevent an unreasonably large
-                # number of combinations to check, we need to keep processing the file list
-                # in chunks to make sure we check if all files can be fit on one drive
-                files_that_fit_on_drive = set()
-                small_file_list = {}
-                processed_small_files = []
-                processed_file_size = 0
-
-                for chunk in range(0, math.ceil(FILE_LIST_LENGTH / FILE_LIST_CHUNK_SIZE)):
-                    if self.analysis_killed:
-                        break
-
-                    # Trim the list of small files to those that aren't already processed
-                    small_file_list = {file: size for (file, size) in total_small_files.items() if file not in processed_small_files}
-
-                    LIST_CHUNK_MIN = chunk * FILE_LIST_CHUNK_SIZE
-                    LIST_CHUNK_MAX = min((chunk + 1) * FILE_LIST_CHUNK_SIZE, FILE_LIST_LENGTH)
-
-                    # Truncate to prevent unreasonably large number of combinations
-                    trimmed_small_file_list = {file[0]: file[1] for file in total_small_files[LIST_CHUNK_MIN:LIST_CHUNK_MAX]}
-
-                    # Try every combination of sources that fit to find result that uses most of that drive
-                    largest_sum = 0
-                    largest_set = []
-                    for n in range(1, len(trimmed_small_file_list) + 1):
-                        for subset in itertools.combinations(trimmed_small_file_list.keys(), n):
-                            combination_total = sum((trimmed_small_file_list[file] for file in subset))
-
-                            if (combination_total > largest_sum and combination_total <= drive['free'] - processed_file_size):
-                                largest_sum = combination_total
-                                largest_set = subset
-
-                    files_that_fit_on_drive.update({file for file in largest_set})
-                    processed_small_files.extend([file for file in trimmed_small_file_list])
-                    file_info = {file: size for (file, size) in file_info.items() if file not in largest_set}
-
-                    # Subtract file size of each batch of files from the free space on the drive so the next batch sorts properly
-                    processed_file_size += sum((size for (file, size) in small_file_list.items() if file in largest_set))
+                # Find the combination of files that uses the most of that drive
+                files_that_fit_on_drive = pack_subset(small_file_list, drive['free'], kill_flag=lambda: self.analysis_killed, time_budget=Backup.PACKING_TIME_BUDGET)
+                file_info = {file: size for (file, size) in file_info.items() if file not in files_that_fit_on_drive}
+                processed_file_size = sum(small_file_list[file] for file in files_that_fit_on_drive)
 
                 if self.analysis_killed:
                     break
@@ -677,193 +865,487 @@ class Backup:
                 return set()
             return file_list
 
-        def build_delta_file_list(drive, path, sources: set, exclusions: list) -> dict:
-            """Get lists of files to delete and replace from the destination drive, that no longer
-            exist in the source, or have changed.
+        def build_file_lists(drive, sources: set, exclusions: list) -> dict:
+            """Get lists of files to delete, replace, and copy for a destination drive.
+
+            The destination drive and the sources are walked together, one directory
+            at a time, and the entries on each side are merge joined by name. Each
+            directory is only listed once on each side, and files are only stat'ed
+            when their size or mtime is needed.
 
             Args:
                 drive (String): The drive to check.
-                path (String): The path to check.
-                sources (String[]): The list of sources to check.
+                sources (String[]): The list of sources the drive should contain.
                 exclusions (String[]): The list of files and folders to exclude.
 
             Returns:
-                dict: The file lists for deleting and replacing.
+                dict: The file lists for deleting, replacing, and copying.
                     delete (set(tuple)): (drive, path, size).
-                    replace (set(tuple)): (drive, source, path, source_path, size).
+                    replace (set(tuple)): (drive, source, path, source_size, dest_size).
+                    new (set(tuple)): (drive, source, path, size).
+                    unchanged (set(tuple)): (drive, source, path, size) for files that
+                        have different mtimes, but didn't need replacing.
+                    link (dict): The new files that are hardlinks to another file
+                        on the drive, keyed by path relative to the drive. Each is
+                        in the new list with a size of 0.
+                        tuple[0] (String): The file to link to, relative to the drive.
+                        tuple[1] (String): The source of the file to link to.
+                        tuple[2] (int): The size of the file.
             """
 
             file_list = {
                 'delete': set(),
-                'replace': set()
+                'replace': set(),
+                'new': set(),
+                'unchanged': set(),
+                'link': {}
             }
-            try:
+
+            # The first file on the drive for each hardlinked source file and its
+            # source, keyed by (st_dev, st_ino), and the ones of those that are new files
+            link_targets = {}
+            new_link_targets = {}
+
+            exclusions = set(exclusions)
+
+            manifest = self.drive_manifests.get(drive)
+
+            # Some filesystems round mtimes, so copies of a file won't always match exactly
+            mtime_tolerance = get_mtime_tolerance(drive)
+            hash_check = self.config.get('mtime_hash_check', False)
+
+            # Folders above a source, that need to be kept on the drive
+            source_parents = {os.path.sep.join(source.split(os.path.sep)[:i]) for source in sources for i in range(1, len(source.split(os.path.sep)))}
+            sources_walked = set()
+
+            def list_directory(path) -> list:
+                """Get the entries in a directory, sorted by name.
+
+                Args:
+                    path (String): The directory to list.
+
+                Returns:
+                    os.DirEntry[]: The entries in the directory, or an empty list if it doesn't exist.
+                """
+
+                try:
+                    return sorted(os.scandir(path), key=lambda entry: os.path.normcase(entry.name))
+                except (FileNotFoundError, NotADirectoryError):
+                    return []
+
+            def merge_entries(dest_entries: list, source_entries: list):
+                """Pair up sorted destination and source entries with the same name.
+
+                Args:
+                    dest_entries (os.DirEntry[]): The sorted destination entries.
+                    source_entries (os.DirEntry[]): The sorted source entries.
+
+                Yields:
+                    tuple: The destination entry and source entry, either of which may be None.
+                """
+
+                i = 0
+                j = 0
+                while i < len(dest_entries) or j < len(source_entries):
+                    dest_name = os.path.normcase(dest_entries[i].name) if i < len(dest_entries) else None
+                    source_name = os.path.normcase(source_entries[j].name) if j < len(source_entries) else None
+
+                    if source_name is None or (dest_name is not None and dest_name < source_name):
+                        yield (dest_entries[i], None)
+                        i += 1
+                    elif dest_name is None or source_name < dest_name:
+                        yield (None, source_entries[j])
+                        j += 1
+                    else:
+                        yield (dest_entries[i], source_entries[j])
+                        i += 1
+                        j += 1
+
+            def delete_entry(entry, stub_path):
+                """Add a destination file or folder to the delete list.
+
+                Args:
+                    entry (os.DirEntry): The entry to delete.
+                    stub_path (String): The path of the entry, relative to the drive.
+                """
+
+                try:
+                    if entry.is_dir():
+                        calculated_size = manifest.get_size(stub_path) if manifest is not None else None
+                        if calculated_size is None:
+                            calculated_size = self.size_index.get_size(entry.path)
+                    else:
+                        calculated_size = entry.stat().st_size
+                except OSError:
+                    return
+
+                file_list['delete'].add((drive, stub_path, calculated_size))
+                self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_DELETE, entry.path))
+
+            def is_unchanged(stub_path, source_path, dest_stats, source_stats) -> bool:
+                """Check if a file with a different mtime than the source is still the same.
+
+                Args:
+                    stub_path (String): The path of the file, relative to the drive.
+                    source_path (String): The path of the file on the source.
+                    dest_stats (os.stat_result): The stats of the file on the drive.
+                    source_stats (os.stat_result): The stats of the file on the source.
+
+                Returns:
+                    bool: Whether the file is the same, and doesn't need replacing.
+                """
+
+                if abs(dest_stats.st_mtime_ns - source_stats.st_mtime_ns) <= mtime_tolerance:
+                    return True
+
+                if not hash_check or drive not in self.file_hashes:
+                    return False
+
+                # Saved hash is only valid if the file hasn't changed since it was hashed
+                record = self.file_hashes[drive].get_record(stub_path)
+                if record is None or record['size'] != dest_stats.st_size or record['mtime_ns'] != dest_stats.st_mtime_ns:
+                    return False
+
+                try:
+                    return self.get_source_hash(source_path, lambda: self.analysis_killed) == record['digest']
+                except OSError:
+                    return False
+
+            def list_dest_directory(path) -> list:
+                """Get the entries in a folder on the drive, sorted by name.
+
+                The listing is read from the drive's manifest if the folder is in it,
+                and read from the drive and saved to the manifest otherwise.
+
+                Args:
+                    path (String): The folder to list, relative to the drive.
+
+                Returns:
+                    os.DirEntry[]: The entries in the folder, or an empty list if it doesn't exist.
+                """
+
+                if manifest is not None:
+                    entries = manifest.list_directory(path)
+                    if entries is not None:
+                        return entries
+
+                try:
+                    entries = sorted(os.scandir(os.path.join(drive, path)), key=lambda entry: os.path.normcase(entry.name))
+                except (FileNotFoundError, NotADirectoryError):
+                    return []
+
+                if manifest is not None:
+                    manifest.record_listing(path, entries)
+
+                return entries
+
+            def list_source_directory(source, path_slug) -> list:
+                """Get the entries in a folder in a source, sorted by name.
+
+                Args:
+                    source (String): The source the folder is in.
+                    path_slug (String): The path of the folder, relative to the source.
+
+                Returns:
+                    os.DirEntry[]: The entries in the folder, or an empty list if it doesn't exist.
+                """
+
+                source_base = source.split(os.path.sep)[0]
+                if source_base not in source_snapshots:
+                    return list_directory(os.path.join(self.get_source_source_path(source), path_slug))
+
+                try:
+                    return source_snapshots[source_base].list_directory(os.path.join(source[len(source_base):].strip(os.path.sep), path_slug).strip(os.path.sep))
+                except (FileNotFoundError, NotADirectoryError):
+                    return []
+
+            def diff_parent_directory(path):
+                """Compare a folder on the drive that's above the sources.
+
+                Anything in the folder that isn't a source, or above one, is deleted.
+
+                Args:
+                    path (String): The path to check, relative to the drive.
+                """
+
                 if self.analysis_killed:
-                    return file_list
+                    return
 
-                # Check to see if path to be scanned is a valid folder
-                if path.split(os.path.sep)[0] in sources:
-                    valid_source = path.split(os.path.sep)[0]
-                else:
-                    valid_source = None
+                try:
+                    dest_entries = list_dest_directory(path)
+                except OSError:
+                    return
 
-                # For each file in the path, check things
-                for entry in os.scandir(os.path.join(drive, path)):
-                    stub_path = entry.path[len(drive):].strip(os.path.sep)
+                for entry in dest_entries:
+                    stub_path = os.path.join(path, entry.name)
 
                     # Skip over the config folder, and OS special folders
                     if stub_path in self.SPECIAL_IGNORE_LIST:
                         continue
 
-                    file_stat = entry.stat()
+                    if stub_path in exclusions:
+                        delete_entry(entry, stub_path)
+                    elif entry.is_dir() and stub_path in sources and os.path.isdir(self.get_source_source_path(stub_path)):
+                        sources_walked.add(stub_path)
+                        diff_source_directory(stub_path, stub_path)
+                    elif entry.is_dir() and stub_path in source_parents:
+                        diff_parent_directory(stub_path)
+                    else:
+                        # Files on the root of the drive, and folders that aren't part of a source
+                        delete_entry(entry, stub_path)
+
+            def diff_source_directory(path, source, dest_exists: bool = True):
+                """Compare a folder in a source with its copy on the drive.
+
+                Args:
+                    path (String): The path to check, relative to the drive.
+                    source (String): The source the folder is in.
+                    dest_exists (bool): Whether the folder exists on the drive (default: True).
+                """
+
+                if self.analysis_killed:
+                    return
+
+                path_slug = path[len(source):].strip(os.path.sep)
+
+                try:
+                    source_entries = list_source_directory(source, path_slug)
+                    dest_entries = list_dest_directory(path) if dest_exists else []
+                except OSError:
+                    # If either side can't be read, don't change anything
+                    return
 
-                    # Delete excluded stuff
+                for dest_entry, source_entry in merge_entries(dest_entries, source_entries):
+                    if self.analysis_killed:
+                        return
+
+                    name = dest_entry.name if dest_entry is not None else source_entry.name
+                    stub_path = os.path.join(path, name)
+                    file_slug = os.path.join(path_slug, name)
+
+                    # Skip over the config folder, and OS special folders, and exclusions
+                    if file_slug in self.SPECIAL_IGNORE_LIST:
+                        continue
                     if stub_path in exclusions:
-                        if entry.is_dir():
-                            calculated_size = get_directory_size(entry.path)
-                        else:
-                            calculated_size = file_stat.st_size
+                        if dest_entry is not None:
+                            delete_entry(dest_entry, stub_path)
+                        continue
 
-                        file_list['delete'].add((drive, stub_path, calculated_size))
-                        self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_DELETE, entry.path))
+                    source_is_dir = source_entry is not None and source_entry.is_dir()
 
-                    root_path = stub_path.split(os.path.sep)[0]
+                    if dest_entry is not None:
+                        if dest_entry.is_dir():
+                            if source_is_dir:
+                                if stub_path in sources:
+                                    sources_walked.add(stub_path)
+                                    diff_source_directory(stub_path, stub_path)
+                                else:
+                                    diff_source_directory(stub_path, source)
+                                continue
 
-                    # For each entry, either add filesize to the total, or recurse into the directory
-                    if entry.is_dir():  # Path is directory
-                        if (root_path in sources and os.path.isdir(self.get_source_source_path(stub_path))  # Dir is source or folder in source, and exists on source
-                                or 0 in [item.find(stub_path + os.path.sep) for item in sources]):  # Directory is parent of source, so it stays
-                            # Recurse into folder
-                            new_list = build_delta_file_list(drive, stub_path, sources, exclusions)
-                            file_list['delete'].update(new_list['delete'])
-                            file_list['replace'].update(new_list['replace'])
-                        else:
-                            # Directory isn't a source, or part of one
-                            file_list['delete'].add((drive, stub_path, get_directory_size(entry.path)))
-                            self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_DELETE, entry.path))
-                    elif entry.is_file():  # Path is file
-                        if (stub_path.find(os.path.sep) == -1  # Files should not be on root of drive
-                                or valid_source is None):  # File should only count if dir is source or child, not parent
-                            file_list['delete'].add((drive, stub_path, file_stat.st_size))
-                            self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_DELETE, entry.path))
-                        else:  # File is in source on destination drive
-                            path_slug = stub_path[len(valid_source):].strip(os.path.sep)
-                            source_path = self.get_source_source_path(valid_source)
-
-                            source_path = os.path.join(source_path, path_slug)
-
-                            try:
-                                source_stats = os.stat(source_path)
-                            except FileNotFoundError:  # Thrown if file doesn't exist
+                            # Directory doesn't exist on source
+                            delete_entry(dest_entry, stub_path)
+                        elif dest_entry.is_file():
+                            if source_entry is None or source_is_dir:
                                 # If file doesn't exist on source, delete it
-                                file_list['delete'].add((drive, stub_path, file_stat.st_size))
-                                self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_DELETE, entry.path))
+                                delete_entry(dest_entry, stub_path)
                             else:
-                                if (file_stat.st_size != source_stats.st_size  # Existing file is different size than source
-                                        or file_stat.st_mtime != source_stats.st_mtime):  # Existing file is older than source
+                                try:
+                                    dest_stats = dest_entry.stat()
+                                    source_stats = source_entry.stat()
+                                except OSError:
+                                    continue
+
+                                if dest_stats.st_size != source_stats.st_size:  # Existing file is different size than source
+                                    file_list['replace'].add((drive, source, file_slug, source_stats.st_size, dest_stats.st_size))
+                                    self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_COPY, dest_entry.path))
+                                elif dest_stats.st_mtime_ns != source_stats.st_mtime_ns and not is_unchanged(stub_path, source_entry.path, dest_stats, source_stats):
                                     # If existing dest file is not same time as source, it needs to be replaced
-                                    file_list['replace'].add((drive, valid_source, path_slug, os.path.getsize(source_path), file_stat.st_size))
-                                    self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_COPY, entry.path))
-            except (NotADirectoryError, PermissionError, OSError):
-                return {
-                    'delete': set(),
-                    'replace': set()
-                }
+                                    file_list['replace'].add((drive, source, file_slug, source_stats.st_size, dest_stats.st_size))
+                                    self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_COPY, dest_entry.path))
+                                else:
+                                    if dest_stats.st_mtime_ns != source_stats.st_mtime_ns:  # Existing file is older than source, but the same
+                                        file_list['unchanged'].add((drive, source, file_slug, source_stats.st_size))
+
+                                    # Other links to the file can be linked to the copy that's already there
+                                    if source_stats.st_nlink > 1:
+                                        link_key = (source_stats.st_dev, source_stats.st_ino)
+                                        if link_key in new_link_targets:
+                                            # A new link was found first, so link it here instead of copying it.
+                                            # Links to it are followed through to here when they're made.
+                                            new_source, new_file, new_size = new_link_targets.pop(link_key)
+                                            file_list['new'].discard((drive, new_source, new_file, new_size))
+                                            file_list['new'].add((drive, new_source, new_file, 0))
+                                            file_list['link'][os.path.join(new_source, new_file)] = (stub_path, source_entry.path, new_size)
+                                            link_targets[link_key] = (stub_path, source_entry.path)
+                                        else:
+                                            link_targets.setdefault(link_key, (stub_path, source_entry.path))
+                                continue
+
+                    if source_entry is None:
+                        continue
+
+                    if source_is_dir:
+                        # Avoid recursing into any split sources and double counting files
+                        if stub_path not in sources:
+                            diff_source_directory(stub_path, source, dest_exists=False)
+                    else:
+                        # File doesn't exist in destination drive
+                        try:
+                            source_stats = source_entry.stat()
+                        except OSError:
+                            continue
+
+                        link_key = (source_stats.st_dev, source_stats.st_ino)
+                        if source_stats.st_nlink > 1 and link_key in link_targets:
+                            # Another link to the file is already on the drive, or being copied to it
+                            file_list['new'].add((drive, source, file_slug, 0))
+                            file_list['link'][stub_path] = (*link_targets[link_key], source_stats.st_size)
+                        else:
+                            if source_stats.st_nlink > 1:
+                                link_targets[link_key] = (stub_path, source_entry.path)
+                                new_link_targets[link_key] = (source, file_slug, source_stats.st_size)
+                            file_list['new'].add((drive, source, file_slug, source_stats.st_size))
+                        self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_COPY, os.path.join(drive, stub_path)))
+
+            diff_parent_directory('')
+
+            # Sources that aren't on the drive yet, and split sources inside folders that aren't
+            for source in sorted(sources):
+                if source not in sources_walked and os.path.isdir(self.get_source_source_path(source)):
+                    diff_source_directory(source, source, dest_exists=os.path.isdir(os.path.join(drive, source)))
+
             return file_list
 
-        def build_new_file_list(drive, path, sources: set, exclusions: list) -> dict:
-            """Get lists of files to copy to the destination drive, that only exist on the
-            source.
+        def find_moved_files(drive, file_list: dict) -> set:
+            """Find new files on a drive that are already on it under a path that's being deleted.
+
+            Files that were moved or renamed on a source show up as a new file, and
+            a file or folder to delete. If a deleted file has the same size as a
+            new file, and the same mtime within the drive's timestamp resolution,
+            it's moved on the drive instead of copying the new file again.
+
+            Matches are checked against the file's saved hash when the backup
+            runs, if the drive has one for it. Matched files are removed from the
+            new and delete lists, and the sizes of deleted folders are reduced by
+            the files moved out of them.
 
             Args:
                 drive (String): The drive to check.
-                path (String): The path to check.
-                sources (String[]): The list of sources the drive should contain.
-                exclusions (String[]): The list of files and folders to exclude.
+                file_list (dict): The file lists from build_file_lists().
 
             Returns:
-                dict: The file list for new files.
-                    new (set(tuple)): (drive, source, path, size).
+                set(tuple): (drive, old_path, source, path, size, digest) for each file to
+                    move, where digest is the saved hash of the file, or None.
             """
 
-            def scan_source_source_for_new_files(drive, source, path, exclusions: list, all_sources: set) -> dict:
-                """Get lists of files to copy to the destination drive from a given source.
+            if not self.config.get('detect_moves', True) or not file_list['delete'] or not file_list['new']:
+                return set()
+
+            new_sizes = {size for drive_path, source, file, size in file_list['new'] if size > 0}
+            if not new_sizes:
+                return set()
+
+            manifest = self.drive_manifests.get(drive)
+            mtime_tolerance = get_mtime_tolerance(drive)
+
+            def list_deleted_files(path) -> list:
+                """Get the files being deleted at a path on the drive, with their sizes and mtimes.
 
                 Args:
-                    drive (String): The drive to check.
-                    source (String): The source to check.
-                    path (String): The path to check.
-                    exclusions (String[]): The list of files and folders to exclude.
-                    all_sources (set): The list of sources the drive should contain, to
-                        avoid recursing into split sources.
+                    path (String): The deleted file or folder, relative to the drive.
 
                 Returns:
-                    dict: The file list for new files.
-                        new (set(tuple)): (drive, source, path, size).
+                    tuple[]: The path, size, and mtime_ns of each file.
                 """
 
-                file_list = {
-                    'new': set()
-                }
+                full_path = os.path.join(drive, path)
+                if os.path.isfile(full_path):
+                    try:
+                        file_stat = os.stat(full_path)
+                    except OSError:
+                        return []
+                    return [(path, file_stat.st_size, file_stat.st_mtime_ns)]
+
+                deleted_files = []
+                folders = [path]
+                while folders and not self.analysis_killed:
+                    folder = folders.pop()
+                    entries = manifest.list_directory(folder) if manifest is not None else None
+                    if entries is None:
+                        try:
+                            entries = list(os.scandir(os.path.join(drive, folder)))
+                        except OSError:
+                            continue
 
-                try:
-                    if self.analysis_killed:
-                        return file_list
+                    for entry in entries:
+                        if entry.is_dir():
+                            folders.append(os.path.join(folder, entry.name))
+                            continue
 
-                    source_path = self.get_source_source_path(source)
-                    source_path_len = len(source_path)
-                    source_path = os.path.join(source_path, path)
+                        try:
+                            entry_stat = entry.stat()
+                        except OSError:
+                            continue
+                        deleted_files.append((os.path.join(folder, entry.name), entry_stat.st_size, entry_stat.st_mtime_ns))
 
-                    # Check if directory has files
-                    source_file_list = os.scandir(source_path)
-                    for entry in source_file_list:
-                        stub_path = entry.path[source_path_len:].strip(os.path.sep)
+                return deleted_files
 
-                        # Skip over the config folder, and OS special folders
-                        if stub_path in self.SPECIAL_IGNORE_LIST:
-                            continue
+            # Group the deleted files by size, so that each new file is only compared with files it could match
+            deleted_files = {}
+            for drive_path, path, size in file_list['delete']:
+                for file, file_size, mtime_ns in list_deleted_files(path):
+                    if file_size in new_sizes:
+                        deleted_files.setdefault(file_size, []).append((file, mtime_ns, path))
 
-                        exclusion_stub_path = os.path.join(source, stub_path)
+            move_list = set()
+            moved_files = set()
+            moved_sizes = {}
+            for item in sorted(file_list['new'], key=lambda x: (x[1], x[2])):
+                if self.analysis_killed:
+                    break
 
-                        # Skip over any exclusions
-                        if exclusion_stub_path in exclusions:
-                            continue
+                drive_path, source, file, size = item
+                if size not in deleted_files:
+                    continue
 
-                        target_path = os.path.join(drive, source, stub_path)
+                try:
+                    source_mtime = os.stat(os.path.join(self.get_source_source_path(source), file)).st_mtime_ns
+                except OSError:
+                    continue
 
-                        if entry.is_dir():  # Entry is directory
-                            # Avoid recursing into any split sources and double counting files
-                            if exclusion_stub_path in all_sources:
-                                continue
+                candidates = [(old_file, mtime_ns, parent) for old_file, mtime_ns, parent in deleted_files[size] if old_file not in moved_files and abs(mtime_ns - source_mtime) <= mtime_tolerance]
 
-                            new_list = scan_source_source_for_new_files(drive, source, stub_path, exclusions, all_sources)
-                            file_list['new'].update(new_list['new'])
-                        elif not os.path.isfile(target_path):  # File doesn't exist in destination drive
-                            file_list['new'].add((drive, source, stub_path, entry.stat().st_size))
-                            self.progress['since_last_update']['analysis'].append((FileUtils.LIST_TOTAL_COPY, target_path))
-
-                    # If no files in folder on source, create empty folder in destination
-                    if not source_file_list and not os.path.isdir(os.path.join(drive, source, path)):
-                        return {
-                            'new': {(drive, source, path, get_directory_size(os.path.join(source_path, path)))}
-                        }
-                except (NotADirectoryError, PermissionError, OSError):
-                    return {
-                        'new': set()
-                    }
-                return file_list
+                # If more than one file could match, only move the one with the same name
+                if len(candidates) > 1:
+                    candidates = [candidate for candidate in candidates if os.path.normcase(os.path.basename(candidate[0])) == os.path.normcase(os.path.basename(file))]
+                if len(candidates) != 1:
+                    continue
 
-            file_list = {
-                'new': set()
-            }
+                old_file, mtime_ns, parent = candidates[0]
 
-            for source in sources:
-                if self.analysis_killed:
-                    break
+                # Saved hash is only useful if the file hasn't changed since it was hashed
+                digest = None
+                if drive in self.file_hashes:
+                    record = self.file_hashes[drive].get_record(old_file)
+                    if record is not None and record['size'] == size and record['mtime_ns'] == mtime_ns:
+                        digest = record['digest']
 
-                file_list['new'].update(scan_source_source_for_new_files(drive, source, path, exclusions, sources)['new'])
+                move_list.add((drive, old_file, source, file, size, digest))
+                moved_files.add(old_file)
+                moved_sizes[parent] = moved_sizes.get(parent, 0) + size
+                file_list['new'].discard(item)
 
-            return file_list
+            # Files that were moved don't need to be deleted, and don't count towards the folders they were in
+            for drive_path, path, size in list(file_list['delete']):
+                if path not in moved_sizes:
+                    continue
+
+                file_list['delete'].discard((drive_path, path, size))
+                if path not in moved_files:
+                    file_list['delete'].add((drive_path, path, max(0, size - moved_sizes[path])))
+
+            return move_list
 
         def start_building_file_lists():
             """Build the lists of files to be copied, modified, and deleted."""
@@ -872,7 +1354,23 @@ class Backup:
                 if self.analysis_killed:
                     break
 
-                modified_file_list = build_delta_file_list(self.DRIVE_VID_INFO[drive]['name'], '', sources, drive_exclusions[self.DRIVE_VID_INFO[drive]['name']])
+                modified_file_list = build_file_lists(self.DRIVE_VID_INFO[drive]['name'], sources, drive_exclusions[self.DRIVE_VID_INFO[drive]['name']])
+
+                # Build list of files to move, before anything they're moved out of is deleted
+                move_items = find_moved_files(self.DRIVE_VID_INFO[drive]['name'], modified_file_list)
+                if move_items:
+                    self.move_file_list[self.DRIVE_VID_INFO[drive]['name']] = move_items
+
+                    move_command_list.append({
+                        'enabled': True,
+                        'displayIndex': len(move_command_list) + 1,
+                        'type': Backup.COMMAND_TYPE_FILE_LIST,
+                        'dest': self.DRIVE_VID_INFO[drive]['name'],
+                        'size': sum((size for drive, old_file, source, file, size, digest in move_items)),
+                        'list': {os.path.join(drive, source, file) for drive, old_file, source, file, size, digest in move_items},
+                        'payload': move_items,
+                        'mode': Status.FILE_OPERATION_MOVE
+                    })
 
                 delete_items = modified_file_list['delete']
                 if delete_items:
@@ -889,6 +1387,12 @@ class Backup:
                         'mode': Status.FILE_OPERATION_DELETE
                     })
 
+                if modified_file_list['unchanged']:
+                    self.unchanged_file_list[self.DRIVE_VID_INFO[drive]['name']] = modified_file_list['unchanged']
+
+                if modified_file_list['link']:
+                    self.link_file_list[self.DRIVE_VID_INFO[drive]['name']] = modified_file_list['link']
+
                 # Build list of files to replace
                 replace_items = list(modified_file_list['replace'])
                 replace_items.sort(key=lambda x: x[1])
@@ -907,7 +1411,7 @@ class Backup:
                     })
 
                 # Build list of new files to copy
-                new_items = build_new_file_list(self.DRIVE_VID_INFO[drive]['name'], '', sources, drive_exclusions[self.DRIVE_VID_INFO[drive]['name']])['new']
+                new_items = modified_file_list['new']
                 if new_items:
                     self.new_file_list[self.DRIVE_VID_INFO[drive]['name']] = new_items
 
@@ -926,12 +1430,22 @@ class Backup:
         self.delete_file_list = {}
         self.replace_file_list = {}
         self.new_file_list = {}
+        self.unchanged_file_list = {}
+        self.move_file_list = {}
+        self.link_file_list = {}
+        move_command_list = []
         purge_command_list = []
         copy_command_list = []
         logging.debug('Delta file lists starting...')
         start_building_file_lists()
         logging.debug('Delta file lists finished')
 
+        for snapshot in source_snapshots.values():
+            snapshot.close()
+
+        if self.source_hashes is not None:
+            self.source_hashes.commit()
+
         # Gather and summarize totals for analysis summary
         show_file_info = []
         for i, drive in enumerate(drive_source_list.keys()):
@@ -943,9 +1457,15 @@ class Backup:
                 'delete': 0,
                 'replace': 0,
                 'copy': 0,
-                'new': 0
+                'new': 0,
+                'move': 0
             }
 
+            if self.DRIVE_VID_INFO[drive]['name'] in self.move_file_list.keys():
+                drive_total['move'] = sum((size for drive, old_file, source, file, size, digest in self.move_file_list[self.DRIVE_VID_INFO[drive]['name']]))
+
+                file_summary.append(f"Moving {len(self.move_file_list[self.DRIVE_VID_INFO[drive]['name']])} files instead of copying ({human_filesize(drive_total['move'])} saved)")
+
             if self.DRIVE_VID_INFO[drive]['name'] in self.delete_file_list.keys():
                 drive_total['delete'] = sum((size for drive, file, size in self.delete_file_list[self.DRIVE_VID_INFO[drive]['name']]))
 
@@ -969,17 +1489,28 @@ class Backup:
 
                 file_summary.append(f"{len(self.new_file_list[self.DRIVE_VID_INFO[drive]['name']])} new files ({human_filesize(drive_total['new'])})")
 
+            if self.DRIVE_VID_INFO[drive]['name'] in self.link_file_list.keys():
+                link_total = sum((size for target, target_src, size in self.link_file_list[self.DRIVE_VID_INFO[drive]['name']].values()))
+
+                file_summary.append(f"Linking {len(self.link_file_list[self.DRIVE_VID_INFO[drive]['name']])} hardlinked files instead of copying ({human_filesize(link_total)} saved)")
+
+            if self.DRIVE_VID_INFO[drive]['name'] in self.unchanged_file_list.keys():
+                unchanged_total = sum((size for drive, source, file, size in self.unchanged_file_list[self.DRIVE_VID_INFO[drive]['name']]))
+
+                file_summary.append(f"Skipped {len(self.unchanged_file_list[self.DRIVE_VID_INFO[drive]['name']])} unchanged files with different timestamps ({human_filesize(unchanged_total)})")
+
             # Increment master totals
             # Double copy total to account for both copy and verify operations
-            self.progress['total'] += 2 * drive_total['copy'] + drive_total['delete']
+            self.progress['total'] += 2 * drive_total['copy'] + drive_total['delete'] + drive_total['move']
             self.progress['delete_total'] += drive_total['delete']
 
             if file_summary:
                 show_file_info.append((self.DRIVE_VID_INFO[drive]['name'], '\n'.join(file_summary)))
 
         if not self.analysis_killed:
-            # Concat both lists into command list
-            self.command_list = [cmd for cmd in purge_command_list]
+            # Concat lists into command list, moving files before their old folders are deleted
+            self.command_list = [cmd for cmd in move_command_list]
+            self.command_list.extend([cmd for cmd in purge_command_list])
             self.command_list.extend([cmd for cmd in copy_command_list])
 
             # Fix display index on command list
@@ -1037,11 +1568,321 @@ class Backup:
                     drive_config_file.set(drive_vid, 'serial', 'Unknown')
                     drive_config_file.set(drive_vid, 'capacity', capacity)
 
+    def run_command(self, cmd):
+        """Run a single command from the command list.
+
+        Args:
+            cmd (dict): The command to run.
+        """
+
+        if cmd['type'] != Backup.COMMAND_TYPE_FILE_LIST:
+            return
+
+        with self.progress_lock:
+            self.progress['since_last_update']['commands'].append(cmd['displayIndex'])
+
+        if cmd['mode'] == Status.FILE_OPERATION_DELETE:
+            for drive, file, size in cmd['payload']:
+                if self.run_killed:
+                    break
+
+                self.do_del_fn(
+                    filename=os.path.join(drive, file),
+                    size=size,
+                    drive=drive,
+                    display_index=cmd['displayIndex']
+                )
+
+                if not os.path.exists(os.path.join(drive, file)) and drive in self.drive_manifests:
+                    self.drive_manifests[drive].remove([file])
+
+                # If file hash was in list, remove it
+                if file in self.file_hashes[drive]:
+                    del self.file_hashes[drive][file]
+        elif cmd['mode'] == Status.FILE_OPERATION_MOVE:
+            self.move_file_list_on_drive(cmd['payload'], display_index=cmd['displayIndex'])
+        elif cmd['mode'] == Status.FILE_OPERATION_UPDATE:
+            self.copy_file_list(
+                file_list=[(drive, source, file, source_size) for drive, source, file, source_size, dest_size in cmd['payload']],
+                operation=Status.FILE_OPERATION_UPDATE,
+                display_index=cmd['displayIndex']
+            )
+        elif cmd['mode'] == Status.FILE_OPERATION_COPY:
+            self.copy_file_list(
+                file_list=cmd['payload'],
+                operation=Status.FILE_OPERATION_COPY,
+                display_index=cmd['displayIndex']
+            )
+
+    def move_file_list_on_drive(self, file_list, display_index: int = None):
+        """Move files that are already on a drive to their new paths.
+
+        If the file has a saved hash, the source is hashed first to make sure
+        it's the same file. If it's not, or the file can't be moved, the old
+        file is deleted and the source is copied instead.
+
+        Args:
+            file_list (tuple[]): The files to move, as (drive, old_file, source, file, size, digest).
+            display_index (int): The index to display the item in the GUI (optional).
+        """
+
+        for drive, old_file, source, file, size, digest in file_list:
+            if self.run_killed:
+                break
+
+            src = os.path.join(self.get_source_source_path(source), file)
+            old_path = os.path.join(drive, old_file)
+            dest = os.path.join(drive, source, file)
+
+            self.set_working_file(dest, size, Status.FILE_OPERATION_MOVE, display_index)
+
+            try:
+                if digest is not None and self.get_source_hash(src, self.get_kill_flag) != digest:
+                    raise ValueError('Source file does not match the file on the drive')
+
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.rename(old_path, dest)
+            except (OSError, ValueError):
+                if self.run_killed:
+                    break
+
+                # Old file is being deleted either way, so copy the source instead,
+                # and count the copy and verify towards the total
+                with self.progress_lock:
+                    self.progress['total'] += size
+
+                do_delete(filename=old_path)
+                if drive in self.drive_manifests:
+                    self.drive_manifests[drive].remove([old_file])
+                if old_file in self.file_hashes[drive]:
+                    del self.file_hashes[drive][old_file]
+
+                self.copy_file_list([(drive, source, file, size)], Status.FILE_OPERATION_COPY, display_index)
+                continue
+
+            self.file_hashes[drive].move(old_file, os.path.join(source, file))
+            if drive in self.drive_manifests:
+                self.drive_manifests[drive].remove([old_file])
+                self.drive_manifests[drive].add_files([os.path.join(source, file)])
+
+            self.update_copy_lists(Status.FILE_OPERATION_SUCCESS, (dest, size, Status.FILE_OPERATION_MOVE, display_index), drive=drive)
+
+    def copy_file_list(self, file_list, operation, display_index: int = None):
+        """Copy a list of files to a destination, batching small files together.
+
+        Args:
+            file_list (tuple[]): The files to copy, as (drive, source, file, size).
+            operation (int): The status code for the file operation.
+            display_index (int): The index to display the item in the GUI (optional).
+        """
+
+        small_file_list = {}
+
+        def save_copied_files(drive, file_hashes: dict):
+            """Save the hashes of copied files, and add them to the drive manifest.
+
+            Args:
+                drive (String): The drive the files were copied to.
+                file_hashes (dict): The hashes of the files that were copied.
+            """
+
+            self.file_hashes[drive].update(file_hashes)
+
+            if drive in self.drive_manifests:
+                self.drive_manifests[drive].add_files(list(file_hashes.keys()))
+
+        def copy_small_file_batch(drive):
+            """Copy the pending small files for a drive, and save their hashes.
+
+            Args:
+                drive (String): The drive to copy small files to.
+            """
+
+            batch = small_file_list.pop(drive, [])
+            if not batch:
+                return
+
+            file_hashes = copy_small_files(
+                file_list=batch,
+                drive_path=drive,
+                pre_callback=lambda filename, size: self.set_working_file(filename, size, operation, display_index),
+                prog_callback=lambda c, t, op: self.set_copy_progress(
+                    copied=c,
+                    total=t,
+                    operation=op,
+                    display_index=display_index,
+                    drive=drive
+                ),
+                fd_callback=lambda status, file: self.update_copy_lists(status, (file[0], file[1], file[2], display_index), drive=drive),
+                get_backup_killflag=self.get_kill_flag
+            )
+            save_copied_files(drive, file_hashes)
+
+        def link_file_item(drive, source, file):
+            """Link a hardlinked file to the copy of it that's already on the drive.
+
+            If the file can't be linked, it's copied instead.
+
+            Args:
+                drive (String): The drive to link the file on.
+                source (String): The source the file is in.
+                file (String): The path of the file, relative to the source.
+            """
+
+            src = os.path.join(self.get_source_source_path(source), file)
+            dest = os.path.join(drive, source, file)
+
+            link_list = self.link_file_list[drive]
+            target, target_src, size = link_list[os.path.join(source, file)]
+
+            # Files that were linked instead of copied are followed through to the copy they're linked to
+            while target in link_list:
+                target, target_src, size = link_list[target]
+
+            self.set_working_file(dest, size, operation, display_index)
+
+            digest = self.file_hashes[drive].get(target)
+            try:
+                # The source has to still be the same file, since its inode could have been reused
+                linked = (digest is not None and os.path.samefile(src, target_src)
+                          and os.path.getsize(os.path.join(drive, target)) == os.path.getsize(src)
+                          and link_file(os.path.join(drive, target), dest))
+            except OSError:
+                linked = False
+
+            if not linked:
+                file_hashes = self.do_copy_fn(
+                    src=src,
+                    dest=dest,
+                    drive_path=drive,
+                    display_index=display_index
+                )
+                save_copied_files(drive, file_hashes)
+                return
+
+            # Links are counted as 0 bytes in the analysis totals, since nothing is written
+            save_copied_files(drive, {os.path.join(source, file): digest})
+            self.update_copy_lists(Status.FILE_OPERATION_SUCCESS, (dest, 0, Status.FILE_OPERATION_COPY, display_index), drive=drive)
+
+        # Hardlinks are made once everything else is copied, so the files they link to are there
+        pending_links = []
+
+        # Files that aren't batched, in the order they're copied, so the next one can be prefetched
+        large_file_list = [(source, file) for drive, source, file, size in file_list if size > FileUtils.SMALL_FILE_THRESHOLD]
+        large_file_index = 0
+
+        for drive, source, file, size in file_list:
+            if self.run_killed:
+                break
+
+            if os.path.join(source, file) in self.link_file_list.get(drive, {}):
+                pending_links.append((drive, source, file))
+                continue
+
+            src = os.path.join(self.get_source_source_path(source), file)
+            dest = os.path.join(drive, source, file)
+
+            if size > FileUtils.SMALL_FILE_THRESHOLD:
+                large_file_index += 1
+
+                # Start reading the next file while this one is copied
+                if self.config.get('cache_hints', False) and large_file_index < len(large_file_list):
+                    next_source, next_file = large_file_list[large_file_index]
+                    prefetch_file(os.path.join(self.get_source_source_path(next_source), next_file))
+
+            # Small files are batched, since the per-file overhead of a full copy outweighs the copy itself
+            if size <= FileUtils.SMALL_FILE_THRESHOLD and os.path.isfile(src):
+                small_file_list.setdefault(drive, []).append((src, dest, size))
+
+                if len(small_file_list[drive]) >= FileUtils.SMALL_FILE_BATCH_SIZE:
+                    copy_small_file_batch(drive)
+
+                continue
+
+            # Large files that changed are updated in place, since usually only part
+            # of them changed, and interrupted copies are resumed from their last checkpoint.
+            # Files linked to other files on the drive are copied, so the links aren't changed.
+            if operation == Status.FILE_OPERATION_UPDATE and size >= FileUtils.CHUNK_THRESHOLD and os.path.isfile(dest) and not is_hardlinked(dest):
+                chunk_digests = self.get_file_chunks(drive, os.path.join(source, file))
+
+                if self.config.get('delta_update', True) or chunk_digests is not None:
+                    self.set_working_file(dest, size, operation, display_index)
+                    file_hashes = self.do_delta_update_fn(
+                        src=src,
+                        dest=dest,
+                        drive_path=drive,
+                        chunk_digests=chunk_digests,
+                        display_index=display_index
+                    )
+                    save_copied_files(drive, file_hashes)
+                    continue
+
+            self.set_working_file(dest, size, operation, display_index)
+
+            # New files that are already on the drive somewhere else are linked or cloned instead
+            if operation == Status.FILE_OPERATION_COPY and self.config.get('dedup', False) and size >= FileUtils.DEDUP_THRESHOLD:
+                file_hashes = self.dedup_file(src, dest, drive, display_index)
+                if file_hashes is not None:
+                    save_copied_files(drive, file_hashes)
+                    continue
+
+            file_hashes = self.do_copy_fn(
+                src=src,
+                dest=dest,
+                drive_path=drive,
+                display_index=display_index
+            )
+            save_copied_files(drive, file_hashes)
+
+        for drive in list(small_file_list.keys()):
+            if self.run_killed:
+                break
+
+            copy_small_file_batch(drive)
+
+        for drive, source, file in pending_links:
+            if self.run_killed:
+                break
+
+            link_file_item(drive, source, file)
+
+    def run_command_list(self, command_list: list):
+        """Run a list of commands in order, stopping if the backup is killed.
+
+        If a command fails with an error, the rest of the commands for its drive
+        are skipped, and the error is saved in failed_drives, so that the other
+        drives are still backed up.
+
+        Args:
+            command_list (dict[]): The commands to run.
+        """
+
+        for cmd in command_list:
+            if cmd['dest'] in self.failed_drives:
+                continue
+
+            try:
+                self.run_command(cmd)
+            except Exception as error:
+                logging.exception('Backup to %s failed, skipping the rest of the drive', cmd['dest'])
+                self.failed_drives[cmd['dest']] = error
+
+            # Command is done, so stop showing progress for its drive
+            self.progress['buffers'].pop(cmd['dest'], None)
+            self.backup_callback_fn(cmd)
+
+            if self.run_killed:
+                break
+
     def run(self):
         """Once the backup analysis is run, and drives and sources are selected, run the backup.
 
         This function is run in a new thread, but is only run if the backup config is valid.
         If sanity_check() returns False, the backup isn't run.
+
+        If more than one drive worker is allowed in the config, the commands for
+        each destination drive are run in order on their own worker thread, so
+        that drives are written to in parallel.
         """
 
         # FIXME: When stopping and starting backup after analysis in quick succession, program sometimes crashes
@@ -1050,10 +1891,19 @@ class Backup:
             return
 
         self.run_killed = False
+        self.failed_drives = {}
         self.backup_running = True
         self.timer.start()
         self.status = Status.BACKUP_BACKUP_RUNNING
 
+        # Everything is closed when a backup finishes, so open it again if the backup is run again
+        if not self.file_hashes:
+            self.file_hashes = {drive['name']: HashStore(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE), root=drive['name']) for drive in self.config['destinations']}
+        if not self.drive_manifests:
+            self.drive_manifests = {drive['name']: DriveManifest(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_MANIFEST_FILE), root=drive['name']) for drive in self.config['destinations']}
+        if self.source_hashes is None and self.config.get('source_hash_cache') and self.config.get('source_hash_file'):
+            self.source_hashes = SourceHashCache(self.config['source_hash_file'])
+
         # Write config file to drives
         self.write_config_to_disks()
 
@@ -1061,6 +1911,7 @@ class Backup:
         self.progress['current_file'] = None
         self.progress['files'] = []
         self.progress['since_last_update']['files'] = []
+        self.progress['since_last_update']['commands'] = []
         self.progress['buffer'] = {
             'copied': 0,
             'total': 0,
@@ -1068,91 +1919,70 @@ class Backup:
             'operation': None,
             'display_index': None
         }
-
+        self.progress['buffers'] = {}
+        self.progress['bytes_copied'] = 0
+        self.progress['bytes_written'] = 0
+        self.progress['sparse_skipped'] = 0
+        self.progress['dedup_saved'] = 0
+
+        # Group commands by destination, keeping the order of commands for each drive
+        drive_command_list = {}
         for cmd in self.command_list:
-            if cmd['type'] == Backup.COMMAND_TYPE_FILE_LIST:
-                self.progress['command_display_index'] = cmd['displayIndex']
-
-                if cmd['mode'] == Status.FILE_OPERATION_DELETE:
-                    for drive, file, size in cmd['payload']:
-                        if self.run_killed:
-                            break
-
-                        self.do_del_fn(
-                            filename=os.path.join(drive, file),
-                            size=size,
-                            display_index=cmd['displayIndex']
-                        )
-
-                        # If file hash was in list, remove it, and write changes to file
-                        if file in self.file_hashes[drive].keys():
-                            del self.file_hashes[drive][file]
-
-                            drive_hash_file_path = os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE)
-                            with open(drive_hash_file_path, 'wb') as f:
-                                hash_list = {'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in self.file_hashes[drive].items()}
-                                pickle.dump(hash_list, f)
-                if cmd['mode'] == Status.FILE_OPERATION_UPDATE:
-                    for drive, source, file, source_size, dest_size in cmd['payload']:
-                        if self.run_killed:
-                            break
-
-                        source_path = self.get_source_source_path(source)
-
-                        dest = os.path.join(drive, source, file)
-
-                        self.set_working_file(dest, source_size, Status.FILE_OPERATION_UPDATE, cmd['displayIndex'])
-                        file_hashes = self.do_copy_fn(
-                            src=os.path.join(source_path, file),
-                            dest=dest,
-                            drive_path=drive,
-                            display_index=cmd['displayIndex']
-                        )
-                        self.file_hashes[drive].update(file_hashes)
-
-                        # Write updated hash file to drive
-                        drive_hash_file_path = os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE)
-                        with open(drive_hash_file_path, 'wb') as f:
-                            hash_list = {'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in self.file_hashes[drive].items()}
-                            pickle.dump(hash_list, f)
-                elif cmd['mode'] == Status.FILE_OPERATION_COPY:
-                    for drive, source, file, size in cmd['payload']:
-                        if self.run_killed:
-                            break
-
-                        source_path = self.get_source_source_path(source)
-
-                        dest = os.path.join(drive, source, file)
-
-                        self.set_working_file(dest, size, Status.FILE_OPERATION_COPY, cmd['displayIndex'])
-                        file_hashes = self.do_copy_fn(
-                            src=os.path.join(source_path, file),
-                            dest=dest,
-                            drive_path=drive,
-                            display_index=cmd['displayIndex']
-                        )
-                        self.file_hashes[drive].update(file_hashes)
-
-                        # Write updated hash file to drive
-                        drive_hash_file_path = os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE)
-                        with open(drive_hash_file_path, 'wb') as f:
-                            hash_list = {'/'.join(file_name.split(os.path.sep)): hash_val for file_name, hash_val in self.file_hashes[drive].items()}
-                            pickle.dump(hash_list, f)
+            drive_command_list.setdefault(cmd['dest'], []).append(cmd)
 
-            self.backup_callback_fn(cmd)
+        max_drive_workers = min(self.config.get('max_drive_workers', 1), len(drive_command_list))
 
-            if self.run_killed:
-                break
+        # Drives are cleaned up and released even if the backup stops with an error,
+        # so the UI isn't left showing it as running
+        commands_done = False
+        try:
+            if max_drive_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_drive_workers, thread_name_prefix='Backup Drive') as executor:
+                    drive_workers = [executor.submit(self.run_command_list, command_list) for command_list in drive_command_list.values()]
+
+                    # Wait for all drives, and raise any exceptions from the workers
+                    for worker in drive_workers:
+                        worker.result()
+            else:
+                self.run_command_list(self.command_list)
 
-        self.timer.stop()
+            commands_done = True
+        finally:
+            self.timer.stop()
 
-        if not self.run_killed:
-            self.status = Status.BACKUP_BACKUP_FINISHED
-        if self.run_killed:
-            self.status = Status.BACKUP_BACKUP_ABORTED
+            self.progress['bytes_copied'], self.progress['bytes_written'] = self.get_bytes_copied()
+            if self.progress['sparse_skipped']:
+                logging.info('Copied %s of data, writing %s, and skipped writing %s of holes in sparse files', human_filesize(self.progress['bytes_copied']),
+                             human_filesize(self.progress['bytes_written']), human_filesize(self.progress['sparse_skipped']))
+            if self.progress['dedup_saved']:
+                logging.info('Linked or cloned %s of files already on the destination instead of copying them', human_filesize(self.progress['dedup_saved']))
 
-        self.backup_running = False
-        self.backup_callback_fn()
+            # Files on the drives may have been overwritten in place, which the size index can't detect
+            for drive in drive_command_list:
+                self.size_index.invalidate(drive)
+
+            # Manifests are up to date with the drives, so mark them as trusted for the next analysis.
+            # A stopped or failed backup may have left changes half done, so its manifests are left untrusted
+            for drive in self.config['destinations']:
+                if not commands_done or self.run_killed or drive['name'] in self.failed_drives or drive['name'] not in self.drive_manifests:
+                    continue
+
+                manifest = self.drive_manifests[drive['name']]
+                manifest.set_generation(manifest.generation + 1)
+
+                drive_config_file = Config(os.path.join(drive['name'], self.BACKUP_CONFIG_DIR, self.BACKUP_CONFIG_FILE))
+                drive_config_file.set('manifest', 'generation', manifest.generation)
+
+            # Release the drives, so they can be ejected once the backup is done
+            self.close()
+
+            if commands_done and not self.run_killed:
+                self.status = Status.BACKUP_BACKUP_FINISHED
+            else:
+                self.status = Status.BACKUP_BACKUP_ABORTED
+
+            self.backup_running = False
+            self.backup_callback_fn()
 
     def add_progress_delta_to_total(self):
         """Add the progress delta to the total, and reset the buffer.
@@ -1165,6 +1995,33 @@ class Backup:
         # Clear buffer
         self.progress['since_last_update']['analysis'].clear()
         self.progress['since_last_update']['files'].clear()
+        self.progress['since_last_update']['commands'].clear()
+
+    def get_bytes_copied(self) -> tuple:
+        """Get the logical and physical size of the data copied so far.
+
+        Returns:
+            tuple: The size of the data copied, counting holes in sparse files, and
+                the number of bytes written for it, leaving them out.
+        """
+
+        with self.progress_lock:
+            file_list = [file['file'] for file in self.progress['files'] + self.progress['since_last_update']['files']]
+            buffers = list(self.progress['buffers'].values())
+            sparse_skipped = self.progress['sparse_skipped']
+
+        bytes_copied = sum([filesize for (filename, filesize, operation, display_index) in file_list if operation == Status.FILE_OPERATION_COPY])
+
+        # Count the data copied so far of files being copied, and all of files being
+        # verified. Buffers of files that are done are reset, and already counted above
+        for buffer in buffers:
+            if buffer['operation'] == Status.FILE_OPERATION_COPY:
+                bytes_copied += buffer['copied']
+            elif buffer['operation'] == Status.FILE_OPERATION_VERIFY and buffer['copied']:
+                bytes_copied += buffer['total']
+
+        # Holes in sparse files count towards the data copied, but aren't written
+        return (bytes_copied, max(0, bytes_copied - sparse_skipped))
 
     def get_progress_updates(self) -> dict:
         """Get the current progress of the backup, and file lists since the
@@ -1174,27 +2031,55 @@ class Backup:
             dict: The current progress of the backup
         """
 
-        current_progress = {
-            'delta': {
-                'analysis': self.progress['since_last_update']['analysis'].copy(),
-                'files': self.progress['since_last_update']['files'].copy()
+        with self.progress_lock:
+            current_progress = {
+                'delta': {
+                    'analysis': self.progress['since_last_update']['analysis'].copy(),
+                    'files': self.progress['since_last_update']['files'].copy(),
+                    'commands': self.progress['since_last_update']['commands'].copy()
+                }
             }
-        }
 
-        self.add_progress_delta_to_total()
+            self.add_progress_delta_to_total()
 
         # Set progress to all processed files
         file_list = [file['file'] for file in self.progress['files']]
         self.progress['current'] = sum([filesize for (filename, filesize, operation, display_index) in file_list if operation == Status.FILE_OPERATION_DELETE])
         self.progress['current'] += sum([2 * filesize for (filename, filesize, operation, display_index) in file_list if operation == Status.FILE_OPERATION_COPY])
+        self.progress['current'] += sum([filesize for (filename, filesize, operation, display_index) in file_list if operation == Status.FILE_OPERATION_MOVE])
+
+        # Add copy buffers to progress total, counting the copy half of files
+        # that are already being verified
+        for buffer in list(self.progress['buffers'].values()):
+            self.progress['current'] += buffer['copied']
+            if buffer['operation'] == Status.FILE_OPERATION_VERIFY:
+                self.progress['current'] += buffer['total']
 
-        # Add copy buffer to progress total
-        self.progress['current'] += self.progress['buffer']['copied']
+        self.progress['bytes_copied'], self.progress['bytes_written'] = self.get_bytes_copied()
 
         current_progress['total'] = self.progress
 
         return current_progress
 
+    def close(self):
+        """Close the hash store and manifest of each drive, and the source hash cache, so
+        that the drives and sources aren't held open.
+
+        Anything that's closed is opened again by the next analysis or backup.
+        """
+
+        if self.source_hashes is not None:
+            self.source_hashes.close()
+            self.source_hashes = None
+
+        for drive_hash_store in self.file_hashes.values():
+            drive_hash_store.close()
+        self.file_hashes = {}
+
+        for manifest in self.drive_manifests.values():
+            manifest.close()
+        self.drive_manifests = {}
+
     @property
     def running(self) -> bool:
         """
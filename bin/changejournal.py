@@ -0,0 +1,530 @@
+"""Watch source trees for changes, and record them in a change journal for analysis.
+
+Run from the repository root on Linux, with the folder the journals are kept in,
+and each source to watch:
+
+    python -m bin.changejournal --journal-dir ~/.config/BackDrop/journals /mnt/data /home/user
+
+The watcher is meant to run in the background between backups. BackDrop reads
+the journals in the same folder when the `change_journal` option is on, as long
+as it's set as the `journal_dir`.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import platform
+import select
+import signal
+import sqlite3
+import struct
+import threading
+import uuid
+from blake3 import blake3
+if platform.system() != 'Windows':
+    import fcntl
+
+from bin.database import open_database
+
+
+def get_journal_filename(journal_dir, source_path) -> str:
+    """Get the path of the change journal for a source.
+
+    Args:
+        journal_dir (String): The folder the journals are kept in.
+        source_path (String): The path of the source.
+
+    Returns:
+        String: The path of the journal file.
+    """
+
+    journal_name = blake3(os.path.normcase(os.path.abspath(source_path)).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(journal_dir, f'{journal_name}.db')
+
+
+class ChangeJournal:
+    """A persistent record of the folders that changed in a source, backed by SQLite.
+
+    The journal is written by a ChangeWatcher, and read by analysis. Each time
+    analysis reads it, the folders it lists are marked as changed in the source
+    snapshot, and dropped from the journal.
+
+    The journal is only complete if the same watcher has been running since the
+    last time it was read, and hasn't missed any events. The watcher holds a lock
+    on the journal for as long as it runs, so a watcher that stopped or crashed
+    is always noticed. Otherwise, the source has to be checked in full.
+    """
+
+    def __init__(self, filename):
+        """Open a change journal, creating it if it doesn't exist.
+
+        Args:
+            filename (String): The path of the journal file.
+        """
+
+        self.filename = filename
+        self.lock_filename = f'{filename}.lock'
+        self._lock = threading.RLock()
+        self._lock_file = None
+
+        # The watcher and analysis use the journal from different processes
+        self._conn = open_database(self.filename, self._init_database, timeout=30)
+
+    def _init_database(self, conn: sqlite3.Connection):
+        """Set up a new connection to the journal, and create the tables if needed.
+
+        Args:
+            conn (sqlite3.Connection): The new connection.
+        """
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS dirty (
+            path TEXT PRIMARY KEY,
+            seq INTEGER
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS unwatched (
+            path TEXT PRIMARY KEY
+        ) WITHOUT ROWID''')
+        conn.commit()
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def close(self):
+        """Commit any changes, and close the journal."""
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def is_watched(self) -> bool:
+        """Check if a watcher is running for the journal.
+
+        Returns:
+            bool: Whether a watcher holds the lock on the journal.
+        """
+
+        if platform.system() == 'Windows' or not os.path.isfile(self.lock_filename):
+            return False
+
+        with open(self.lock_filename, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+        return False
+
+    def start_watch(self):
+        """Take the lock on the journal, and start a new watch.
+
+        Until set_ready() is called, the journal isn't complete.
+
+        Raises:
+            BlockingIOError: If another watcher is running for the journal.
+        """
+
+        if self._lock_file is None:
+            lock_file = open(self.lock_filename, 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise
+            self._lock_file = lock_file
+
+        with self._lock, self._conn:
+            self._set_meta('watch_id', uuid.uuid4().hex)
+            self._set_meta('ready', False)
+            self._conn.execute('DELETE FROM unwatched')
+
+    def stop_watch(self):
+        """End the current watch, and release the lock on the journal."""
+
+        with self._lock, self._conn:
+            self._set_meta('ready', False)
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def set_ready(self, ready: bool = True):
+        """Mark whether every folder in the source is being watched.
+
+        Args:
+            ready (bool): Whether the watch is complete (default: True).
+        """
+
+        with self._lock, self._conn:
+            self._set_meta('ready', ready)
+
+    def record(self, dirty: set, unwatched: set = None, overflow: bool = False):
+        """Record folders that changed.
+
+        Args:
+            dirty (set): The folders that changed, relative to the source.
+            unwatched (set): Folders that can't be watched, relative to the source (optional).
+            overflow (bool): Whether any events were lost (default: False).
+        """
+
+        with self._lock, self._conn:
+            seq = self._get_meta('seq', 0) + 1
+            self._set_meta('seq', seq)
+
+            self._conn.executemany('INSERT OR REPLACE INTO dirty (path, seq) VALUES (?, ?)', [(path, seq) for path in dirty])
+            if unwatched:
+                self._conn.executemany('INSERT OR IGNORE INTO unwatched (path) VALUES (?)', [(path,) for path in unwatched])
+            if overflow:
+                self._set_meta('overflow_seq', seq)
+
+    def get_changes(self) -> dict:
+        """Get the folders that changed since the journal was last read.
+
+        Returns:
+            dict: The changes in the journal.
+                dirty (set): The folders that changed, relative to the source.
+                unwatched (String[]): Folders that aren't watched, and have to be
+                    checked on every analysis.
+                complete (bool): Whether the journal has every change since it was
+                    last read. If not, the source has to be checked in full.
+                marker (tuple): The point the journal was read up to, for mark_read().
+        """
+
+        watching = self.is_watched()
+
+        with self._lock:
+            watch_id = self._get_meta('watch_id')
+            ready = bool(self._get_meta('ready', False)) and watching
+            seq = self._get_meta('seq', 0)
+
+            complete = (ready and watch_id is not None
+                        and self._get_meta('read_watch_id') == watch_id
+                        and not self._get_meta('overflow_seq', 0))
+
+            dirty = {path for (path,) in self._conn.execute('SELECT path FROM dirty WHERE seq <= ?', (seq,))}
+            unwatched = [path for (path,) in self._conn.execute('SELECT path FROM unwatched')]
+
+        return {
+            'dirty': dirty,
+            'unwatched': unwatched,
+            'complete': complete,
+            'marker': (watch_id if ready else None, seq)
+        }
+
+    def mark_read(self, marker: tuple):
+        """Drop the changes that were read, once they're saved somewhere else.
+
+        If every folder was being watched when the journal was read, the journal
+        is complete from then on, until the watcher stops or misses events.
+
+        Args:
+            marker (tuple): The marker from get_changes().
+        """
+
+        watch_id, seq = marker
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dirty WHERE seq <= ?', (seq,))
+
+            if self._get_meta('overflow_seq', 0) <= seq:
+                self._set_meta('overflow_seq', 0)
+
+            if watch_id is not None and self._get_meta('watch_id') == watch_id:
+                self._set_meta('read_watch_id', watch_id)
+
+
+class ChangeWatcher:
+    """Watches a source tree with inotify, and records the folders that change in a ChangeJournal.
+
+    Every folder in the tree gets its own watch. Changes to files mark their
+    folder as changed, and new folders are watched as they're created. If the
+    kernel drops events, or a folder can't be watched, the journal is marked as
+    incomplete so that the next analysis checks the source in full.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_UNMOUNT = 0x00002000
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+    EVENT_HEADER = struct.Struct('iIII')
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, root, journal: ChangeJournal):
+        """Create a watcher for a source.
+
+        Args:
+            root (String): The path of the source to watch.
+            journal (ChangeJournal): The journal to record changes in.
+        """
+
+        self.root = root
+        self.journal = journal
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = None
+        self._watches = {}  # Folder paths relative to the source, keyed by watch descriptor
+        self._dirty = set()
+        self._unwatched = set()
+        self._overflow = False
+        self._complete = True
+
+    def fileno(self) -> int:
+        return self._fd
+
+    @staticmethod
+    def _join(dir_path, name) -> str:
+        return f'{dir_path}/{name}' if dir_path else name
+
+    def start(self):
+        """Start a new watch, and add a watch to every folder in the source.
+
+        Raises:
+            BlockingIOError: If another watcher is running for the source.
+            OSError: If inotify isn't available.
+        """
+
+        if self._fd is not None:
+            os.close(self._fd)
+        self._watches = {}
+        self._complete = True
+
+        self.journal.start_watch()
+
+        self._fd = self._libc.inotify_init1(ChangeWatcher.IN_NONBLOCK | ChangeWatcher.IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1 failed: {os.strerror(err)}')
+
+        self._add_tree('', mark_dirty=False)
+        self.flush()
+        self.journal.set_ready(self._complete)
+
+        logging.info('Watching %d folders in %s', len(self._watches), self.root)
+
+    def stop(self):
+        """Remove all watches, and end the watch in the journal."""
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+        self.flush()
+        self.journal.stop_watch()
+
+    def _add_tree(self, db_path, mark_dirty: bool = True):
+        """Watch a folder and every folder in it.
+
+        Args:
+            db_path (String): The folder to watch, relative to the source.
+            mark_dirty (bool): Whether to mark each folder as changed (default: True).
+        """
+
+        folders = [db_path]
+        while folders:
+            folder = folders.pop()
+            full_path = os.path.join(self.root, *folder.split('/'))
+
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(full_path), ChangeWatcher.WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    # Out of watches, so no later analysis can trust the journal
+                    logging.warning('Ran out of inotify watches at %s, raise fs.inotify.max_user_watches to watch the whole source', full_path)
+                    if self._complete:
+                        self._complete = False
+                        self.journal.set_ready(False)
+                elif err in (errno.EACCES, errno.EPERM):
+                    self._unwatched.add(folder)
+                # Otherwise, the folder is already gone, and its parent has an event for it
+                continue
+
+            self._watches[wd] = folder
+            if mark_dirty:
+                self._dirty.add(folder)
+
+            try:
+                for entry in os.scandir(full_path):
+                    if not entry.is_dir():
+                        continue
+
+                    if entry.is_symlink():
+                        # Linked folders are listed in analysis, but can't be watched
+                        self._unwatched.add(self._join(folder, entry.name))
+                    else:
+                        folders.append(self._join(folder, entry.name))
+            except OSError:
+                self._unwatched.add(folder)
+
+    def _remove_tree(self, db_path):
+        """Stop watching a folder and every folder in it.
+
+        Args:
+            db_path (String): The folder to stop watching, relative to the source.
+        """
+
+        prefix = f'{db_path}/'
+        for wd, folder in list(self._watches.items()):
+            if folder == db_path or folder.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def read_events(self):
+        """Read and handle all pending inotify events."""
+
+        while True:
+            try:
+                buf = os.read(self._fd, ChangeWatcher.READ_SIZE)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, name_len = ChangeWatcher.EVENT_HEADER.unpack_from(buf, offset)
+                offset += ChangeWatcher.EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + name_len].rstrip(b'\0'))
+                offset += name_len
+
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        """Record a single inotify event.
+
+        Args:
+            wd (int): The watch descriptor of the folder.
+            mask (int): The event mask.
+            name (String): The name of the file or folder in the watched folder, if any.
+        """
+
+        if mask & (ChangeWatcher.IN_Q_OVERFLOW | ChangeWatcher.IN_UNMOUNT):
+            self._overflow = True
+            return
+
+        folder = self._watches.get(wd)
+        if folder is None:
+            return
+
+        if mask & ChangeWatcher.IN_IGNORED:
+            del self._watches[wd]
+            return
+
+        self._dirty.add(folder)
+        if not name:
+            if not folder and mask & (ChangeWatcher.IN_DELETE_SELF | ChangeWatcher.IN_MOVE_SELF):
+                # The source itself is gone, so nothing in it is being watched
+                self._overflow = True
+            return
+
+        path = self._join(folder, name)
+        if mask & ChangeWatcher.IN_ISDIR:
+            if mask & (ChangeWatcher.IN_CREATE | ChangeWatcher.IN_MOVED_TO):
+                # Anything created in the folder before its watch was added is
+                # picked up by listing it again
+                self._add_tree(path)
+            elif mask & ChangeWatcher.IN_MOVED_FROM:
+                self._remove_tree(path)
+        elif mask & (ChangeWatcher.IN_CREATE | ChangeWatcher.IN_MOVED_TO) and os.path.isdir(os.path.join(self.root, *path.split('/'))):
+            # Link to a folder
+            self._unwatched.add(path)
+
+    def flush(self):
+        """Save the changes seen since the last flush to the journal."""
+
+        if not self._dirty and not self._unwatched and not self._overflow:
+            return
+
+        self.journal.record(self._dirty, self._unwatched, self._overflow)
+        self._dirty = set()
+        self._unwatched = set()
+        self._overflow = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch sources for changes, so BackDrop only lists what changed during analysis.')
+    parser.add_argument('--journal-dir', required=True, help='The folder to keep the change journals in')
+    parser.add_argument('--flush-interval', type=float, default=1, help='How often to save changes to the journals in seconds (default: 1)')
+    parser.add_argument('sources', nargs='+', help='The sources to watch')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if platform.system() != 'Linux':
+        parser.exit(1, 'Change journals need inotify, which is only available on Linux\n')
+
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stop cleanly when the service manager stops the watcher
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    watchers = []
+    try:
+        for source in args.sources:
+            journal = ChangeJournal(get_journal_filename(args.journal_dir, source))
+            watcher = ChangeWatcher(os.path.abspath(source), journal)
+            try:
+                watcher.start()
+            except BlockingIOError:
+                parser.exit(1, f'Another watcher is already running for {source}\n')
+            watchers.append(watcher)
+
+        # Mounts and unmounts don't send inotify events, but can change what's
+        # in a source, so the watches are started over when they happen
+        mounts = open('/proc/self/mounts')
+
+        while True:
+            readable, writable, exceptional = select.select(watchers, [], [mounts], args.flush_interval)
+
+            if exceptional:
+                logging.info('Mounts changed, starting watches over')
+                mounts.close()
+                mounts = open('/proc/self/mounts')
+                for watcher in watchers:
+                    watcher.start()
+                continue
+
+            for watcher in readable:
+                watcher.read_events()
+            for watcher in watchers:
+                watcher.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+            watcher.journal.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+
+
+def open_database(filename, init_fn, timeout: float = 5) -> sqlite3.Connection:
+    """Open a SQLite database, creating it if it doesn't exist.
+
+    If the database is corrupt, it's deleted and created again, so it should
+    only hold data that can be rebuilt.
+
+    Args:
+        filename (String): The path of the database file.
+        init_fn (def): The function to set up a new connection, and create the tables.
+        timeout (float): How long to wait for a lock held by another connection in seconds (default: 5).
+
+    Returns:
+        sqlite3.Connection: The connection to the database.
+    """
+
+    path_stub = os.path.dirname(filename)
+    if path_stub and not os.path.exists(path_stub):
+        os.makedirs(path_stub)
+
+    try:
+        return _connect(filename, init_fn, timeout)
+    except sqlite3.DatabaseError:
+        # Database is corrupt, so start over
+        os.remove(filename)
+        return _connect(filename, init_fn, timeout)
+
+
+def _connect(filename, init_fn, timeout: float) -> sqlite3.Connection:
+    """Open a connection to a database, and set it up.
+
+    The connection is closed if it can't be set up, so that the file isn't
+    held open if it has to be deleted.
+
+    Args:
+        filename (String): The path of the database file.
+        init_fn (def): The function to set up a new connection, and create the tables.
+        timeout (float): How long to wait for a lock held by another connection in seconds.
+
+    Returns:
+        sqlite3.Connection: The connection to the database.
+    """
+
+    conn = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+
+    try:
+        init_fn(conn)
+    except BaseException:
+        conn.close()
+        raise
+
+    return conn
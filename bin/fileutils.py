@@ -1,11 +1,20 @@
 import os
 import shutil
+import functools
 from blake3 import blake3
 import subprocess
 import platform
+import threading
+import queue
+import mmap
+import errno
+import re
+from concurrent.futures import ThreadPoolExecutor
 if platform.system() == 'Windows':
     import win32api
     import win32file
+else:
+    import fcntl
 
 from bin.status import Status
 
@@ -24,8 +33,90 @@ class FileUtils:
     LOCAL_DRIVE = 1
     NETWORK_DRIVE = 2
 
+    # System folders on drives that are never backed up or verified
+    SYSTEM_IGNORE_LIST = ['$RECYCLE.BIN', 'System Volume Information']
+
     READINTO_BUFSIZE = 1024 * 1024 * 2  # differs from shutil.COPY_BUFSIZE on platforms != Windows
 
+    # Number of buffers in the copy ring. With more than one buffer, the source is
+    # read on a separate thread while the previous chunk is written and hashed.
+    PIPELINE_BUFFER_COUNT = 3
+
+    # Copy strategies. Buffered copies move data through userspace buffers, while
+    # kernel copies use copy_file_range() or sendfile() where the OS supports it,
+    # and hash the source through an mmap view of the file.
+    COPY_STRATEGY_BUFFERED = 'buffered'
+    COPY_STRATEGY_KERNEL = 'kernel'
+    COPY_STRATEGY_OPTIONS = [COPY_STRATEGY_BUFFERED, COPY_STRATEGY_KERNEL]
+    COPY_STRATEGY = COPY_STRATEGY_BUFFERED
+
+    # Files at or below this size are copied in batches on a pool of workers,
+    # reading, hashing and verifying each file in memory.
+    SMALL_FILE_THRESHOLD = 64 * 1024
+    SMALL_FILE_BATCH_SIZE = 256
+    SMALL_FILE_WORKERS = 8
+
+    # Files at or above this size have the digest of each chunk saved alongside
+    # their hash. When they change, only the chunks that differ from the source
+    # are rewritten, interrupted copies resume from the last checkpoint, and
+    # verification can find which parts of a file are corrupted.
+    CHUNK_THRESHOLD = 64 * 1024 * 1024
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    # Files at or above this size are hashed through an mmap view in slices, with
+    # BLAKE3 spreading each slice over up to HASH_MAX_THREADS threads. Smaller
+    # files are streamed through a buffer on a single thread.
+    HASH_MMAP_THRESHOLD = 16 * 1024 * 1024
+    HASH_MMAP_SLICE_SIZE = 64 * 1024 * 1024
+    HASH_MAX_THREADS = blake3.AUTO
+
+    # Whether files are flushed to disk and dropped from the page cache before they're
+    # read back to verify them, so that verification reads the drive instead of
+    # the copy of the data still in memory.
+    VERIFY_BYPASS_CACHE = True
+
+    # Files of at least PREALLOCATE_THRESHOLD have their full size reserved on the
+    # destination before they're written, so they're laid out in one piece instead
+    # of growing a buffer at a time. On Linux this uses fallocate(), which only
+    # the filesystems in PREALLOCATE_FILESYSTEMS support natively. Elsewhere glibc
+    # falls back to writing to every block, which would double the writes.
+    PREALLOCATE_THRESHOLD = 8 * 1024 * 1024
+    PREALLOCATE_FILESYSTEMS = ['ext4', 'xfs', 'btrfs', 'f2fs', 'ntfs3', 'bcachefs']
+
+    # With cache hints on, sources are read with sequential readahead, the start
+    # of the next file to copy is prefetched, and copied data is dropped from the
+    # page cache every CACHE_DROP_INTERVAL bytes once it's on disk, so that bulk
+    # copies don't push everything else out of the cache.
+    CACHE_DROP_INTERVAL = 64 * 1024 * 1024
+    PREFETCH_SIZE = 16 * 1024 * 1024
+
+    # With dedup on, new files of at least DEDUP_THRESHOLD are hashed before they're
+    # copied if the drive has a file of the same size, and are linked or cloned
+    # to an identical file already on the drive instead of being copied. Clones
+    # use the FICLONE ioctl, which only filesystems with copy on write support.
+    DEDUP_THRESHOLD = 1024 * 1024
+    FICLONE = 0x40049409
+
+    # Number of chunks between checkpoints while copying. At each checkpoint the
+    # destination is flushed to disk, and the chunks so far are saved.
+    CHUNK_CHECKPOINT_INTERVAL = 16
+
+    # How far apart in ns the mtimes of a file on the source and destination can be
+    # for the file to count as unchanged, by destination filesystem. FAT and exFAT
+    # store timestamps in 2 second steps, and FUSE drivers may round them too.
+    MTIME_TOLERANCE = {
+        'fat': 2 * 10**9,
+        'fat12': 2 * 10**9,
+        'fat16': 2 * 10**9,
+        'fat32': 2 * 10**9,
+        'vfat': 2 * 10**9,
+        'msdos': 2 * 10**9,
+        'exfat': 2 * 10**9,
+        'fuse': 2 * 10**9,
+        'fuseblk': 2 * 10**9,
+        'hfsplus': 10**9
+    }
+
 
 def get_drive_list(system_drive, flags=0) -> list:
     """Get the list of available drives based on a selection.
@@ -86,6 +177,67 @@ def get_drive_list(system_drive, flags=0) -> list:
     return source_avail_drive_list
 
 
+def get_filesystem_type(path) -> str:
+    """Get the type of filesystem a path is on.
+
+    Args:
+        path (String): The path to check.
+
+    Returns:
+        String: The lowercase name of the filesystem, or None if it can't be found.
+    """
+
+    path = os.path.abspath(path)
+
+    if platform.system() == 'Windows':
+        try:
+            return win32api.GetVolumeInformation(os.path.splitdrive(path)[0] + os.path.sep)[4].lower()
+        except Exception:
+            return None
+
+    # Find the mount point with the longest match for the path
+    path = os.path.realpath(path)
+    filesystem_type = None
+    mount_point_len = -1
+    try:
+        with open('/proc/self/mountinfo', 'r') as f:
+            for line in f:
+                fields = line.split(' - ')
+                if len(fields) < 2:
+                    continue
+
+                # Spaces and other special characters in mount points are escaped as octal
+                mount_point = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[0].split(' ')[4])
+                if len(mount_point) > mount_point_len and (path == mount_point or path.startswith(mount_point.rstrip(os.path.sep) + os.path.sep)):
+                    filesystem_type = fields[1].split(' ')[0].lower()
+                    mount_point_len = len(mount_point)
+    except OSError:
+        return None
+
+    return filesystem_type
+
+
+def get_mtime_tolerance(path) -> int:
+    """Get how far apart mtimes can be for files on a path to count as unchanged.
+
+    Args:
+        path (String): The path to check.
+
+    Returns:
+        int: The mtime tolerance for the filesystem the path is on, in ns.
+    """
+
+    filesystem_type = get_filesystem_type(path)
+    if filesystem_type is None:
+        return 0
+
+    # FUSE mounts are named by the program that mounted them
+    if filesystem_type.startswith('fuse.'):
+        filesystem_type = 'fuse'
+
+    return FileUtils.MTIME_TOLERANCE.get(filesystem_type, 0)
+
+
 def human_filesize(num: int, suffix=None) -> str:
     """Convert a number of bytes to a human readable format.
 
@@ -107,24 +259,37 @@ def human_filesize(num: int, suffix=None) -> str:
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
-def get_directory_size(directory) -> int:
+def get_directory_size(directory, seen_links: set = None) -> int:
     """Get the filesize of a directory and its contents.
 
+    Files with more than one hardlink are only counted the first time one of
+    their links is found.
+
     Args:
         directory (String): The directory to check.
+        seen_links (set): The (st_dev, st_ino) of hardlinked files already
+            counted (optional).
 
     Returns:
         int: The filesize of the directory.
     """
 
+    if seen_links is None:
+        seen_links = set()
+
     total = 0
     try:
         for entry in os.scandir(directory):
             # For each entry, either add filesize to the total, or recurse into the directory
             if entry.is_file():
-                total += entry.stat().st_size
+                file_stat = entry.stat()
+                if file_stat.st_nlink > 1:
+                    if (file_stat.st_dev, file_stat.st_ino) in seen_links:
+                        continue
+                    seen_links.add((file_stat.st_dev, file_stat.st_ino))
+                total += file_stat.st_size
             elif entry.is_dir():
-                total += get_directory_size(entry.path)
+                total += get_directory_size(entry.path, seen_links)
     except NotADirectoryError:
         return os.path.getsize(directory)
     except PermissionError:
@@ -134,9 +299,330 @@ def get_directory_size(directory) -> int:
     return total
 
 
-def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag) -> tuple:
+class ChunkedHash:
+    """A BLAKE3 hash of a whole file, that also keeps the digest of each fixed size chunk.
+
+    It can be used anywhere a blake3 object is updated with a file's data in
+    order, regardless of how the data is split up between updates.
+    """
+
+    def __init__(self, chunk_size: int = None, chunk_callback=None, max_threads: int = 1):
+        """Create an empty chunked hash.
+
+        Args:
+            chunk_size (int): The size of each chunk in bytes (optional, default
+                FileUtils.CHUNK_SIZE).
+            chunk_callback (def): The function to call with the number of chunks
+                each time a chunk is finished (optional).
+            max_threads (int): The number of threads each hash can use (default: 1).
+        """
+
+        self.chunk_size = chunk_size if chunk_size is not None else FileUtils.CHUNK_SIZE
+        self.chunk_callback = chunk_callback
+        self.max_threads = max_threads
+        self.digests = []
+
+        self._hash = blake3(max_threads=self.max_threads)
+        self._chunk_hash = blake3(max_threads=self.max_threads)
+        self._chunk_length = 0
+
+    def update(self, data):
+        """Add data to the hash.
+
+        Args:
+            data (bytes): The data to add, following the data already added.
+        """
+
+        self._hash.update(data)
+
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.chunk_size - self._chunk_length)
+            self._chunk_hash.update(view[:n])
+            self._chunk_length += n
+            view = view[n:]
+
+            if self._chunk_length == self.chunk_size:
+                self.digests.append(self._chunk_hash.digest())
+                self._chunk_hash = blake3(max_threads=self.max_threads)
+                self._chunk_length = 0
+
+                if self.chunk_callback is not None:
+                    self.chunk_callback(len(self.digests))
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def chunk_digests(self) -> list:
+        """Get the digests of every chunk, including the last partial chunk.
+
+        Returns:
+            bytes[]: The digest of each chunk, in order.
+        """
+
+        if self._chunk_length:
+            return self.digests + [self._chunk_hash.digest()]
+
+        return list(self.digests)
+
+
+class KnownHash:
+    """A stand-in for a hash object, for data whose hash is already known.
+
+    Data it's updated with is ignored, so a copy can skip hashing a source that
+    was hashed before, and still check the destination against it.
+    """
+
+    def __init__(self, digest):
+        """Create a hash with a known digest.
+
+        Args:
+            digest (String): The hex digest of the data.
+        """
+
+        self._digest = digest
+
+    def update(self, data):
+        pass
+
+    def hexdigest(self) -> str:
+        return self._digest
+
+
+def _copy_pipelined(fsrc, fdst, h, buffer_size: int, prog_callback, get_backup_killflag) -> int:
+    """Copy an open file to another using a ring of buffers, reading the source
+    on a separate thread while chunks are written and hashed on this one.
+
+    Args:
+        fsrc: The source file object, opened for unbuffered binary reading.
+        fdst: The destination file object, opened for binary writing.
+        h (blake3): The hash object to update with the copied data.
+        buffer_size (int): The size of each buffer in the ring.
+        prog_callback (def): The function to call with the number of bytes copied.
+        get_backup_killflag (def): The function to use to get the backup thread kill flag.
+
+    Returns:
+        int: The number of bytes copied.
+    """
+
+    ring = [memoryview(bytearray(buffer_size)) for i in range(FileUtils.PIPELINE_BUFFER_COUNT)]
+    free_buffers = queue.SimpleQueue()
+    filled_buffers = queue.SimpleQueue()
+    for i in range(len(ring)):
+        free_buffers.put(i)
+
+    def read_into_ring():
+        """Fill free buffers from the source until EOF, or until told to stop."""
+
+        while True:
+            i = free_buffers.get()
+            if i is None:
+                break
+
+            try:
+                n = fsrc.readinto(ring[i])
+            except OSError:
+                n = None
+
+            filled_buffers.put((i, n))
+            if not n:
+                break
+
+    reader = threading.Thread(target=read_into_ring, name='Copy Reader', daemon=True)
+    reader.start()
+
+    copied = 0
+    try:
+        while True:
+            i, n = filled_buffers.get()
+            if n is None:
+                raise OSError('Failed to read from source file')
+            elif n == 0:
+                break
+
+            fdst.write(ring[i][:n])
+            h.update(ring[i][:n])
+            free_buffers.put(i)
+
+            copied += n
+            prog_callback(copied)
+
+            if get_backup_killflag():
+                break
+    finally:
+        # Unblock the reader if it's waiting on a free buffer
+        free_buffers.put(None)
+        reader.join()
+
+    return copied
+
+
+def _copy_sparse(fsrc, fdst, h, data_ranges: list, file_size: int, buffer_size: int, prog_callback, get_backup_killflag, hole_callback=None) -> int:
+    """Copy an open sparse file to another, leaving the holes in the source as holes.
+
+    Only the ranges of the source that hold data are read and written. Holes
+    read back as zeros, so they're hashed as zeros, to get the same hash as
+    reading the whole file.
+
+    Args:
+        fsrc: The source file object, opened for unbuffered binary reading.
+        fdst: The destination file object, opened for binary writing.
+        h (blake3): The hash object to update with the copied data.
+        data_ranges (tuple[]): The start and end offset of each range of data in the source.
+        file_size (int): The size of the source file.
+        buffer_size (int): The size of the copy buffer.
+        prog_callback (def): The function to call with the number of bytes copied.
+        get_backup_killflag (def): The function to use to get the backup thread kill flag.
+        hole_callback (def): The function to call with the number of bytes in holes
+            that are skipped instead of written (optional).
+
+    Returns:
+        int: The number of bytes copied, counting holes.
+    """
+
+    mv = memoryview(bytearray(buffer_size))
+    zeros = memoryview(bytes(buffer_size))
+
+    copied = 0
+    for start, end in data_ranges + [(file_size, file_size)]:
+        while copied < start:
+            n = min(buffer_size, start - copied)
+            h.update(zeros[:n])
+            if hole_callback is not None:
+                hole_callback(n)
+
+            copied += n
+            prog_callback(copied)
+
+            if get_backup_killflag():
+                return copied
+
+        if start >= file_size:
+            break
+
+        fsrc.seek(start)
+        fdst.seek(start)
+        while copied < end:
+            n = fsrc.readinto(mv[:min(buffer_size, end - copied)])
+
+            # Source was truncated while copying
+            if not n:
+                return copied
+
+            fdst.write(mv[:n])
+            h.update(mv[:n])
+
+            copied += n
+            prog_callback(copied)
+
+            if get_backup_killflag():
+                return copied
+
+    # Extend the destination over any hole at the end of the file
+    fdst.truncate(file_size)
+
+    return copied
+
+
+def kernel_copy_supported() -> bool:
+    """Check if the OS supports copying files in the kernel.
+
+    Returns:
+        bool: Whether copy_file_range() or sendfile() can be used to copy files.
+    """
+
+    return platform.system() == 'Linux' and (hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile'))
+
+
+def _copy_kernel(fsrc, fdst, h, file_size: int, prog_callback, get_backup_killflag) -> int:
+    """Copy an open file to another in the kernel, hashing the source through
+    an mmap view instead of reading it into userspace buffers.
+
+    copy_file_range() is tried first, and if the kernel or filesystem doesn't
+    support it, this falls back to sendfile(), and then to writing from the
+    mmap view.
+
+    Args:
+        fsrc: The source file object.
+        fdst: The destination file object.
+        h (blake3): The hash object to update with the copied data.
+        file_size (int): The size of the source file.
+        prog_callback (def): The function to call with the number of bytes copied.
+        get_backup_killflag (def): The function to use to get the backup thread kill flag.
+
+    Returns:
+        int: The number of bytes copied.
+    """
+
+    UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+    src_fd = fsrc.fileno()
+    dst_fd = fdst.fileno()
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    use_sendfile = hasattr(os, 'sendfile')
+
+    try:
+        src_map = mmap.mmap(src_fd, file_size, access=mmap.ACCESS_READ)
+    except ValueError as e:
+        # Source is smaller than expected
+        raise OSError(str(e))
+
+    copied = 0
+    with src_map, memoryview(src_map) as src_view:
+        while copied < file_size:
+            count = min(FileUtils.READINTO_BUFSIZE, file_size - copied)
+
+            if use_copy_file_range:
+                try:
+                    n = os.copy_file_range(src_fd, dst_fd, count, copied, copied)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+
+                    use_copy_file_range = False
+                    continue
+            elif use_sendfile:
+                try:
+                    os.lseek(dst_fd, copied, os.SEEK_SET)
+                    n = os.sendfile(dst_fd, src_fd, copied, count)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+
+                    use_sendfile = False
+                    continue
+            else:
+                os.lseek(dst_fd, copied, os.SEEK_SET)
+                n = os.write(dst_fd, src_view[copied:copied + count])
+
+            # Source was truncated while copying
+            if n == 0:
+                break
+
+            h.update(src_view[copied:copied + n])
+
+            copied += n
+            prog_callback(copied)
+
+            if get_backup_killflag():
+                break
+
+    return copied
+
+
+def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag, copy_strategy=None, chunk_callback=None, cache_hints: bool = False, sparse_callback=None, source_digest=None) -> tuple:
     """Copy a source binary file to a destination.
 
+    Space for large files is reserved on the destination before they're written.
+    Sparse files are copied with their holes left unwritten, so they take up the
+    same space on the destination as on the source, and progress counts the
+    holes as copied.
+
+    If a chunk callback is given, files of at least FileUtils.CHUNK_THRESHOLD
+    are hashed in chunks, and checkpointed every FileUtils.CHUNK_CHECKPOINT_INTERVAL
+    chunks. If the copy is interrupted after a checkpoint, the partial file is
+    kept, so that delta_update_file() can resume it from the last checkpoint.
+
     Args:
         source_filename (String): The source to copy.
         dest_filename (String): The destination to copy to.
@@ -145,6 +631,17 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
         prog_callback (def): The function to call on progress change.
         fd_callback (def): The function to run after copy to update file details.
         get_backup_killflag (def): The function to use to get the backup thread kill flag.
+        copy_strategy (String): The FileUtils copy strategy to use (optional,
+            default FileUtils.COPY_STRATEGY).
+        chunk_callback (def): The function to call with the destination, its chunk
+            digests, and whether the copy is complete, when chunks are saved (optional).
+        cache_hints (bool): Whether to read the source sequentially, and drop the source
+            and destination from the page cache as they're copied (default: False).
+        sparse_callback (def): The function to call with the number of bytes in holes
+            that are skipped instead of written as the file is copied, if the source
+            is sparse (optional).
+        source_digest (String): The known hash of the source, so that it doesn't need
+            hashing while it's copied, unless it's hashed in chunks (optional).
 
     Returns:
         tuple:
@@ -154,6 +651,9 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
             If the file failed to copy, returns None.
     """
 
+    if copy_strategy is None:
+        copy_strategy = FileUtils.COPY_STRATEGY
+
     pre_callback()
     operation = Status.FILE_OPERATION_COPY
 
@@ -162,7 +662,6 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
     if buffer_size == 0:
         buffer_size = 1024
 
-    h = blake3()
     b = bytearray(buffer_size)
     mv = memoryview(b)
 
@@ -173,32 +672,100 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
         except OSError:
             file_size = FileUtils.READINTO_BUFSIZE
 
+        if cache_hints:
+            advise_sequential(f.fileno())
+
+        try:
+            data_ranges = get_data_ranges(f.fileno(), file_size)
+        except OSError:
+            data_ranges = None
+
+        cache_dropped = 0
+
+        def copy_progress(c: int):
+            """Report copy progress, and drop copied data from the page cache if needed.
+
+            Args:
+                c (int): The number of bytes copied.
+            """
+
+            nonlocal cache_dropped
+
+            if cache_hints and c - cache_dropped >= FileUtils.CACHE_DROP_INTERVAL:
+                fdst.flush()
+                drop_file_cache(fdst.fileno(), cache_dropped, c - cache_dropped)
+                drop_file_cache(f.fileno(), cache_dropped, c - cache_dropped, sync=False)
+                cache_dropped = c
+
+            prog_callback(c=c, t=file_size, op=operation)
+
+        chunked = chunk_callback is not None and file_size >= FileUtils.CHUNK_THRESHOLD
+        if chunked:
+            def checkpoint(chunk_count: int):
+                """Flush the copied data to disk, and save the chunks so far.
+
+                Args:
+                    chunk_count (int): The number of chunks copied.
+                """
+
+                if chunk_count % FileUtils.CHUNK_CHECKPOINT_INTERVAL == 0:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    chunk_callback(dest_filename, list(h.digests), False)
+
+            h = ChunkedHash(chunk_callback=checkpoint, max_threads=FileUtils.HASH_MAX_THREADS)
+            chunk_callback(dest_filename, [], False)
+        elif source_digest is not None:
+            h = KnownHash(source_digest)
+        else:
+            h = new_file_hash(file_size)
+
         # Make sure destination path exists before copying
         path_stub = dest_filename[0:dest_filename.rindex(os.path.sep)]
         if not os.path.exists(path_stub):
             os.makedirs(path_stub)
 
+        # Linked files are replaced rather than overwritten, so the other links are left as they are
+        if is_hardlinked(dest_filename):
+            os.remove(dest_filename)
+
         try:
             with open(dest_filename, 'wb') as fdst:
-                try:
-                    for n in iter(lambda: f.readinto(mv), 0):
-                        fdst.write(mv[:n])
-                        h.update(mv[:n])
-
-                        copied += n
-                        prog_callback(c=copied, t=file_size, op=operation)
+                # Sparse files aren't preallocated, since that would fill in their holes
+                if data_ranges is None:
+                    preallocate_file(fdst.fileno(), file_size, drive_path)
 
-                        if get_backup_killflag():
-                            break
+                try:
+                    if data_ranges is not None:
+                        copied = _copy_sparse(f, fdst, h, data_ranges, file_size, buffer_size, copy_progress, get_backup_killflag, sparse_callback)
+                    elif copy_strategy == FileUtils.COPY_STRATEGY_KERNEL and file_size > 0 and kernel_copy_supported():
+                        copied = _copy_kernel(f, fdst, h, file_size, copy_progress, get_backup_killflag)
+                    elif FileUtils.PIPELINE_BUFFER_COUNT > 1 and file_size > buffer_size:
+                        copied = _copy_pipelined(f, fdst, h, buffer_size, copy_progress, get_backup_killflag)
+                    else:
+                        for n in iter(lambda: f.readinto(mv), 0):
+                            fdst.write(mv[:n])
+                            h.update(mv[:n])
+
+                            copied += n
+                            copy_progress(copied)
+
+                            if get_backup_killflag():
+                                break
                 except OSError:
                     pass
         except PermissionError:
             pass
 
-    # If file wasn't copied successfully, delete it
+        if cache_hints:
+            drop_file_cache(f.fileno(), sync=False)
+
+    # If file wasn't copied successfully, delete it, unless it can be resumed
     if copied != file_size:
         try:
-            if os.path.isfile(dest_filename):
+            if chunked and len(h.digests) >= FileUtils.CHUNK_CHECKPOINT_INTERVAL:
+                pass
+            elif os.path.isfile(dest_filename):
                 os.remove(dest_filename)
             elif os.path.isdir(dest_filename):
                 shutil.rmtree(dest_filename)
@@ -216,21 +783,13 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
     shutil.copymode(source_filename, dest_filename)
     shutil.copystat(source_filename, dest_filename)
 
-    dest_hash = blake3()
-    dest_b = bytearray(buffer_size)
-    dest_mv = memoryview(dest_b)
-
-    with open(dest_filename, 'rb', buffering=0) as f:
-        operation = Status.FILE_OPERATION_VERIFY
-        copied = 0
-
-        for n in iter(lambda: f.readinto(dest_mv), 0):
-            dest_hash.update(dest_mv[:n])
-
-            copied += n
-            prog_callback(c=copied, t=file_size, op=operation)
+    dest_hash = new_file_hash(file_size)
+    hash_file(dest_filename, dest_hash, prog_callback=lambda c: prog_callback(c=c, t=file_size, op=Status.FILE_OPERATION_VERIFY), bypass_cache=FileUtils.VERIFY_BYPASS_CACHE or cache_hints)
 
     if h.hexdigest() == dest_hash.hexdigest():
+        if chunked:
+            chunk_callback(dest_filename, h.chunk_digests(), True)
+
         fd_callback(
             status=Status.FILE_OPERATION_SUCCESS,
             file=(dest_filename, file_size, Status.FILE_OPERATION_COPY, None)
@@ -242,6 +801,9 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
         elif os.path.isdir(dest_filename):
             shutil.rmtree(dest_filename)
 
+        if chunked:
+            chunk_callback(dest_filename, [], False)
+
         fd_callback(
             status=Status.FILE_OPERATION_FAILED,
             file=(dest_filename, file_size, Status.FILE_OPERATION_COPY, None)
@@ -253,39 +815,623 @@ def copy_file(source_filename, dest_filename, drive_path, pre_callback, prog_cal
         return None
 
 
-def get_file_hash(filename, kill_flag) -> str:
-    """Get the hash of a file.
+def delta_update_file(source_filename, dest_filename, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag, chunk_digests: list = None, chunk_callback=None, cache_hints: bool = False) -> tuple:
+    """Update an existing destination file in place, rewriting only the chunks that changed.
+
+    The source is read and hashed in chunks of FileUtils.CHUNK_SIZE. Each
+    chunk is compared with the saved digest of the same chunk on the destination,
+    or with the destination chunk itself if there are no saved digests, and only
+    chunks that differ are written. The whole destination is then read back and
+    hashed to verify it, so that a chunk skipped because of a stale saved digest
+    isn't taken as good.
+
+    Unlike copy_file(), a file that fails to update isn't deleted, so that an
+    interrupted update of a large file doesn't throw away the chunks that were
+    already up to date. Chunks are checkpointed the same way as copy_file(), so
+    this is also used to resume interrupted copies.
 
     Args:
-        filename (String): The file to get the hash of.
-        kill_flag (function): The function to get a kill flag.
+        source_filename (String): The source to copy.
+        dest_filename (String): The existing destination file to update.
+        drive_path (String): The path of the destination drive to copy to.
+        pre_callback (def): The function to call before copying.
+        prog_callback (def): The function to call on progress change.
+        fd_callback (def): The function to run after copy to update file details.
+        get_backup_killflag (def): The function to use to get the backup thread kill flag.
+        chunk_digests (bytes[]): The saved digests of the destination chunks (optional).
+        chunk_callback (def): The function to call with the destination, its chunk
+            digests, and whether the update is complete, when chunks are saved (optional).
+        cache_hints (bool): Whether to read the source sequentially, and drop the source
+            and destination from the page cache once they're done (default: False).
 
     Returns:
-        String: The blake3 hash of the file if readable. None otherwise.
+        tuple:
+            String: The destination drive the file was copied to.
+            String: The resulting file hash if the file was updated successfully.
+        None:
+            If the file failed to update, returns None.
     """
 
-    # Optimize the buffer for small files
-    buffer_size = min(FileUtils.READINTO_BUFSIZE, os.path.getsize(filename))
-    if buffer_size == 0:
-        buffer_size = 1024
+    pre_callback()
 
+    chunk_size = FileUtils.CHUNK_SIZE
     h = blake3()
-    b = bytearray(buffer_size)
-    mv = memoryview(b)
+    mv = memoryview(bytearray(chunk_size))
+    dest_mv = memoryview(bytearray(chunk_size))
+
+    digests = []
+    file_size = 0
+    offset = 0
+    try:
+        file_size = os.stat(source_filename).st_size
+
+        with open(source_filename, 'rb', buffering=0) as fsrc, open(dest_filename, 'r+b') as fdst:
+            dest_size = os.fstat(fdst.fileno()).st_size
+
+            if cache_hints:
+                advise_sequential(fsrc.fileno())
+                advise_sequential(fdst.fileno())
+
+            for n in iter(lambda: fsrc.readinto(mv), 0):
+                chunk = mv[:n]
+                h.update(chunk)
+                digest = blake3(chunk).digest()
+                index = len(digests)
+                digests.append(digest)
+
+                if offset + n > dest_size:
+                    unchanged = False
+                elif chunk_digests is not None:
+                    unchanged = index < len(chunk_digests) and chunk_digests[index] == digest
+                else:
+                    fdst.seek(offset)
+                    unchanged = fdst.readinto(dest_mv[:n]) == n and dest_mv[:n] == chunk
+
+                if not unchanged:
+                    fdst.seek(offset)
+                    fdst.write(chunk)
+
+                offset += n
+                prog_callback(c=offset, t=file_size, op=Status.FILE_OPERATION_COPY)
+
+                if chunk_callback is not None and len(digests) % FileUtils.CHUNK_CHECKPOINT_INTERVAL == 0:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    chunk_callback(dest_filename, list(digests), False)
+
+                if get_backup_killflag():
+                    break
+
+            if offset == file_size:
+                fdst.truncate(file_size)
+
+            if cache_hints:
+                drop_file_cache(fsrc.fileno(), sync=False)
+
+        # Verify the whole file before its mtime is set to match the source, so
+        # that if it fails, the next backup compares it against the source again
+        if offset == file_size:
+            dest_hash = new_file_hash(file_size)
+            hash_file(dest_filename, dest_hash, prog_callback=lambda c: prog_callback(c=c, t=file_size, op=Status.FILE_OPERATION_VERIFY), bypass_cache=FileUtils.VERIFY_BYPASS_CACHE or cache_hints)
+
+            if dest_hash.hexdigest() != h.hexdigest():
+                offset = None
+
+                # The saved digests can't be trusted, so the next backup compares the chunks themselves
+                if chunk_callback is not None:
+                    chunk_callback(dest_filename, [], False)
+    except OSError:
+        offset = None
+
+    if offset != file_size:
+        # A partly updated file is left in place, since its mtime no longer matches
+        # the source, so the next backup will compare it against the source again
+        fd_callback(
+            status=Status.FILE_OPERATION_FAILED,
+            file=(dest_filename, file_size, Status.FILE_OPERATION_COPY, None)
+        )
+
+        return None
+
+    shutil.copymode(source_filename, dest_filename)
+    shutil.copystat(source_filename, dest_filename)
+
+    if chunk_callback is not None:
+        chunk_callback(dest_filename, digests, True)
+
+    fd_callback(
+        status=Status.FILE_OPERATION_SUCCESS,
+        file=(dest_filename, file_size, Status.FILE_OPERATION_COPY, None)
+    )
+
+    return (drive_path, dest_hash.hexdigest())
+
+
+def drop_file_cache(fd: int, offset: int = 0, length: int = 0, sync: bool = True):
+    """Flush part of a file to disk, and drop it from the page cache.
+
+    The next read of the range comes from the drive. This only has an effect
+    on platforms with posix_fadvise(), and does nothing elsewhere.
+
+    Args:
+        fd (int): The file descriptor of the file.
+        offset (int): The start of the range to drop (default: 0).
+        length (int): The length of the range to drop, or 0 for the rest of the file (default: 0).
+        sync (bool): Whether to flush the file to disk first. Files that were only read
+            have nothing to flush (default: True).
+    """
+
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    try:
+        # Dirty pages can't be dropped, so they need writing out first
+        if sync:
+            os.fdatasync(fd) if hasattr(os, 'fdatasync') else os.fsync(fd)
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def advise_sequential(fd: int):
+    """Tell the OS a file will be read from start to end, so it reads further ahead.
+
+    Args:
+        fd (int): The file descriptor of the file.
+    """
+
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+        pass
+
+
+def prefetch_file(filename, length: int = None):
+    """Start reading the start of a file into the page cache in the background.
+
+    Args:
+        filename (String): The file to prefetch.
+        length (int): The number of bytes to prefetch (default: FileUtils.PREFETCH_SIZE).
+    """
+
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    if length is None:
+        length = FileUtils.PREFETCH_SIZE
+
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_drive_filesystem_type(drive_path) -> str:
+    return get_filesystem_type(drive_path)
+
+
+def preallocate_file(fd: int, size: int, drive_path) -> bool:
+    """Reserve space on a drive for a file that's about to be written.
+
+    Args:
+        fd (int): The file descriptor of the empty destination file.
+        size (int): The size of the file.
+        drive_path (String): The path of the drive the file is on.
+
+    Returns:
+        bool: Whether the space was reserved.
+    """
+
+    if size < FileUtils.PREALLOCATE_THRESHOLD:
+        return False
+
+    try:
+        if platform.system() == 'Windows':
+            # Extending a file on NTFS and exFAT allocates its clusters up front
+            os.ftruncate(fd, size)
+            return True
+
+        if hasattr(os, 'posix_fallocate') and _get_drive_filesystem_type(drive_path) in FileUtils.PREALLOCATE_FILESYSTEMS:
+            os.posix_fallocate(fd, 0, size)
+            return True
+    except OSError:
+        pass
+
+    return False
+
+
+def get_data_ranges(fd: int, file_size: int) -> list:
+    """Get the ranges of a sparse file that hold data, skipping the holes.
+
+    Args:
+        fd (int): The file descriptor of the file.
+        file_size (int): The size of the file.
+
+    Returns:
+        tuple[]: The start and end offset of each range of data, or None if the file
+            isn't sparse, or the OS or filesystem can't find holes.
+    """
+
+    if not hasattr(os, 'SEEK_DATA') or not hasattr(os, 'SEEK_HOLE'):
+        return None
+
+    # Files with every block allocated have no holes to find
+    file_stat = os.fstat(fd)
+    if not hasattr(file_stat, 'st_blocks') or file_stat.st_blocks * 512 >= file_size:
+        return None
+
+    data_ranges = []
+    offset = 0
+    try:
+        while offset < file_size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                # No data past the offset, so the rest of the file is a hole
+                if e.errno == errno.ENXIO:
+                    break
+                raise
+
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), file_size)
+            data_ranges.append((start, end))
+            offset = end
+    except OSError:
+        return None
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+    return data_ranges
+
+
+def new_file_hash(file_size: int):
+    """Get a hash object suited to a file of a given size.
+
+    Args:
+        file_size (int): The size of the file to hash.
+
+    Returns:
+        blake3: A multithreaded hash for files of at least FileUtils.HASH_MMAP_THRESHOLD,
+            and a single threaded hash otherwise.
+    """
+
+    if file_size >= FileUtils.HASH_MMAP_THRESHOLD:
+        return blake3(max_threads=FileUtils.HASH_MAX_THREADS)
+
+    return blake3()
+
+
+def hash_file(filename, h, kill_flag=None, prog_callback=None, bypass_cache: bool = False) -> bool:
+    """Feed the contents of a file into a hash, picking the fastest way to read it.
+
+    Files of at least FileUtils.HASH_MMAP_THRESHOLD are mapped into memory,
+    and hashed in slices of FileUtils.HASH_MMAP_SLICE_SIZE, so that a
+    multithreaded hash can spread each slice over several cores without
+    copying it. Smaller files are streamed through a buffer. The kill flag is
+    checked between each slice or buffer.
+
+    Args:
+        filename (String): The file to hash.
+        h (blake3): The hash object to update, such as one from new_file_hash().
+        kill_flag (def): The function to get a kill flag (optional).
+        prog_callback (def): The function to call with the number of bytes hashed (optional).
+        bypass_cache (bool): Whether to drop the file from the page cache before and after
+            reading it, so that it's read from the drive, and doesn't push other files out
+            of the cache (default: False).
+
+    Returns:
+        bool: Whether the whole file was hashed, or False if it was killed.
+    """
 
     with open(filename, 'rb', buffering=0) as f:
-        for n in iter(lambda: f.readinto(mv), 0):
-            if kill_flag():  # TODO: Refactor this into separate function
-                break
-            h.update(mv[:n])
+        if bypass_cache:
+            drop_file_cache(f.fileno())
+
+        try:
+            return _hash_open_file(f, h, kill_flag, prog_callback)
+        finally:
+            if bypass_cache:
+                drop_file_cache(f.fileno())
+
+
+def _hash_open_file(f, h, kill_flag=None, prog_callback=None) -> bool:
+    """Feed the contents of an open file into a hash, for hash_file().
+
+    Args:
+        f (io.FileIO): The file to hash, opened unbuffered.
+        h (blake3): The hash object to update.
+        kill_flag (def): The function to get a kill flag (optional).
+        prog_callback (def): The function to call with the number of bytes hashed (optional).
+
+    Returns:
+        bool: Whether the whole file was hashed, or False if it was killed.
+    """
+
+    file_size = os.fstat(f.fileno()).st_size
+
+    if file_size >= FileUtils.HASH_MMAP_THRESHOLD:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as file_map, memoryview(file_map) as file_view:
+            for offset in range(0, len(file_view), FileUtils.HASH_MMAP_SLICE_SIZE):
+                if kill_flag is not None and kill_flag():
+                    return False
+
+                h.update(file_view[offset:offset + FileUtils.HASH_MMAP_SLICE_SIZE])
+                if prog_callback is not None:
+                    prog_callback(min(offset + FileUtils.HASH_MMAP_SLICE_SIZE, len(file_view)))
+
+        return True
+
+    # Optimize the buffer for small files
+    mv = memoryview(bytearray(max(min(FileUtils.READINTO_BUFSIZE, file_size), 1024)))
 
-    if kill_flag():
+    hashed = 0
+    for n in iter(lambda: f.readinto(mv), 0):
+        if kill_flag is not None and kill_flag():
+            return False
+
+        h.update(mv[:n])
+        hashed += n
+        if prog_callback is not None:
+            prog_callback(hashed)
+
+    return True
+
+
+def get_file_hash(filename, kill_flag, bypass_cache: bool = False) -> str:
+    """Get the hash of a file.
+
+    Args:
+        filename (String): The file to get the hash of.
+        kill_flag (function): The function to get a kill flag.
+        bypass_cache (bool): Whether to read the file from the drive instead of the
+            page cache, as in hash_file() (default: False).
+
+    Returns:
+        String: The blake3 hash of the file if readable. None otherwise.
+    """
+
+    h = new_file_hash(os.path.getsize(filename))
+    if not hash_file(filename, h, kill_flag, bypass_cache=bypass_cache):
         return ''
 
     return h.hexdigest()
 
 
-def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag, display_index: int = None) -> dict:
+def get_file_chunks(filename, kill_flag, bypass_cache: bool = False) -> tuple:
+    """Get the hash of a file, and the digest of each of its chunks.
+
+    Args:
+        filename (String): The file to get the hash of.
+        kill_flag (function): The function to get a kill flag.
+        bypass_cache (bool): Whether to read the file from the drive instead of the
+            page cache, as in hash_file() (default: False).
+
+    Returns:
+        tuple:
+            String: The blake3 hash of the file, or an empty string if killed.
+            bytes[]: The digest of each FileUtils.CHUNK_SIZE chunk of the file.
+    """
+
+    h = ChunkedHash(max_threads=FileUtils.HASH_MAX_THREADS if os.path.getsize(filename) >= FileUtils.HASH_MMAP_THRESHOLD else 1)
+    if not hash_file(filename, h, kill_flag, bypass_cache=bypass_cache):
+        return ('', [])
+
+    return (h.hexdigest(), h.chunk_digests())
+
+
+def copy_small_file(source_filename, dest_filename) -> str:
+    """Copy a small file to a destination in memory.
+
+    The source is read in a single call, hashed in memory, and written in a single
+    call, and the destination is verified with a single re-read. The caller is
+    responsible for making sure the destination directory exists.
+
+    Args:
+        source_filename (String): The source to copy.
+        dest_filename (String): The destination to copy to.
+
+    Returns:
+        String: The hash of the file if it was copied and verified successfully.
+        None: If the file failed to copy.
+    """
+
+    try:
+        with open(source_filename, 'rb', buffering=0) as f:
+            data = f.readall()
+        source_hash = blake3(data).hexdigest()
+
+        if is_hardlinked(dest_filename):
+            os.remove(dest_filename)
+
+        with open(dest_filename, 'wb', buffering=0) as f:
+            f.write(data)
+        shutil.copystat(source_filename, dest_filename)
+
+        with open(dest_filename, 'rb', buffering=0) as f:
+            dest_hash = blake3(f.readall()).hexdigest()
+    except OSError:
+        dest_hash = None
+        source_hash = ''
+
+    if source_hash == dest_hash:
+        return dest_hash
+
+    # If file wasn't copied successfully, delete it
+    try:
+        if os.path.isfile(dest_filename):
+            os.remove(dest_filename)
+    except PermissionError:
+        pass
+
+    return None
+
+
+def copy_small_files(file_list: list, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag, max_workers: int = None) -> dict:
+    """Copy a batch of small files on a pool of workers.
+
+    Destination directories are created once for the whole batch before any
+    files are copied.
+
+    Args:
+        file_list (tuple[]): The files to copy.
+            tuple[0] (String): The source to copy.
+            tuple[1] (String): The destination to copy to.
+            tuple[2] (int): The size of the source file.
+        drive_path (String): The path of the destination drive to copy to.
+        pre_callback (def): The function to call with the destination and size of each file before it's copied.
+        prog_callback (def): The function to call on progress change.
+        fd_callback (def): The function to run after copy to update file details.
+        get_backup_killflag (def): The function to use to get the backup thread kill flag.
+        max_workers (int): The number of files to copy at once (optional, default
+            FileUtils.SMALL_FILE_WORKERS).
+
+    Returns:
+        dict: A list of file hashes for each file copied
+            Key (String): The filename to hash.
+            Value (String): The hash of the file.
+    """
+
+    if max_workers is None:
+        max_workers = FileUtils.SMALL_FILE_WORKERS
+
+    for path_stub in {os.path.dirname(dest_filename) for source_filename, dest_filename, size in file_list}:
+        os.makedirs(path_stub, exist_ok=True)
+
+    def copy_worker(file) -> tuple:
+        """Copy a single file from the batch, and report it to the GUI.
+
+        Args:
+            file (tuple): The file to copy, as listed in the batch.
+
+        Returns:
+            tuple: The destination file, and its hash if it was copied.
+        """
+
+        source_filename, dest_filename, size = file
+
+        if get_backup_killflag():
+            return (dest_filename, None)
+
+        pre_callback(dest_filename, size)
+        new_hash = copy_small_file(source_filename, dest_filename)
+
+        if new_hash is not None:
+            prog_callback(c=size, t=size, op=Status.FILE_OPERATION_COPY)
+
+        fd_callback(
+            status=Status.FILE_OPERATION_SUCCESS if new_hash is not None else Status.FILE_OPERATION_FAILED,
+            file=(dest_filename, size, Status.FILE_OPERATION_COPY, None)
+        )
+
+        return (dest_filename, new_hash)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Small File Copy') as executor:
+        results = list(executor.map(copy_worker, file_list))
+
+    return {dest_filename[len(drive_path):].strip(os.path.sep): new_hash for dest_filename, new_hash in results if new_hash is not None and dest_filename.find(drive_path) == 0}
+
+
+def is_hardlinked(filename) -> bool:
+    """Check if a file has other hardlinks to it.
+
+    Files with other links can't be written over in place, since that would
+    change the other links too.
+
+    Args:
+        filename (String): The file to check.
+
+    Returns:
+        bool: Whether the file has more than one link.
+    """
+
+    try:
+        return os.lstat(filename).st_nlink > 1
+    except OSError:
+        return False
+
+
+def link_file(target_filename, dest_filename) -> bool:
+    """Create a hardlink to a file on a destination, replacing anything already there.
+
+    The link is made under a temporary name, and renamed over the destination,
+    so an existing file is only replaced once the link exists.
+
+    Args:
+        target_filename (String): The existing file to link to.
+        dest_filename (String): The path of the link to create.
+
+    Returns:
+        bool: Whether the link was created. This is False if the filesystem
+        doesn't support hardlinks.
+    """
+
+    temp_filename = f'{dest_filename}.backdrop-link'
+
+    try:
+        os.makedirs(os.path.dirname(dest_filename), exist_ok=True)
+        if os.path.lexists(temp_filename):
+            os.remove(temp_filename)
+        os.link(target_filename, temp_filename)
+        os.replace(temp_filename, dest_filename)
+    except (OSError, NotImplementedError):
+        try:
+            if os.path.lexists(temp_filename):
+                os.remove(temp_filename)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
+def clone_file(target_filename, dest_filename) -> bool:
+    """Create a copy of a file on a destination that shares its data with the original.
+
+    The clone is a separate file with its own metadata, but takes up no extra
+    space until one of the files is changed. The clone is made under a temporary
+    name, and renamed over the destination, as in link_file().
+
+    Args:
+        target_filename (String): The existing file to clone.
+        dest_filename (String): The path of the clone to create.
+
+    Returns:
+        bool: Whether the file was cloned. This is False if the OS or filesystem
+        doesn't support cloning files.
+    """
+
+    if platform.system() != 'Linux':
+        return False
+
+    temp_filename = f'{dest_filename}.backdrop-clone'
+
+    try:
+        os.makedirs(os.path.dirname(dest_filename), exist_ok=True)
+        with open(target_filename, 'rb') as fsrc, open(temp_filename, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FileUtils.FICLONE, fsrc.fileno())
+        os.replace(temp_filename, dest_filename)
+    except OSError:
+        try:
+            if os.path.lexists(temp_filename):
+                os.remove(temp_filename)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
+def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get_backup_killflag, display_index: int = None, copy_strategy=None, chunk_callback=None, cache_hints: bool = False, sparse_callback=None, hardlinks: dict = None, source_hashes=None) -> dict:
     """Copy a source to a destination.
 
     Args:
@@ -297,6 +1443,17 @@ def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get
         fd_callback (def): The function to run after copy to update file details.
         get_backup_killflag (def): The function to use to get the backup thread kill flag.
         display_index (int): The index to display the item in the GUI (optional).
+        copy_strategy (String): The FileUtils copy strategy to use (optional).
+        chunk_callback (def): The function to call when chunks of large files are saved (optional).
+        cache_hints (bool): Whether to keep copied data out of the page cache (default: False).
+        sparse_callback (def): The function to call with the size of holes skipped in sparse files (optional).
+        hardlinks (dict): The hardlinked files found so far, when copying the
+            folders inside a folder that's being copied (optional).
+            targets (dict): The first copy of each file, keyed by (st_dev, st_ino).
+            pending (tuple[]): The links left to create, as (target, dest, size).
+        source_hashes (SourceHashCache): The cache to look up the hash of each source
+            file in, so that it doesn't need hashing again, and to save the hashes
+            of files that weren't in it (optional).
 
     Returns:
         dict: A list of file hashes for each file copied
@@ -306,17 +1463,74 @@ def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get
 
     new_hash_list = {}
 
+    def copy_single_file(source_filename, dest_filename) -> tuple:
+        """Copy a single file, using its hash from the source hash cache if it's there.
+
+        Args:
+            source_filename (String): The source to copy.
+            dest_filename (String): The destination to copy to.
+
+        Returns:
+            tuple: The result of copy_file().
+        """
+
+        source_stat, source_digest = source_hashes.lookup(source_filename) if source_hashes is not None else (None, None)
+
+        new_hash = copy_file(
+            source_filename=source_filename,
+            dest_filename=dest_filename,
+            drive_path=drive_path,
+            pre_callback=lambda: pre_callback(display_index=display_index, filename=dest_filename),
+            prog_callback=prog_callback,
+            fd_callback=fd_callback,
+            get_backup_killflag=get_backup_killflag,
+            copy_strategy=copy_strategy,
+            chunk_callback=chunk_callback,
+            cache_hints=cache_hints,
+            sparse_callback=sparse_callback,
+            source_digest=source_digest
+        )
+
+        if new_hash is not None and source_digest is None and source_hashes is not None:
+            source_hashes.add(source_filename, source_stat, new_hash[1])
+
+        return new_hash
+
+    def copy_small_file_batch(file_list: list, file_stats: dict) -> dict:
+        """Copy a batch of small files, and save their hashes in the source hash cache.
+
+        Args:
+            file_list (tuple[]): The files to copy, as in copy_small_files().
+            file_stats (dict): The stats of each source from before it was copied.
+
+        Returns:
+            dict: The hashes returned by copy_small_files().
+        """
+
+        file_hashes = copy_small_files(
+            file_list=file_list,
+            drive_path=drive_path,
+            pre_callback=lambda filename, size: pre_callback(display_index=display_index, filename=filename),
+            prog_callback=prog_callback,
+            fd_callback=fd_callback,
+            get_backup_killflag=get_backup_killflag
+        )
+
+        if source_hashes is not None:
+            for source_filename, dest_filename, size in file_list:
+                source_hashes.add(source_filename, file_stats.get(source_filename), file_hashes.get(dest_filename[len(drive_path):].strip(os.path.sep)))
+
+        return file_hashes
+
+    # Each hardlinked file is copied once, and linked to everywhere else it's
+    # found, once everything in the folder being copied has been copied
+    top_level = hardlinks is None
+    if top_level:
+        hardlinks = {'targets': {}, 'pending': []}
+
     if os.path.isfile(src):
         if not get_backup_killflag():
-            new_hash = copy_file(
-                source_filename=src,
-                dest_filename=dest,
-                drive_path=drive_path,
-                pre_callback=lambda: pre_callback(display_index=display_index, filename=dest),
-                prog_callback=prog_callback,
-                fd_callback=fd_callback,
-                get_backup_killflag=get_backup_killflag
-            )
+            new_hash = copy_single_file(src, dest)
 
             if new_hash is not None and dest.find(new_hash[0]) == 0:
                 file_path_stub = dest.split(new_hash[0])[1].strip(os.path.sep)
@@ -327,26 +1541,35 @@ def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get
             os.makedirs(dest)
 
         try:
+            small_file_list = []
+            small_file_stats = {}
             for entry in os.scandir(src):
                 if get_backup_killflag():
                     break
 
                 filename = entry.path.split(os.path.sep)[-1]
-                if entry.is_file():
-                    src_file = os.path.join(src, filename)
+                if entry.is_file() and entry.stat().st_nlink > 1:
+                    link_key = (entry.stat().st_dev, entry.stat().st_ino)
+                    if link_key in hardlinks['targets']:
+                        hardlinks['pending'].append((hardlinks['targets'][link_key], os.path.join(dest, filename), entry.stat().st_size))
+                        continue
+                    hardlinks['targets'][link_key] = os.path.join(dest, filename)
+
+                if entry.is_file() and entry.stat().st_size <= FileUtils.SMALL_FILE_THRESHOLD:
+                    # Batch small files to copy together
+                    small_file_list.append((os.path.join(src, filename), os.path.join(dest, filename), entry.stat().st_size))
+                    small_file_stats[os.path.join(src, filename)] = entry.stat()
+
+                    if len(small_file_list) >= FileUtils.SMALL_FILE_BATCH_SIZE:
+                        new_hash_list.update(copy_small_file_batch(small_file_list, small_file_stats))
+                        small_file_list = []
+                        small_file_stats = {}
+                elif entry.is_file():
                     dest_file = os.path.join(dest, filename)
 
-                    new_hash = copy_file(
-                        source_filename=src_file,
-                        dest_filename=dest_file,
-                        drive_path=drive_path,
-                        pre_callback=lambda: pre_callback(display_index=display_index, filename=dest_file),
-                        prog_callback=prog_callback,
-                        fd_callback=fd_callback,
-                        get_backup_killflag=get_backup_killflag
-                    )
-                    if new_hash is not None and dest.find(new_hash[0]) == 0:
-                        file_path_stub = dest.split(new_hash[0])[1].strip(os.path.sep)
+                    new_hash = copy_single_file(os.path.join(src, filename), dest_file)
+                    if new_hash is not None and dest_file.find(new_hash[0]) == 0:
+                        file_path_stub = dest_file.split(new_hash[0])[1].strip(os.path.sep)
                         new_hash_list[file_path_stub] = new_hash[1]
                 elif entry.is_dir():
                     new_hash_list.update(
@@ -357,10 +1580,44 @@ def do_copy(src, dest, drive_path, pre_callback, prog_callback, fd_callback, get
                             pre_callback=pre_callback,
                             prog_callback=prog_callback,
                             fd_callback=fd_callback,
-                            get_backup_killflag=get_backup_killflag
+                            get_backup_killflag=get_backup_killflag,
+                            copy_strategy=copy_strategy,
+                            chunk_callback=chunk_callback,
+                            cache_hints=cache_hints,
+                            sparse_callback=sparse_callback,
+                            hardlinks=hardlinks,
+                            source_hashes=source_hashes
                         )
                     )
 
+            if small_file_list:
+                new_hash_list.update(copy_small_file_batch(small_file_list, small_file_stats))
+
+            if top_level:
+                for target_file, dest_file, size in hardlinks['pending']:
+                    if get_backup_killflag():
+                        break
+
+                    target_stub = target_file[len(drive_path):].strip(os.path.sep)
+                    dest_stub = dest_file[len(drive_path):].strip(os.path.sep)
+
+                    # Fall back to copying the file if its first copy failed, or links aren't supported
+                    if target_stub in new_hash_list and link_file(target_file, dest_file):
+                        new_hash_list[dest_stub] = new_hash_list[target_stub]
+                        fd_callback(
+                            status=Status.FILE_OPERATION_SUCCESS,
+                            file=(dest_file, size, Status.FILE_OPERATION_COPY, None)
+                        )
+                        continue
+
+                    new_hash = copy_single_file(os.path.join(src, os.path.relpath(dest_file, dest)), dest_file)
+                    if new_hash is not None and dest_file.find(new_hash[0]) == 0:
+                        new_hash_list[dest_stub] = new_hash[1]
+
+                # Folders that were linked into were already copied, so put their mtimes back
+                for dest_dir in {os.path.dirname(dest_file) for target_file, dest_file, size in hardlinks['pending']}:
+                    shutil.copystat(os.path.join(src, os.path.relpath(dest_dir, dest)), dest_dir)
+
             # Handle changing attributes of folders if we copy a new folder
             shutil.copymode(src, dest)
             shutil.copystat(src, dest)
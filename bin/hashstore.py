@@ -0,0 +1,490 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from bin.database import open_database
+
+
+class HashStore:
+    """A per-drive catalog of file hashes and metadata, backed by SQLite.
+
+    Each file on the drive is stored with its size, mtime, inode, hash, and
+    the time the hash was last verified. Lookups and deletes use the path index,
+    so the catalog never needs to be loaded into memory in full, and changes are
+    written in transactions instead of rewriting the whole file.
+
+    Large files can also have the digest of each fixed size chunk stored, so
+    that when they change, only the chunks that differ need to be rewritten.
+
+    Paths are stored on disk with / separators, and use the OS path separator
+    in memory.
+    """
+
+    # Name of the hash catalog in the backup config folder on each drive
+    FILENAME = 'hashes.db'
+
+    # Hash files from older versions, migrated into the catalog the first time it's opened
+    LEGACY_HASH_FILE = 'hashes.pkl'
+    LEGACY_JOURNAL_SUFFIX = '.journal'
+
+    # Number of rows to fetch at once when iterating the catalog
+    PAGE_SIZE = 5000
+
+    # Size in bytes of each chunk digest
+    CHUNK_DIGEST_SIZE = 32
+
+    def __init__(self, filename, root=None):
+        """Open a hash store, creating it if it doesn't exist.
+
+        Args:
+            filename (String): The path of the hash catalog file.
+            root (String): The path the stored filenames are relative to (optional).
+                If set, file metadata is read from the drive when hashes are saved.
+        """
+
+        self.filename = filename
+        self.root = root
+        self._lock = threading.RLock()
+
+        self._conn = open_database(self.filename, self._init_database)
+
+        self._migrate_legacy_hashes()
+
+    def _init_database(self, conn: sqlite3.Connection):
+        """Set up a new connection to the catalog, and create the tables if needed.
+
+        Args:
+            conn (sqlite3.Connection): The new connection.
+        """
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            digest TEXT,
+            last_verified REAL
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chunks (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            chunk_size INTEGER,
+            digests BLOB
+        ) WITHOUT ROWID''')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_last_verified ON files (last_verified)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_size_digest ON files (size, digest)')
+        conn.commit()
+
+    @staticmethod
+    def _to_db_path(file_name) -> str:
+        return '/'.join(file_name.split(os.path.sep))
+
+    @staticmethod
+    def _from_db_path(file_name) -> str:
+        return os.path.sep.join(file_name.split('/'))
+
+    def _migrate_legacy_hashes(self):
+        """Import hashes from an old pickled hash file and its journal, and delete them."""
+
+        legacy_filename = os.path.join(os.path.dirname(self.filename), HashStore.LEGACY_HASH_FILE)
+        legacy_journal_filename = f'{legacy_filename}{HashStore.LEGACY_JOURNAL_SUFFIX}'
+
+        if not os.path.isfile(legacy_filename) and not os.path.isfile(legacy_journal_filename):
+            return
+
+        hash_list = {}
+        try:
+            with open(legacy_filename, 'rb') as f:
+                hash_list = pickle.load(f)
+        except Exception:
+            # Hash file is missing or corrupt
+            pass
+
+        try:
+            with open(legacy_journal_filename, 'rb') as f:
+                while True:
+                    try:
+                        record_type, file_name, hash_val = pickle.load(f)
+                    except Exception:
+                        # End of journal, or partially written record from an interrupted write
+                        break
+
+                    if record_type == 's':
+                        hash_list[file_name] = hash_val
+                    else:
+                        hash_list.pop(file_name, None)
+        except FileNotFoundError:
+            pass
+
+        self.update({HashStore._from_db_path(file_name): hash_val for file_name, hash_val in hash_list.items()}, verified=False)
+
+        for filename in [legacy_filename, legacy_journal_filename]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def _get_file_meta(self, file_name) -> tuple:
+        """Get the size, mtime, and inode of a file on the drive.
+
+        Args:
+            file_name (String): The file to check.
+
+        Returns:
+            tuple: (size, mtime_ns, inode), or None values if the file can't be read.
+        """
+
+        if self.root is None:
+            return (None, None, None)
+
+        try:
+            file_stat = os.stat(os.path.join(self.root, file_name))
+        except OSError:
+            return (None, None, None)
+
+        return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+    def close(self):
+        """Commit any changes, and close the store."""
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def prune(self, root, ignore_list: list = None, file_exists=None) -> int:
+        """Remove hashes for files that no longer exist, or are in ignored folders.
+
+        Args:
+            root (String): The path the stored filenames are relative to.
+            ignore_list (String[]): Top level folders to drop hashes for (optional).
+            file_exists (def): The function to check if a file exists, given its
+                stored filename (optional). Defaults to checking the drive.
+
+        Returns:
+            int: The number of hashes removed.
+        """
+
+        if ignore_list is None:
+            ignore_list = []
+        if file_exists is None:
+            file_exists = lambda file_name: os.path.isfile(os.path.join(root, file_name))
+
+        stale_files = [file_name for file_name in self.keys()
+                       if file_name.split(os.path.sep)[0] in ignore_list
+                       or not file_exists(file_name)]
+        self.delete(stale_files)
+
+        # Partly copied files have chunks saved but no hash yet, so they're kept as long as they exist
+        with self._lock:
+            partial_files = [HashStore._from_db_path(file_name) for (file_name,) in self._conn.execute('SELECT path FROM chunks WHERE path NOT IN (SELECT path FROM files)')]
+        stale_partial_files = [file_name for file_name in partial_files
+                               if file_name.split(os.path.sep)[0] in ignore_list
+                               or not file_exists(file_name)]
+        self.delete(stale_partial_files)
+
+        return len(stale_files)
+
+    def set(self, file_name, hash_val, verified: bool = True):
+        """Set the hash for a file.
+
+        Args:
+            file_name (String): The filename to hash.
+            hash_val (String): The hash of the file.
+            verified (bool): Whether the hash was just verified against the file (default: True).
+        """
+
+        self.update({file_name: hash_val}, verified)
+
+    def update(self, hash_list: dict, verified: bool = True):
+        """Set the hashes for a list of files in a single transaction.
+
+        Args:
+            hash_list (dict): The hashes to set.
+                Key (String): The filename to hash.
+                Value (String): The hash of the file.
+            verified (bool): Whether the hashes were just verified against the files (default: True).
+        """
+
+        if not hash_list:
+            return
+
+        verified_time = time.time() if verified else None
+        rows = [(HashStore._to_db_path(file_name), *self._get_file_meta(file_name), hash_val, verified_time) for file_name, hash_val in hash_list.items()]
+
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, digest, last_verified) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def mark_verified(self, file_list: list):
+        """Record that the hashes for a list of files were verified.
+
+        Args:
+            file_list (String[]): The filenames that were verified.
+        """
+
+        verified_time = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE files SET last_verified = ? WHERE path = ?', [(verified_time, HashStore._to_db_path(file_name)) for file_name in file_list])
+
+    def delete(self, file_list: list, keep_chunks: bool = False):
+        """Remove the hashes for a list of files in a single transaction.
+
+        Args:
+            file_list (String[]): The filenames to remove.
+            keep_chunks (bool): Whether to keep the chunk digests, so that partly
+                written files can still be resumed (default: False).
+        """
+
+        if not file_list:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM files WHERE path = ?', [(HashStore._to_db_path(file_name),) for file_name in file_list])
+            if not keep_chunks:
+                self._conn.executemany('DELETE FROM chunks WHERE path = ?', [(HashStore._to_db_path(file_name),) for file_name in file_list])
+
+    def move(self, old_file_name, new_file_name):
+        """Move the saved hash for a file that was renamed, keeping its metadata.
+
+        Args:
+            old_file_name (String): The filename the hash was saved under.
+            new_file_name (String): The filename the file was renamed to.
+        """
+
+        with self._lock, self._conn:
+            for table in ['files', 'chunks']:
+                self._conn.execute(f'DELETE FROM {table} WHERE path = ?', (HashStore._to_db_path(new_file_name),))
+                self._conn.execute(f'UPDATE {table} SET path = ? WHERE path = ?', (HashStore._to_db_path(new_file_name), HashStore._to_db_path(old_file_name)))
+
+    def get(self, file_name, default=None) -> str:
+        """Get the hash for a file.
+
+        Args:
+            file_name (String): The filename to get the hash of.
+            default (*): The value to return if the file has no hash (optional).
+
+        Returns:
+            String: The hash of the file, if it's in the store.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT digest FROM files WHERE path = ?', (HashStore._to_db_path(file_name),)).fetchone()
+
+        return row[0] if row is not None else default
+
+    def get_record(self, file_name) -> dict:
+        """Get the saved hash and metadata for a file.
+
+        Args:
+            file_name (String): The filename to look up.
+
+        Returns:
+            dict: The saved info for the file, or None if the file isn't in the store.
+                size (int): The size of the file when it was hashed.
+                mtime_ns (int): The mtime of the file when it was hashed.
+                inode (int): The inode of the file when it was hashed.
+                digest (String): The hash of the file.
+                last_verified (float): The timestamp the hash was last verified.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime_ns, inode, digest, last_verified FROM files WHERE path = ?', (HashStore._to_db_path(file_name),)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(['size', 'mtime_ns', 'inode', 'digest', 'last_verified'], row))
+
+    def has_size(self, size: int, mtime_ns: int = None) -> bool:
+        """Check if any file in the store has a given size.
+
+        This is used to skip hashing a file to look for copies of it, if no file
+        could be a copy.
+
+        Args:
+            size (int): The size to look for.
+            mtime_ns (int): The mtime the file also needs to have (optional).
+
+        Returns:
+            bool: Whether a file with the size, and mtime if given, is in the store.
+        """
+
+        with self._lock:
+            if mtime_ns is None:
+                return self._conn.execute('SELECT 1 FROM files WHERE size = ? LIMIT 1', (size,)).fetchone() is not None
+
+            return self._conn.execute('SELECT 1 FROM files WHERE size = ? AND mtime_ns = ? LIMIT 1', (size, mtime_ns)).fetchone() is not None
+
+    def find_by_digest(self, digest, size: int) -> list:
+        """Find the files in the store with a given hash and size.
+
+        Args:
+            digest (String): The hash to look for.
+            size (int): The size of the file.
+
+        Returns:
+            tuple[]: The filename of each file, and its mtime when it was hashed.
+        """
+
+        with self._lock:
+            rows = self._conn.execute('SELECT path, mtime_ns FROM files WHERE size = ? AND digest = ?', (size, digest)).fetchall()
+
+        return [(HashStore._from_db_path(file_name), mtime_ns) for file_name, mtime_ns in rows]
+
+    def set_chunks(self, file_name, chunk_size: int, digests: list, complete: bool = True):
+        """Set the chunk digests for a file.
+
+        Complete chunk lists are saved with the current size and mtime of the
+        file, and are only returned by get_chunks() while the file still matches.
+        Partial chunk lists, saved while a file is being copied, cover the start
+        of the file, and are returned as long as the file is at least that long.
+        The whole file hash no longer matches a partly written file, so saving a
+        partial chunk list removes it.
+
+        Args:
+            file_name (String): The filename the chunks are for.
+            chunk_size (int): The size of each chunk in bytes.
+            digests (bytes[]): The BLAKE3 digest of each chunk, in order.
+            complete (bool): Whether the digests cover the whole file (default: True).
+        """
+
+        if complete:
+            size, mtime_ns, inode = self._get_file_meta(file_name)
+        else:
+            size, mtime_ns = (len(digests) * chunk_size, None)
+
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO chunks (path, size, mtime_ns, chunk_size, digests) VALUES (?, ?, ?, ?, ?)',
+                               (HashStore._to_db_path(file_name), size, mtime_ns, chunk_size, b''.join(digests)))
+            if not complete:
+                self._conn.execute('DELETE FROM files WHERE path = ?', (HashStore._to_db_path(file_name),))
+
+    def get_chunks(self, file_name, size: int, mtime_ns: int) -> tuple:
+        """Get the chunk digests for a file, if they're still valid.
+
+        Args:
+            file_name (String): The filename to get the chunks of.
+            size (int): The current size of the file.
+            mtime_ns (int): The current mtime of the file.
+
+        Returns:
+            tuple: The chunk size, and the list of chunk digests, or None if there are
+                no chunks saved for the file, or the file has changed since they were.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime_ns, chunk_size, digests FROM chunks WHERE path = ?', (HashStore._to_db_path(file_name),)).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+        if row[1] is None and (row[0] == 0 or row[0] > size):
+            return None
+        if row[1] is not None and (row[0] != size or row[1] != mtime_ns):
+            return None
+
+        chunk_size, digests = row[2], row[3]
+        return (chunk_size, [digests[i:i + HashStore.CHUNK_DIGEST_SIZE] for i in range(0, len(digests), HashStore.CHUNK_DIGEST_SIZE)])
+
+    def items(self):
+        """Iterate over the saved hashes, a page at a time.
+
+        Yields:
+            tuple: The filename, and its hash.
+        """
+
+        last_path = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT path, digest FROM files WHERE path > ? ORDER BY path LIMIT ?', (last_path, HashStore.PAGE_SIZE)).fetchall()
+
+            if not rows:
+                break
+
+            for file_name, hash_val in rows:
+                yield (HashStore._from_db_path(file_name), hash_val)
+
+            last_path = rows[-1][0]
+
+    def items_by_last_verified(self, verified_before: float = None):
+        """Iterate over the saved hashes, from the longest since verified, a page at a time.
+
+        Files that have never been verified come first.
+
+        Args:
+            verified_before (float): The timestamp to stop at, so that files verified since
+                then are skipped (optional).
+
+        Yields:
+            tuple: The filename, its hash, and its size when it was hashed.
+        """
+
+        last_path = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT path, digest, size FROM files WHERE last_verified IS NULL AND path > ? ORDER BY path LIMIT ?', (last_path, HashStore.PAGE_SIZE)).fetchall()
+
+            if not rows:
+                break
+
+            for file_name, hash_val, size in rows:
+                yield (HashStore._from_db_path(file_name), hash_val, size)
+
+            last_path = rows[-1][0]
+
+        last_key = (float('-inf'), '')
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT path, digest, size, last_verified FROM files WHERE (last_verified, path) > (?, ?) AND last_verified < ? ORDER BY last_verified, path LIMIT ?',
+                                          (*last_key, verified_before if verified_before is not None else float('inf'), HashStore.PAGE_SIZE)).fetchall()
+
+            if not rows:
+                break
+
+            for file_name, hash_val, size, last_verified in rows:
+                yield (HashStore._from_db_path(file_name), hash_val, size)
+
+            last_key = (rows[-1][3], rows[-1][0])
+
+    def get_total_size(self) -> int:
+        """Get the total size of the files with saved hashes.
+
+        Returns:
+            int: The total size of the files, as of when they were hashed.
+        """
+
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def keys(self):
+        """Iterate over the filenames with saved hashes.
+
+        Yields:
+            String: The filename.
+        """
+
+        for file_name, hash_val in self.items():
+            yield file_name
+
+    def __contains__(self, file_name) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM files WHERE path = ?', (HashStore._to_db_path(file_name),)).fetchone() is not None
+
+    def __getitem__(self, file_name) -> str:
+        hash_val = self.get(file_name)
+        if hash_val is None:
+            raise KeyError(file_name)
+
+        return hash_val
+
+    def __setitem__(self, file_name, hash_val):
+        self.set(file_name, hash_val)
+
+    def __delitem__(self, file_name):
+        if file_name not in self:
+            raise KeyError(file_name)
+
+        self.delete([file_name])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
@@ -0,0 +1,292 @@
+import os
+import sqlite3
+import threading
+
+from bin.snapshot import SnapshotEntry
+from bin.database import open_database
+
+
+class DriveManifest:
+    """A record of the files BackDrop has written to a destination drive, backed by SQLite.
+
+    The manifest stores the listing of each folder on the drive, with the size,
+    mtime, and inode of each file. It's updated as files are copied and deleted,
+    so that analysis can read listings from it instead of walking the drive.
+
+    Folders are only listed in the manifest once their full contents are known.
+    Folders that aren't listed have to be read from the drive.
+
+    The manifest has a generation number, which is also saved in the backup
+    config on the drive once a backup finishes. If the two don't match, the
+    drive was changed by something that didn't update the manifest, and it
+    can't be trusted.
+    """
+
+    # Name of the manifest in the backup config folder on each drive
+    FILENAME = 'manifest.db'
+
+    def __init__(self, filename, root):
+        """Open a drive manifest, creating it if it doesn't exist.
+
+        Args:
+            filename (String): The path of the manifest file.
+            root (String): The path of the drive the manifest is for.
+        """
+
+        self.filename = filename
+        self.root = root
+        self._lock = threading.RLock()
+
+        self._conn = open_database(self.filename, self._init_database)
+
+    def _init_database(self, conn: sqlite3.Connection):
+        """Set up a new connection to the manifest, and create the tables if needed.
+
+        Args:
+            conn (sqlite3.Connection): The new connection.
+        """
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+            dir TEXT,
+            name TEXT,
+            is_dir INTEGER,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            PRIMARY KEY (dir, name)
+        ) WITHOUT ROWID''')
+        conn.commit()
+
+    @staticmethod
+    def _to_db_path(path) -> str:
+        return '/'.join(path.strip(os.path.sep).split(os.path.sep)) if path else ''
+
+    @staticmethod
+    def _join(dir_path, name) -> str:
+        return f'{dir_path}/{name}' if dir_path else name
+
+    @staticmethod
+    def _split(db_path) -> tuple:
+        """Split a manifest path into its folder and name.
+
+        Args:
+            db_path (String): The path to split.
+
+        Returns:
+            tuple: The folder, and the name of the file or folder in it.
+        """
+
+        if '/' not in db_path:
+            return ('', db_path)
+
+        return tuple(db_path.rsplit('/', 1))
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+
+        return row[0] if row is not None else 0
+
+    def set_generation(self, generation: int):
+        """Set the generation number of the manifest.
+
+        Args:
+            generation (int): The generation to set.
+        """
+
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (generation,))
+
+    def clear(self):
+        """Drop everything in the manifest, so the drive is read again."""
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dirs')
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute("DELETE FROM meta WHERE key = 'generation'")
+
+    def close(self):
+        """Commit any changes, and close the manifest."""
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def list_directory(self, path) -> list:
+        """Get the entries in a folder on the drive, sorted by name.
+
+        Args:
+            path (String): The folder to list, relative to the drive.
+
+        Returns:
+            SnapshotEntry[]: The entries in the folder, or None if the folder isn't listed.
+        """
+
+        db_path = DriveManifest._to_db_path(path)
+        full_path = os.path.join(self.root, path)
+
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM dirs WHERE path = ?', (db_path,)).fetchone() is None:
+                return None
+
+            rows = self._conn.execute('SELECT name, is_dir, size, mtime_ns, inode FROM entries WHERE dir = ?', (db_path,)).fetchall()
+
+        entries = [SnapshotEntry(name, os.path.join(full_path, name), bool(is_dir), size, mtime_ns, inode) for name, is_dir, size, mtime_ns, inode in rows]
+        return sorted(entries, key=lambda entry: os.path.normcase(entry.name))
+
+    def record_listing(self, path, entries: list):
+        """Save the listing of a folder read from the drive.
+
+        Args:
+            path (String): The folder that was listed, relative to the drive.
+            entries (os.DirEntry[]): The entries in the folder.
+        """
+
+        db_path = DriveManifest._to_db_path(path)
+
+        rows = []
+        for entry in entries:
+            if entry.is_dir():
+                rows.append((db_path, entry.name, True, None, None, entry.inode()))
+                continue
+
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            rows.append((db_path, entry.name, False, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino))
+
+        with self._lock, self._conn:
+            old_dirs = {name for (name,) in self._conn.execute('SELECT name FROM entries WHERE dir = ? AND is_dir = 1', (db_path,))}
+
+            self._conn.execute('DELETE FROM entries WHERE dir = ?', (db_path,))
+            self._conn.executemany('INSERT INTO entries (dir, name, is_dir, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.execute('INSERT OR IGNORE INTO dirs (path) VALUES (?)', (db_path,))
+
+            for name in old_dirs - {name for dir_path, name, is_dir, size, mtime_ns, inode in rows if is_dir}:
+                self._remove_tree(DriveManifest._join(db_path, name))
+
+    def _remove_tree(self, db_path):
+        """Drop the listings of a folder and everything in it.
+
+        Args:
+            db_path (String): The folder to drop.
+        """
+
+        self._conn.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', (db_path, len(db_path) + 1, f'{db_path}/'))
+        self._conn.execute('DELETE FROM entries WHERE dir = ? OR substr(dir, 1, ?) = ?', (db_path, len(db_path) + 1, f'{db_path}/'))
+
+    def _add_parents(self, db_path):
+        """Make sure the folders above a path are in the manifest.
+
+        Folders that weren't in a listed parent folder must have been created
+        since, so they're empty apart from what's added to them after.
+
+        Args:
+            db_path (String): The path to add the parent folders of.
+        """
+
+        parts = db_path.split('/')[:-1]
+        for i in range(len(parts)):
+            parent = '/'.join(parts[:i])
+            folder = '/'.join(parts[:i + 1])
+
+            if self._conn.execute('SELECT 1 FROM dirs WHERE path = ?', (parent,)).fetchone() is None:
+                continue
+
+            if self._conn.execute('SELECT 1 FROM entries WHERE dir = ? AND name = ?', (parent, parts[i])).fetchone() is None:
+                self._conn.execute('INSERT OR REPLACE INTO entries (dir, name, is_dir, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?)', (parent, parts[i], True, None, None, None))
+                self._conn.execute('INSERT OR IGNORE INTO dirs (path) VALUES (?)', (folder,))
+
+    def add_files(self, file_list: list):
+        """Record files that were written to the drive.
+
+        Args:
+            file_list (String[]): The files that were written, relative to the drive.
+        """
+
+        if not file_list:
+            return
+
+        with self._lock, self._conn:
+            for file_name in file_list:
+                try:
+                    file_stat = os.stat(os.path.join(self.root, file_name))
+                except OSError:
+                    continue
+
+                db_path = DriveManifest._to_db_path(file_name)
+                dir_path, name = DriveManifest._split(db_path)
+                self._add_parents(db_path)
+                self._conn.execute('INSERT OR REPLACE INTO entries (dir, name, is_dir, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?)',
+                                   (dir_path, name, False, file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino))
+
+    def remove(self, file_list: list):
+        """Record files or folders that were deleted from the drive.
+
+        Args:
+            file_list (String[]): The files and folders that were deleted, relative to the drive.
+        """
+
+        if not file_list:
+            return
+
+        with self._lock, self._conn:
+            for file_name in file_list:
+                db_path = DriveManifest._to_db_path(file_name)
+                dir_path, name = DriveManifest._split(db_path)
+                self._conn.execute('DELETE FROM entries WHERE dir = ? AND name = ?', (dir_path, name))
+                self._remove_tree(db_path)
+
+    def has_file(self, file_name) -> bool:
+        """Check if a file is on the drive, according to the manifest.
+
+        Args:
+            file_name (String): The file to check, relative to the drive.
+
+        Returns:
+            bool: Whether the file is in the manifest, or None if its folder isn't listed.
+        """
+
+        dir_path, name = DriveManifest._split(DriveManifest._to_db_path(file_name))
+
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM dirs WHERE path = ?', (dir_path,)).fetchone() is None:
+                return None
+
+            return self._conn.execute('SELECT 1 FROM entries WHERE dir = ? AND name = ? AND is_dir = 0', (dir_path, name)).fetchone() is not None
+
+    def get_size(self, path) -> int:
+        """Get the total size of the files in a folder, if the whole folder is listed.
+
+        Args:
+            path (String): The folder to check, relative to the drive.
+
+        Returns:
+            int: The size of the folder, or None if any part of it isn't listed.
+        """
+
+        db_path = DriveManifest._to_db_path(path)
+        prefix = f'{db_path}/' if db_path else ''
+
+        with self._lock:
+            listed_dirs = {dir_path for (dir_path,) in self._conn.execute('SELECT path FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', (db_path, len(prefix), prefix))}
+            if db_path not in listed_dirs:
+                return None
+
+            total = 0
+            for dir_path, name, is_dir, size in self._conn.execute('SELECT dir, name, is_dir, size FROM entries WHERE dir = ? OR substr(dir, 1, ?) = ?', (db_path, len(prefix), prefix)):
+                if not is_dir:
+                    total += size
+                elif DriveManifest._join(dir_path, name) not in listed_dirs:
+                    return None
+
+        return total
@@ -0,0 +1,88 @@
+import bisect
+import time
+
+
+def pack_subset(items: dict, capacity: int, kill_flag=None, time_budget: float = None) -> set:
+    """Find the subset of items with the largest total size that fits in a given capacity.
+
+    This is a branch and bound search over the full list of items, largest first.
+    It starts from a greedy first fit solution, and prunes any branch that can't
+    beat the best total found so far. If the search runs past the time budget,
+    or the kill flag is set, the best subset found so far is returned.
+
+    Args:
+        items (dict): The items to pack.
+            Key (String): The name of the item.
+            Value (int): The size of the item.
+        capacity (int): The space available to pack into.
+        kill_flag (def): The function to check whether to stop early (optional).
+        time_budget (float): The maximum time to search, in seconds (optional).
+
+    Returns:
+        set: The names of the items in the best subset found.
+    """
+
+    # Only items that fit on their own can be part of a subset, largest first
+    candidates = sorted(((size, name) for name, size in items.items() if size <= capacity), reverse=True)
+
+    if not candidates:
+        return set()
+
+    sizes = [size for size, name in candidates]
+    names = [name for size, name in candidates]
+
+    # If everything fits, there's nothing to search
+    if sum(sizes) <= capacity:
+        return set(names)
+
+    # Sizes are sorted descending, so negate them to binary search for the first item that fits
+    negated_sizes = [-size for size in sizes]
+
+    # suffix_sums[i] is the total size of items i and after, for bounding branches
+    suffix_sums = [0] * (len(sizes) + 1)
+    for i in range(len(sizes) - 1, -1, -1):
+        suffix_sums[i] = suffix_sums[i + 1] + sizes[i]
+
+    # Start with a greedy first fit, so that there's always a reasonable answer
+    best_sum = 0
+    best_indexes = []
+    for i, size in enumerate(sizes):
+        if best_sum + size <= capacity:
+            best_sum += size
+            best_indexes.append(i)
+
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    # Depth first search, including items before excluding them. Chosen items are
+    # tracked as a linked list of (index, parent) so each node is cheap to push.
+    stack = [(0, 0, None)]
+    nodes = 0
+    while stack and best_sum < capacity:
+        i, current_sum, chosen = stack.pop()
+
+        nodes += 1
+        if nodes % 1024 == 0:
+            if (kill_flag is not None and kill_flag()) or (deadline is not None and time.monotonic() > deadline):
+                break
+
+        # Skip to the first remaining item that fits
+        i = bisect.bisect_left(negated_sizes, current_sum - capacity, i)
+
+        # Record the subset if it's the best so far
+        if current_sum > best_sum:
+            best_sum = current_sum
+            best_indexes = []
+            node = chosen
+            while node is not None:
+                best_indexes.append(node[0])
+                node = node[1]
+
+        # Prune if even adding every remaining item can't beat the best
+        if i >= len(sizes) or current_sum + suffix_sums[i] <= best_sum:
+            continue
+
+        # Exclude item i, then include it, so that including is searched first
+        stack.append((i + 1, current_sum, chosen))
+        stack.append((i + 1, current_sum + sizes[i], (i, chosen)))
+
+    return {names[i] for i in best_indexes}
@@ -0,0 +1,223 @@
+import os
+import threading
+
+
+class DirectorySizeIndex:
+    """A shared index of directory sizes, built in a single pass over each tree.
+
+    Each directory scanned is stored as a node with the total size, file count,
+    and newest file mtime of everything under it, so that once a tree has been
+    scanned, the size of any folder inside it can be looked up without walking
+    it again.
+
+    Nodes are checked against the mtime of their directory when they're used.
+    A directory's mtime changes when files are added, removed, or renamed in it,
+    so only directories that changed are listed again, and the rest of the tree
+    costs one stat per directory. Files changed in place don't update the mtime
+    of their directory, so anything that overwrites files should call
+    invalidate() on the path when it's done.
+
+    Files with more than one hardlink are tracked by (st_dev, st_ino), so that
+    each inode is only counted once in the size of any tree that contains more
+    than one link to it.
+    """
+
+    def __init__(self):
+        """Create an empty directory size index."""
+
+        self._nodes = {}  # Scanned trees, keyed by root path
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _normalize(path) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _scan(self, path, node: dict = None) -> dict:
+        """Scan a directory, reusing any subdirectories that haven't changed.
+
+        Args:
+            path (String): The directory to scan.
+            node (dict): The existing node for the directory, if any (optional).
+
+        Returns:
+            dict: The node for the directory, or None if it can't be read.
+        """
+
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        if node is not None and node['dir_mtime'] == dir_mtime:
+            # Directory listing hasn't changed, so only subdirectories need checking
+            file_size = node['file_size']
+            file_links = node['file_links']
+            file_count = node['file_count']
+            file_mtime = node['file_mtime']
+            old_children = node['children']
+            child_names = list(old_children.keys())
+        else:
+            file_size = 0
+            file_links = {}
+            file_count = 0
+            file_mtime = 0
+            old_children = node['children'] if node is not None else {}
+            child_names = []
+
+            try:
+                for entry in os.scandir(path):
+                    # For each entry, either add filesize to the total, or queue the directory
+                    if entry.is_file():
+                        file_stat = entry.stat()
+                        if file_stat.st_nlink > 1:
+                            file_links[(file_stat.st_dev, file_stat.st_ino)] = file_stat.st_size
+                        else:
+                            file_size += file_stat.st_size
+                        file_count += 1
+                        file_mtime = max(file_mtime, file_stat.st_mtime_ns)
+                    elif entry.is_dir():
+                        child_names.append(entry.name)
+            except OSError:
+                pass
+
+        children = {}
+        for name in child_names:
+            child = self._scan(os.path.join(path, name), old_children.get(name))
+            if child is not None:
+                children[name] = child
+
+        # Hardlinked files are counted once across the whole tree. Link maps are
+        # never changed once built, so they're shared if only one part has any
+        link_maps = [link_map for link_map in [file_links] + [child['links'] for child in children.values()] if link_map]
+        if len(link_maps) > 1:
+            links = {}
+            for link_map in link_maps:
+                links.update(link_map)
+        else:
+            links = link_maps[0] if link_maps else {}
+
+        unlinked_size = file_size + sum(child['unlinked_size'] for child in children.values())
+
+        return {
+            'dir_mtime': dir_mtime,
+            'file_size': file_size,
+            'file_links': file_links,
+            'file_count': file_count,
+            'file_mtime': file_mtime,
+            'unlinked_size': unlinked_size,
+            'links': links,
+            'size': unlinked_size + sum(links.values()),
+            'count': file_count + sum(child['count'] for child in children.values()),
+            'mtime': max([file_mtime] + [child['mtime'] for child in children.values()]),
+            'children': children
+        }
+
+    def _find(self, path) -> tuple:
+        """Find the cached node for a path, from the nearest scanned tree above it.
+
+        Args:
+            path (String): The normalized path to find.
+
+        Returns:
+            tuple:
+                dict: The node for the path, or None if it hasn't been scanned.
+                dict: The node for the parent of the path, or None.
+        """
+
+        if path in self._nodes:
+            return (self._nodes[path], None)
+
+        for root, root_node in self._nodes.items():
+            if not path.startswith(root.rstrip(os.path.sep) + os.path.sep):
+                continue
+
+            parent = None
+            node = root_node
+            for name in path[len(root):].strip(os.path.sep).split(os.path.sep):
+                parent = node
+                node = node['children'].get(name) if node is not None else None
+
+            return (node, parent)
+
+        return (None, None)
+
+    def get_info(self, path) -> dict:
+        """Get the size info for a directory, scanning it if needed.
+
+        Args:
+            path (String): The directory to check.
+
+        Returns:
+            dict: The info for the directory.
+                size (int): The total size of the files in the directory.
+                count (int): The number of files in the directory.
+                mtime (int): The newest mtime of the files in the directory, in ns.
+        """
+
+        path = DirectorySizeIndex._normalize(path)
+
+        with self._lock:
+            node, parent = self._find(path)
+            node = self._scan(path, node)
+
+            if node is None:
+                return {'size': 0, 'count': 0, 'mtime': 0}
+
+            if parent is not None:
+                # Parent totals are recalculated the next time the parent is checked
+                parent['children'][os.path.basename(path)] = node
+            else:
+                # Drop any trees inside this one, since they're part of it now
+                self._nodes = {root: root_node for root, root_node in self._nodes.items() if not root.startswith(path.rstrip(os.path.sep) + os.path.sep)}
+                self._nodes[path] = node
+
+        return {
+            'size': node['size'],
+            'count': node['count'],
+            'mtime': node['mtime']
+        }
+
+    def get_size(self, path) -> int:
+        """Get the filesize of a directory and its contents.
+
+        Args:
+            path (String): The directory to check.
+
+        Returns:
+            int: The filesize of the directory, or the file if the path is a file.
+        """
+
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+
+        return self.get_info(path)['size']
+
+    def invalidate(self, path=None):
+        """Drop cached info for a directory, so that it's scanned again in full.
+
+        Args:
+            path (String): The directory to drop, or None to drop everything (optional).
+        """
+
+        with self._lock:
+            if path is None:
+                self._nodes = {}
+                return
+
+            path = DirectorySizeIndex._normalize(path)
+            node, parent = self._find(path)
+
+            if path in self._nodes:
+                del self._nodes[path]
+            elif parent is not None:
+                parent['children'].pop(os.path.basename(path), None)
+
+            # Force every tree containing the path to list it again
+            for root, root_node in self._nodes.items():
+                if path.startswith(root.rstrip(os.path.sep) + os.path.sep):
+                    node = root_node
+                    for name in path[len(root):].strip(os.path.sep).split(os.path.sep):
+                        if node is None:
+                            break
+                        node['dir_mtime'] = None
+                        node = node['children'].get(name)
@@ -0,0 +1,291 @@
+import os
+import stat
+import sqlite3
+import threading
+import time
+
+from bin.database import open_database
+
+
+class SnapshotEntry:
+    """A file or folder from a source snapshot, with the same interface as os.DirEntry."""
+
+    __slots__ = ['name', 'path', 'st_size', 'st_mtime_ns', 'st_ino', 'st_nlink', 'st_dev', '_is_dir']
+
+    def __init__(self, name, path, is_dir: bool, size: int, mtime_ns: int, inode: int, nlink: int = 1, dev: int = 0):
+        self.name = name
+        self.path = path
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+        self.st_ino = inode
+        self.st_nlink = nlink
+        self.st_dev = dev
+        self._is_dir = is_dir
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 10**9 if self.st_mtime_ns is not None else None
+
+    def is_dir(self) -> bool:
+        return self._is_dir
+
+    def is_file(self) -> bool:
+        return not self._is_dir
+
+    def inode(self) -> int:
+        return self.st_ino
+
+    def stat(self):
+        return self
+
+
+class SourceSnapshot:
+    """A persistent listing of a source tree, used to skip listing folders that haven't changed.
+
+    Each folder is stored with its mtime and inode, and the size, mtime, inode,
+    and link count of each entry in it. A folder is only listed again if its mtime has
+    changed, which happens when files are added, removed, or renamed in it.
+
+    Files that are changed in place don't change the mtime of their folder, so
+    the whole snapshot is rebuilt once it's older than MAX_AGE.
+
+    With a change journal, folders the journal saw change are listed again, and
+    if the journal is complete, the rest are used without checking the source.
+    """
+
+    # Maximum age of a snapshot in seconds before the source is scanned in full again
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    # Folders changed this recently in seconds may still be changing within the
+    # resolution of their mtime, so they're not trusted in the next analysis
+    RACY_WINDOW = 2
+
+    # Number of folders to scan between commits
+    COMMIT_INTERVAL = 500
+
+    def __init__(self, filename, root):
+        """Open a snapshot of a source, creating it if it doesn't exist.
+
+        Args:
+            filename (String): The path of the snapshot file.
+            root (String): The path of the source the snapshot is for.
+        """
+
+        self.filename = filename
+        self.root = root
+        self._lock = threading.RLock()
+        self._pending_dirs = 0
+        self._trusted = False
+        self._unwatched = []
+
+        self._conn = open_database(self.filename, self._init_database)
+
+        created = self._conn.execute("SELECT value FROM meta WHERE key = 'created'").fetchone()
+        if created is None or time.time() - created[0] > SourceSnapshot.MAX_AGE:
+            self.clear()
+
+    def _init_database(self, conn: sqlite3.Connection):
+        """Set up a new connection to the snapshot, and create the tables if needed.
+
+        Args:
+            conn (sqlite3.Connection): The new connection.
+        """
+
+        # The snapshot can always be rebuilt from the source, so favor speed over durability
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            dev INTEGER,
+            verified INTEGER
+        ) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+            dir TEXT,
+            name TEXT,
+            is_dir INTEGER,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            nlink INTEGER,
+            PRIMARY KEY (dir, name)
+        ) WITHOUT ROWID''')
+
+        # Snapshots from before link counts and folder devices were saved are listed again in full
+        if ('nlink' not in [row[1] for row in conn.execute('PRAGMA table_info(entries)')]
+                or 'verified' not in [row[1] for row in conn.execute('PRAGMA table_info(dirs)')]):
+            conn.execute('DROP TABLE entries')
+            conn.execute('DROP TABLE dirs')
+            conn.commit()
+            self._init_database(conn)
+            return
+
+        conn.commit()
+
+    @staticmethod
+    def _to_db_path(path) -> str:
+        return '/'.join(path.split(os.path.sep))
+
+    def clear(self):
+        """Drop everything in the snapshot, so the source is scanned in full."""
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dirs')
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('created', ?)", (time.time(),))
+
+    def apply_changes(self, changes: dict):
+        """Mark the folders a change journal saw change, so they're listed again.
+
+        If the journal is complete, folders that didn't change are used without
+        checking the source. Otherwise, the journal may have missed changes, so
+        every folder has to be checked against the source again before it's
+        trusted.
+
+        Args:
+            changes (dict): The changes from ChangeJournal.get_changes().
+        """
+
+        with self._lock, self._conn:
+            if not changes['complete']:
+                self._conn.execute('UPDATE dirs SET verified = 0')
+
+            self._conn.executemany('UPDATE dirs SET mtime_ns = NULL WHERE path = ?', [(path,) for path in changes['dirty']])
+
+            self._trusted = changes['complete']
+            self._unwatched = [(path, f'{path}/') for path in changes['unwatched']]
+
+    def _is_trusted(self, db_path) -> bool:
+        """Check if a folder can be used without checking the source.
+
+        Args:
+            db_path (String): The path of the folder in the snapshot.
+
+        Returns:
+            bool: Whether the change journal is watching the folder.
+        """
+
+        # The source itself is always checked, in case something was mounted over it
+        if not self._trusted or not db_path:
+            return False
+
+        return not any(db_path == path or db_path.startswith(prefix) for path, prefix in self._unwatched)
+
+    def close(self):
+        """Commit any changes, and close the snapshot."""
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def list_directory(self, path) -> list:
+        """Get the entries in a folder in the source, sorted by name.
+
+        The folder is only listed from disk if it's changed since the last time
+        it was listed.
+
+        Args:
+            path (String): The folder to list, relative to the source.
+
+        Returns:
+            SnapshotEntry[]: The entries in the folder.
+
+        Raises:
+            FileNotFoundError: If the folder doesn't exist.
+            NotADirectoryError: If the path isn't a folder.
+            OSError: If the folder can't be read.
+        """
+
+        full_path = os.path.join(self.root, path)
+        db_path = SourceSnapshot._to_db_path(path)
+
+        with self._lock:
+            row = self._conn.execute('SELECT mtime_ns, inode, dev, verified FROM dirs WHERE path = ?', (db_path,)).fetchone()
+
+            if row is not None and row[0] is not None and row[3] and self._is_trusted(db_path):
+                return self._get_entries(full_path, db_path, row[2])
+
+        dir_stat = os.stat(full_path)
+        if not stat.S_ISDIR(dir_stat.st_mode):
+            raise NotADirectoryError(full_path)
+
+        with self._lock:
+            if row is not None and row[:2] == (dir_stat.st_mtime_ns, dir_stat.st_ino):
+                if not row[3]:
+                    self._conn.execute('UPDATE dirs SET verified = 1 WHERE path = ?', (db_path,))
+                return self._get_entries(full_path, db_path, dir_stat.st_dev)
+
+            entries = self._scan(full_path, db_path, dir_stat)
+
+        return sorted(entries, key=lambda entry: os.path.normcase(entry.name))
+
+    def _get_entries(self, full_path, db_path, dev: int) -> list:
+        """Get the saved entries in a folder, sorted by name.
+
+        Args:
+            full_path (String): The full path of the folder.
+            db_path (String): The path of the folder in the snapshot.
+            dev (int): The device the folder is on.
+
+        Returns:
+            SnapshotEntry[]: The entries in the folder.
+        """
+
+        # Files are on the same device as their folder
+        rows = self._conn.execute('SELECT name, is_dir, size, mtime_ns, inode, nlink FROM entries WHERE dir = ?', (db_path,)).fetchall()
+        entries = [SnapshotEntry(name, os.path.join(full_path, name), bool(is_dir), size, mtime_ns, inode, nlink, dev) for name, is_dir, size, mtime_ns, inode, nlink in rows]
+
+        return sorted(entries, key=lambda entry: os.path.normcase(entry.name))
+
+    def _scan(self, full_path, db_path, dir_stat) -> list:
+        """List a folder from disk, and save it to the snapshot.
+
+        Args:
+            full_path (String): The full path of the folder.
+            db_path (String): The path of the folder in the snapshot.
+            dir_stat (os.stat_result): The stats of the folder before it was listed.
+
+        Returns:
+            SnapshotEntry[]: The entries in the folder.
+        """
+
+        old_dirs = {name for (name,) in self._conn.execute('SELECT name FROM entries WHERE dir = ? AND is_dir = 1', (db_path,))}
+
+        entries = []
+        for entry in os.scandir(full_path):
+            if entry.is_dir():
+                entries.append(SnapshotEntry(entry.name, entry.path, True, None, None, entry.inode()))
+                continue
+
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            entries.append(SnapshotEntry(entry.name, entry.path, False, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino, entry_stat.st_nlink, entry_stat.st_dev))
+
+        # Folders that were just changed might change again without their mtime changing
+        dir_mtime = dir_stat.st_mtime_ns
+        if time.time_ns() - dir_mtime < SourceSnapshot.RACY_WINDOW * 10**9:
+            dir_mtime = None
+
+        self._conn.execute('DELETE FROM entries WHERE dir = ?', (db_path,))
+        self._conn.executemany('INSERT INTO entries (dir, name, is_dir, size, mtime_ns, inode, nlink) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               [(db_path, entry.name, entry.is_dir(), entry.st_size, entry.st_mtime_ns, entry.st_ino, entry.st_nlink) for entry in entries])
+        self._conn.execute('INSERT OR REPLACE INTO dirs (path, mtime_ns, inode, dev, verified) VALUES (?, ?, ?, ?, ?)', (db_path, dir_mtime, dir_stat.st_ino, dir_stat.st_dev, True))
+
+        # Drop folders that no longer exist, and everything in them
+        for name in old_dirs - {entry.name for entry in entries if entry.is_dir()}:
+            removed_path = f'{db_path}/{name}' if db_path else name
+            self._conn.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', (removed_path, len(removed_path) + 1, f'{removed_path}/'))
+            self._conn.execute('DELETE FROM entries WHERE dir = ? OR substr(dir, 1, ?) = ?', (removed_path, len(removed_path) + 1, f'{removed_path}/'))
+
+        self._pending_dirs += 1
+        if self._pending_dirs >= SourceSnapshot.COMMIT_INTERVAL:
+            self._conn.commit()
+            self._pending_dirs = 0
+
+        return entries
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+
+from bin.fileutils import get_file_hash
+from bin.database import open_database
+
+
+class SourceHashCache:
+    """A persistent cache of the hashes of source files, backed by SQLite.
+
+    Each hash is stored under the (st_dev, st_ino) of the file, with the size
+    and mtime the file had when it was hashed. A hash is only used while the
+    file still has the same size and mtime, the same as analysis uses to decide
+    a file hasn't changed. Since the path isn't part of the key, hashes are kept
+    when files are moved or renamed.
+
+    Hashes are saved as a side effect of copying files, so checking a source
+    file against a drive, or looking for copies of it, usually doesn't need to
+    read the file again.
+    """
+
+    # Files changed this recently in seconds may still be changing within the
+    # resolution of their mtime, so their hashes aren't saved
+    RACY_WINDOW = 2
+
+    # Maximum age of a hash in seconds before it's dropped, so that hashes of
+    # files that no longer exist don't build up
+    MAX_AGE = 90 * 24 * 60 * 60
+
+    # Number of hashes to save between commits
+    COMMIT_INTERVAL = 500
+
+    def __init__(self, filename):
+        """Open a source hash cache, creating it if it doesn't exist.
+
+        Args:
+            filename (String): The path of the cache file.
+        """
+
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._pending_hashes = 0
+
+        self._conn = open_database(self.filename, self._init_database)
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM files WHERE hashed < ?', (time.time() - SourceHashCache.MAX_AGE,))
+
+    def _init_database(self, conn: sqlite3.Connection):
+        """Set up a new connection to the cache, and create the tables if needed.
+
+        Args:
+            conn (sqlite3.Connection): The new connection.
+        """
+
+        # The cache can always be rebuilt from the sources, so favor speed over durability
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('''CREATE TABLE IF NOT EXISTS files (
+            dev INTEGER,
+            inode INTEGER,
+            size INTEGER,
+            mtime_ns INTEGER,
+            digest TEXT,
+            hashed REAL,
+            PRIMARY KEY (dev, inode)
+        ) WITHOUT ROWID''')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_hashed ON files (hashed)')
+        conn.commit()
+
+    def commit(self):
+        """Commit any hashes that haven't been saved yet."""
+
+        with self._lock:
+            self._conn.commit()
+            self._pending_hashes = 0
+
+    def close(self):
+        """Commit any changes, and close the cache."""
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def lookup(self, filename) -> tuple:
+        """Get the saved hash of a file, if it hasn't changed since it was hashed.
+
+        Args:
+            filename (String): The file to look up.
+
+        Returns:
+            tuple:
+                os.stat_result: The stats of the file, or None if it can't be read.
+                String: The hash of the file, or None if there's no valid hash saved.
+        """
+
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return (None, None)
+
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime_ns, digest FROM files WHERE dev = ? AND inode = ?', (file_stat.st_dev, file_stat.st_ino)).fetchone()
+
+        if row is None or row[:2] != (file_stat.st_size, file_stat.st_mtime_ns):
+            return (file_stat, None)
+
+        return (file_stat, row[2])
+
+    def add(self, filename, file_stat, digest):
+        """Save the hash of a file.
+
+        The hash is only saved if the file still has the stats it had before it
+        was hashed, and wasn't changed too recently to be sure of that.
+
+        Args:
+            filename (String): The file that was hashed.
+            file_stat (os.stat_result): The stats of the file from before it was hashed.
+            digest (String): The hash of the file.
+        """
+
+        if file_stat is None or not digest:
+            return
+
+        try:
+            current_stat = os.stat(filename)
+        except OSError:
+            return
+
+        if (current_stat.st_dev, current_stat.st_ino, current_stat.st_size, current_stat.st_mtime_ns) != (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns):
+            return
+
+        now = time.time()
+        if now - file_stat.st_mtime < SourceHashCache.RACY_WINDOW:
+            return
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO files (dev, inode, size, mtime_ns, digest, hashed) VALUES (?, ?, ?, ?, ?, ?)',
+                               (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns, digest, now))
+
+            self._pending_hashes += 1
+            if self._pending_hashes >= SourceHashCache.COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending_hashes = 0
+
+    def get_file_hash(self, filename, kill_flag) -> str:
+        """Get the hash of a file, reading it only if there's no valid hash saved.
+
+        Args:
+            filename (String): The file to get the hash of.
+            kill_flag (function): The function to get a kill flag.
+
+        Returns:
+            String: The blake3 hash of the file if readable, as in get_file_hash().
+        """
+
+        file_stat, digest = self.lookup(filename)
+        if digest is not None:
+            return digest
+
+        digest = get_file_hash(filename, kill_flag)
+        self.add(filename, file_stat, digest)
+
+        return digest
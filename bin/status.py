@@ -33,6 +33,7 @@ class Status:
     FILE_OPERATION_COPY = 0x31
     FILE_OPERATION_VERIFY = 0x32
     FILE_OPERATION_UPDATE = 0x33
+    FILE_OPERATION_MOVE = 0x34
     FILE_OPERATION_SUCCESS = 0x3e
     FILE_OPERATION_FAILED = 0x3f
 
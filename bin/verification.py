@@ -0,0 +1,404 @@
+import os
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from bin.fileutils import FileUtils, human_filesize, get_file_hash, get_file_chunks, do_delete
+from bin.hashstore import HashStore
+from bin.manifest import DriveManifest
+
+
+class Verification:
+    """Check the files on a set of destination drives against their saved hashes.
+
+    Each drive is checked on its own worker, so the drives are read at the same
+    time, and the whole run takes as long as the slowest drive. Within a drive,
+    files are hashed on a pool of file_workers threads, which should be left at
+    1 for spinning drives, and can be raised for SSDs.
+
+    Results are put on a queue as each file is checked, to be read by the UI
+    with get_results(), and changes to the hash catalog of each drive are
+    written in batches.
+
+    Verification can also be run as a rolling scrub, where each run only checks
+    the files that have gone the longest since they were last verified, up to a
+    size limit for each drive. Files are checked oldest first, so a scrub that's
+    stopped picks up where it left off on the next run, and running a scrub
+    regularly covers every file over time.
+    """
+
+    # Number of checked files to hold before writing them to a drive's hash catalog
+    COMMIT_INTERVAL = 200
+
+    def __init__(self, drives: list, backup_config_dir, verify_all_files: bool = False, file_workers: int = 1,
+                 scrub_size: int = 0, scrub_percent: float = 0, scrub_cycle: float = 0, io_budget: int = 0):
+        """Configure a verification to be run on a set of drives.
+
+        The verification is run as a rolling scrub if any of the scrub options
+        are set, and checks every file otherwise.
+
+        Args:
+            drives (String[]): The mountpoints of the drives to check.
+            backup_config_dir (String): The directory backup configs are stored in on each drive.
+            verify_all_files (bool): Whether to check every file on the drives, and save hashes
+                for files that don't have one, instead of only files with saved hashes (default: False).
+            file_workers (int): The number of files to hash at once on each drive (default: 1).
+            scrub_size (int): The most data in bytes to check on each drive in a scrub (optional).
+            scrub_percent (float): The most data to check on each drive in a scrub, as a
+                percentage of the data with saved hashes (optional). If both limits are set,
+                the larger one is used.
+            scrub_cycle (float): The time in seconds after which a file is due to be
+                checked again in a scrub (optional).
+            io_budget (int): The most data in bytes per second to read from each drive (optional).
+        """
+
+        self.drives = drives
+        self.verify_all_files = verify_all_files
+        self.file_workers = max(1, file_workers)
+        self.scrub_size = scrub_size
+        self.scrub_percent = scrub_percent
+        self.scrub_cycle = scrub_cycle
+        self.io_budget = io_budget
+
+        self.BACKUP_CONFIG_DIR = backup_config_dir
+        self.BACKUP_HASH_FILE = HashStore.FILENAME
+        self.BACKUP_MANIFEST_FILE = DriveManifest.FILENAME
+        self.SPECIAL_IGNORE_LIST = [self.BACKUP_CONFIG_DIR] + FileUtils.SYSTEM_IGNORE_LIST
+
+        self.results = queue.SimpleQueue()
+        self.current_file = None
+        self.failed_list = []
+        self.running = False
+        self.killed = False
+
+        self._lock = threading.Lock()
+
+    def kill(self):
+        """Stop the verification once the files being hashed are done."""
+
+        self.killed = True
+
+    def get_results(self) -> list:
+        """Get the results that have come in since the last call.
+
+        Returns:
+            tuple[]: The list each file belongs in, the full path of the file, and the error
+                if the file failed, or None.
+        """
+
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        return results
+
+    def run(self):
+        """Check all drives, with one worker for each drive."""
+
+        self.running = True
+        self.killed = False
+        self.failed_list = []
+
+        if self.drives:
+            with ThreadPoolExecutor(max_workers=len(self.drives), thread_name_prefix='Verify Drive') as executor:
+                drive_workers = [executor.submit(self.verify_drive, drive) for drive in self.drives]
+
+                # Wait for all drives, and raise any exceptions from the workers
+                for worker in drive_workers:
+                    worker.result()
+
+        self.current_file = None
+        self.running = False
+
+    def _walk_drive(self, drive):
+        """List every file on a drive, skipping ignored folders.
+
+        Args:
+            drive (String): The mountpoint of the drive.
+
+        Yields:
+            tuple: The path of the file relative to the drive, and its full path.
+        """
+
+        path_list = [drive]
+        while path_list and not self.killed:
+            path = path_list.pop()
+            try:
+                entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+            except OSError:
+                continue
+
+            dir_list = []
+            for entry in entries:
+                path_stub = entry.path[len(drive):].strip(os.path.sep)
+                try:
+                    if entry.is_file():
+                        yield (path_stub, entry.path)
+                    elif entry.is_dir() and path_stub not in self.SPECIAL_IGNORE_LIST:
+                        dir_list.append(entry.path)
+                except OSError:
+                    continue
+
+            path_list.extend(reversed(dir_list))
+
+    @property
+    def is_scrub(self) -> bool:
+        return bool(self.scrub_size or self.scrub_percent or self.scrub_cycle)
+
+    def _list_scrub_files(self, drive, hash_store: HashStore):
+        """List the files on a drive that are due to be checked in a scrub.
+
+        Files without a saved hash are listed first if verify_all_files is set,
+        followed by the files with saved hashes, oldest verified first, until
+        the size limit for the scrub is reached.
+
+        Args:
+            drive (String): The mountpoint of the drive.
+            hash_store (HashStore): The hash catalog of the drive.
+
+        Yields:
+            tuple: The path of the file relative to the drive, its full path, and its size.
+        """
+
+        scrub_limit = max(self.scrub_size, int(hash_store.get_total_size() * self.scrub_percent / 100))
+        if not scrub_limit:
+            scrub_limit = float('inf')
+
+        # Files checked in this scrub are skipped, along with files that aren't due yet
+        verified_before = time.time()
+        if self.scrub_cycle:
+            verified_before -= self.scrub_cycle
+
+        scrub_total = 0
+
+        if self.verify_all_files:
+            for path_stub, filename in self._walk_drive(drive):
+                if scrub_total >= scrub_limit:
+                    return
+
+                if path_stub not in hash_store:
+                    try:
+                        size = os.path.getsize(filename)
+                    except OSError:
+                        continue
+
+                    scrub_total += size
+                    yield (path_stub, filename, size)
+
+        for path_stub, saved_hash, size in hash_store.items_by_last_verified(verified_before):
+            if scrub_total >= scrub_limit:
+                return
+
+            scrub_total += size if size is not None else 0
+            yield (path_stub, os.path.join(drive, path_stub), size)
+
+    def _wait_for_io_budget(self, bytes_read: int, start_time: float):
+        """Wait until reading from a drive is back under the I/O budget.
+
+        Args:
+            bytes_read (int): The number of bytes read from the drive so far.
+            start_time (float): The time reading from the drive started.
+        """
+
+        if not self.io_budget:
+            return
+
+        delay = bytes_read / self.io_budget - (time.monotonic() - start_time)
+        while delay > 0 and not self.killed:
+            time.sleep(min(delay, 0.5))
+            delay = bytes_read / self.io_budget - (time.monotonic() - start_time)
+
+    def verify_drive(self, drive):
+        """Check the files on a single drive.
+
+        Args:
+            drive (String): The mountpoint of the drive.
+        """
+
+        hash_store = HashStore(os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_HASH_FILE), root=drive)
+        hash_store.prune(drive, self.SPECIAL_IGNORE_LIST)
+
+        if self.is_scrub:
+            file_list = self._list_scrub_files(drive, hash_store)
+        elif self.verify_all_files:
+            file_list = ((path_stub, filename, None) for path_stub, filename in self._walk_drive(drive))
+        else:
+            file_list = ((path_stub, os.path.join(drive, path_stub), None) for path_stub, saved_hash in hash_store.items())
+
+        verified_list = []
+        new_hash_list = {}
+
+        def handle_result(path_stub, filename, file_list_name, file_hash, error):
+            """Queue the result of a checked file, and save its hash in the next batch.
+
+            Args:
+                path_stub (String): The path of the file, relative to the drive.
+                filename (String): The full path of the file.
+                file_list_name (String): The list the file belongs in, or None if it
+                    had no saved hash, or wasn't checked.
+                file_hash (String): The computed hash of the file.
+                error (String): The error to report if the file failed.
+            """
+
+            if file_list_name == FileUtils.LIST_SUCCESS:
+                verified_list.append(path_stub)
+            elif file_list_name is None and file_hash is not None:
+                new_hash_list[path_stub] = file_hash
+
+            if file_list_name is not None:
+                if file_list_name == FileUtils.LIST_FAIL:
+                    with self._lock:
+                        self.failed_list.append(filename)
+                self.results.put((file_list_name, filename, error))
+
+            if len(verified_list) + len(new_hash_list) >= Verification.COMMIT_INTERVAL:
+                hash_store.mark_verified(verified_list)
+                hash_store.update(new_hash_list)
+                verified_list.clear()
+                new_hash_list.clear()
+
+        # Keep a few files queued for each worker, so that workers aren't left idle,
+        # without listing the whole drive up front
+        max_pending = 2 * self.file_workers
+        pending = set()
+
+        bytes_read = 0
+        start_time = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.file_workers, thread_name_prefix='Verify File') as executor:
+            for path_stub, filename, size in file_list:
+                if self.killed:
+                    break
+
+                if self.io_budget:
+                    if size is None:
+                        try:
+                            size = os.path.getsize(filename)
+                        except OSError:
+                            size = 0
+
+                    self._wait_for_io_budget(bytes_read, start_time)
+                    bytes_read += size
+                elif size is not None:
+                    bytes_read += size
+
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle_result(*future.result())
+
+                pending.add(executor.submit(self.verify_file, hash_store, drive, path_stub, filename))
+
+            for future in pending:
+                handle_result(*future.result())
+
+        hash_store.mark_verified(verified_list)
+        hash_store.update(new_hash_list)
+        hash_store.close()
+
+        if self.is_scrub:
+            logging.info('Scrubbed %s on %s', human_filesize(bytes_read), drive)
+
+    def verify_file(self, hash_store: HashStore, drive, path_stub, filename) -> tuple:
+        """Check a file against its saved hash, and handle it if it's corrupted.
+
+        Files with saved chunk digests are checked a chunk at a time, and only
+        the corrupted ranges are marked to be rewritten by the next backup. Other
+        corrupted files are deleted, so they're copied again in full.
+
+        Files with no saved hash are hashed, so that the hash can be saved. So
+        are files whose size or mtime changed since they were hashed, like files
+        left partly written by a stopped backup, since they're not corrupt. Files
+        with bad chunks waiting to be rewritten by the next backup are skipped.
+
+        Args:
+            hash_store (HashStore): The hash catalog of the drive.
+            drive (String): The mountpoint of the drive.
+            path_stub (String): The path of the file, relative to the drive.
+            filename (String): The full path of the file.
+
+        Returns:
+            tuple: The path_stub and filename, the list the file belongs in, the computed hash,
+                and the error if the file failed. The list is None if the file had no saved
+                hash, or the verification was stopped.
+        """
+
+        self.current_file = filename
+
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return (path_stub, filename, None, None, None)
+
+        record = hash_store.get_record(path_stub)
+        saved_hash = record['digest'] if record is not None else None
+        if record is not None and record['size'] is not None and (record['size'], record['mtime_ns']) != (file_stat.st_size, file_stat.st_mtime_ns):
+            saved_hash = None
+
+        if saved_hash is None:
+            # Files with bad chunks are left to be repaired by the next backup, and
+            # hashing them before then would save the corrupted data as good
+            saved_chunks = hash_store.get_chunks(path_stub, file_stat.st_size, file_stat.st_mtime_ns)
+            if saved_chunks is not None and bytes(HashStore.CHUNK_DIGEST_SIZE) in saved_chunks[1]:
+                return (path_stub, filename, None, None, None)
+
+            file_hash = get_file_hash(filename, lambda: self.killed, bypass_cache=FileUtils.VERIFY_BYPASS_CACHE)
+            return (path_stub, filename, None, file_hash if not self.killed else None, None)
+
+        saved_chunks = hash_store.get_chunks(path_stub, file_stat.st_size, file_stat.st_mtime_ns)
+        if saved_chunks is not None and saved_chunks[0] == FileUtils.CHUNK_SIZE:
+            saved_chunks = saved_chunks[1]
+            computed_hash, chunk_digests = get_file_chunks(filename, lambda: self.killed, bypass_cache=FileUtils.VERIFY_BYPASS_CACHE)
+        else:
+            saved_chunks = None
+            computed_hash = get_file_hash(filename, lambda: self.killed, bypass_cache=FileUtils.VERIFY_BYPASS_CACHE)
+
+        if self.killed:
+            return (path_stub, filename, None, None, None)
+
+        if computed_hash == saved_hash:
+            return (path_stub, filename, FileUtils.LIST_SUCCESS, computed_hash, None)
+
+        bad_chunks = [i for i, digest in enumerate(chunk_digests) if i >= len(saved_chunks) or digest != saved_chunks[i]] if saved_chunks is not None else []
+        if bad_chunks:
+            # Merge neighboring bad chunks into byte ranges to report
+            bad_ranges = []
+            for i in bad_chunks:
+                start = i * FileUtils.CHUNK_SIZE
+                end = min(start + FileUtils.CHUNK_SIZE, file_stat.st_size)
+                if bad_ranges and bad_ranges[-1][1] == start:
+                    bad_ranges[-1][1] = end
+                else:
+                    bad_ranges.append([start, end])
+
+            try:
+                # Touch the file so the next backup updates it, and drop the digests of
+                # the bad chunks so that only they're rewritten. The whole file hash is
+                # dropped too, since it no longer matches what's on the drive
+                os.utime(filename)
+                hash_store.set_chunks(path_stub, FileUtils.CHUNK_SIZE, [bytes(HashStore.CHUNK_DIGEST_SIZE) if i in bad_chunks else digest for i, digest in enumerate(saved_chunks)])
+                hash_store.delete([path_stub], keep_chunks=True)
+
+                drive_manifest = DriveManifest(os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_MANIFEST_FILE), root=drive)
+                drive_manifest.add_files([path_stub])
+                drive_manifest.close()
+
+                return (path_stub, filename, FileUtils.LIST_FAIL, computed_hash, f"File hash mismatch in bytes {', '.join(f'{start}-{end - 1}' for start, end in bad_ranges)}")
+            except OSError:
+                pass
+
+        # Computed hash different from saved, so delete corrupted file, and the saved hash
+        do_delete(filename)
+        hash_store.delete([path_stub])
+
+        # Drop the file from the manifest too, so the next analysis copies it again
+        drive_manifest = DriveManifest(os.path.join(drive, self.BACKUP_CONFIG_DIR, self.BACKUP_MANIFEST_FILE), root=drive)
+        drive_manifest.remove([path_stub])
+        drive_manifest.close()
+
+        return (path_stub, filename, FileUtils.LIST_FAIL, computed_hash, 'File hash mismatch')